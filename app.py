@@ -1,106 +1,266 @@
 import os
-from lightning_app import LightningWork, LightningApp, LightningFlow
-from lightning_app.structures import List
-import subprocess
 import time
-import webbrowser
-from dotenv import load_dotenv
-from model_manager import ModelManager, ModelType
-from civitai_client import CivitaiClient, CivitaiModel
-from huggingface_client import HuggingFaceClient, HuggingFaceModel
-from web_ui import app as web_app
-import uvicorn
-import threading
-from lightning_studio import StudioFlow, LightningConfig, StudioUI
-from pathlib import Path
-from lightning.app.storage import Drive
+import logging
+# Imported first: the startup profiler measures from here
+from metrics import STARTUP
+
+with STARTUP.phase("imports"):
+    import subprocess
+    import threading
+    import urllib.request
+    from pathlib import Path
+    from typing import TYPE_CHECKING, Optional
+    from dotenv import load_dotenv
+    from lightning_app import LightningWork, LightningApp, LightningFlow
+    from lightning_app.structures import List
+    from lightning.app.storage import Drive
+    from lightning_studio import StudioFlow, LightningConfig, StudioUI
+    from model_manager import ModelInfo, ModelManager, ModelType
+    from prefetch import prefetcher_from_env
+    from metrics import DRIVE_SYNC_DURATION, TRACER
+    from status_hub import HUB
+    from bundles import BundleStore, store_from_env
+    from peers import PeerNode, peers_from_env
+    from catalog import IndexUploader
+
+# The model-source clients, the FastAPI app, uvicorn and webbrowser are
+# imported on first use so health checks answer before they load
+if TYPE_CHECKING:
+    from civitai_client import CivitaiClient, CivitaiModel
+    from huggingface_client import HuggingFaceClient, HuggingFaceModel
 
 load_dotenv()
 
+if STARTUP.verbose:
+    logging.basicConfig(level=logging.INFO)
+
 class ComfyUIWork(LightningWork):
     def __init__(self):
         # Request GPU and set parallel to True for concurrent execution
         super().__init__(cloud_compute={"gpu": "T4", "name": "gpu-small-t4"}, parallel=True)
         self.ready = False
         self._model_manager = ModelManager()
-        self._civitai = CivitaiClient(os.getenv("CIVITAI_API_KEY"))
-        self._huggingface = HuggingFaceClient(os.getenv("HUGGINGFACE_TOKEN"))
-        self.web_port = 8000
+        self._civitai_client = None
+        self._huggingface_client = None
+        self._comfy_process = None
+        self.web_port = 7860
         self.comfy_port = 8188
         self.browsers_opened = False
         self._config = LightningConfig.from_env()
         self.lightning_port = self._config.port
         # Create a drive for persistent model storage
         self.model_drive = Drive("model_storage")
+        self._bundles = None
+        self._peers = None
+        self._index_uploader = None
 
     def run(self):
         print("🚀 Starting ComfyUI setup...")
-        
-        # Create necessary directories
-        models_root = Path("models")
-        models_root.mkdir(exist_ok=True)
-        for model_type in ["checkpoints", "loras", "controlnet", "vae"]:
-            (models_root / model_type).mkdir(exist_ok=True)
+
+        # Serve the API first: health checks and the model catalog don't need ComfyUI
+        HUB.component("comfyui", "starting")
+        with STARTUP.phase("web_server"):
+            self._start_web_server()
+        if self.peers is not None:
+            print(f"🔗 Sharing models with {len(self.peers.peers)} peer instance(s)")
             
-        # Restore models from persistent storage if they exist
-        if self.model_drive.exists("models"):
+        # Restore models from persistent storage: the catalog and the most-used
+        # models first, everything else in the background
+        index_path = "models/model_index.json"
+        if self.model_drive.exists(index_path):
+            print("📥 Restoring popular models from storage...")
+            HUB.component("comfyui", "restoring")
+            with STARTUP.phase("drive_restore"):
+                self._drive_get(index_path)
+                self._model_manager.reload()
+                if self.bundles is not None:
+                    self.bundles.load()
+            with STARTUP.phase("prefetch"):
+                # Warm the variants generation will actually load, as the idle prefetcher does
+                from web_ui import select_model
+                prefetcher_from_env(self._model_manager, self.restore_model, select_model).prefetch()
+            threading.Thread(target=self._restore_remaining_models, daemon=True).start()
+        elif self.model_drive.exists("models"):
             print("📥 Restoring models from storage...")
-            self.model_drive.get("models", "models")
+            HUB.component("comfyui", "restoring")
+            with STARTUP.phase("drive_restore"), DRIVE_SYNC_DURATION.time(operation="restore"), TRACER.span("drive.get", path="models"):
+                self.model_drive.get("models", "models")
+
+        # From here on every index save (catalog changes, usage flushes) goes back to the Drive
+        self._index_uploader = IndexUploader(self.model_drive, self._model_manager)
+        self._index_uploader.start()
             
         # Clone ComfyUI if not present
         if not Path("ComfyUI").exists():
             print("📦 Cloning ComfyUI repository...")
-            subprocess.run(
-                ["git", "clone", "https://github.com/comfyanonymous/ComfyUI.git"],
-                check=True
-            )
+            HUB.component("comfyui", "cloning")
+            with STARTUP.phase("comfyui_clone"):
+                subprocess.run(
+                    ["git", "clone", "https://github.com/comfyanonymous/ComfyUI.git"],
+                    check=True
+                )
             
+        # One catalog for the web app and ComfyUI: adopt files dropped into
+        # ComfyUI/models or older folder layouts, then point ComfyUI at models/
+        with STARTUP.phase("catalog_sync"):
+            self._model_manager.sync_directory([os.path.join("ComfyUI", "models")])
+            self._model_manager.write_extra_model_paths("ComfyUI")
+
         # Install ComfyUI dependencies
         print("📚 Installing ComfyUI requirements...")
-        subprocess.run(
-            ["pip", "install", "-r", "ComfyUI/requirements.txt"],
-            check=True
-        )
+        HUB.component("comfyui", "installing")
+        with STARTUP.phase("dependency_install"):
+            subprocess.run(
+                ["pip", "install", "-r", "ComfyUI/requirements.txt"],
+                check=True
+            )
         
         # Start ComfyUI server
         print("✨ Starting ComfyUI server...")
+        HUB.component("comfyui", "booting")
+        with STARTUP.phase("comfyui_boot"):
+            self._comfy_process = subprocess.Popen(
+                [
+                    "python", "main.py",
+                    "--listen", "0.0.0.0",
+                    "--port", str(self.comfy_port),
+                    "--enable-cors-header"
+                ],
+                cwd="ComfyUI"
+            )
+            self._wait_for_comfyui()
         self.ready = True
-        os.chdir("ComfyUI")
-        subprocess.run([
-            "python", "main.py",
-            "--listen", "0.0.0.0",
-            "--port", "8188",
-            "--enable-cors-header"
-        ])
-        
-        # Initialize web app
-        web_app.comfy_ui = self
-        
-        # Start web server in a separate thread
-        web_thread = threading.Thread(
-            target=uvicorn.run,
-            args=(web_app,),
-            kwargs={
-                "host": "0.0.0.0",
-                "port": self.web_port,
-                "log_level": "info"
-            },
-            daemon=True
-        )
-        web_thread.start()
-        
-        # Wait for servers to be ready
-        time.sleep(5)  # Give servers time to start
+        HUB.component("comfyui", "ready", port=self.comfy_port)
+        STARTUP.mark("first_ready")
+        if STARTUP.verbose:
+            print(STARTUP.summary())
 
         # Open browsers if not already opened
         if not self.browsers_opened:
+            import webbrowser
             print("Opening interfaces in your browser...")
             webbrowser.open(f"http://127.0.0.1:{self.comfy_port}")  # ComfyUI
             webbrowser.open(f"http://127.0.0.1:{self.web_port}")    # Web UI
             self.browsers_opened = True
         
-        while True:
-            time.sleep(1)
+        # Blocks until ComfyUI exits; nothing here needs to wake up in between
+        exit_code = self._comfy_process.wait()
+        self.ready = False
+        HUB.component("comfyui", "stopped", exit_code=exit_code)
+
+    def _start_web_server(self):
+        """Run the FastAPI app in a background thread and wait until it is listening"""
+        from web_ui import serve
+        serve(self, self.web_port, background=True)
+
+    def _wait_for_comfyui(self, timeout: float = 600.0):
+        """Poll ComfyUI until it answers HTTP; fail as soon as the process exits"""
+        url = f"http://127.0.0.1:{self.comfy_port}/system_stats"
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                with urllib.request.urlopen(url, timeout=2) as response:
+                    if response.status == 200:
+                        return
+            except OSError:
+                pass
+            # Waiting on the process rather than sleeping returns the moment it dies
+            try:
+                self._comfy_process.wait(timeout=0.5)
+            except subprocess.TimeoutExpired:
+                continue
+            HUB.component("comfyui", "stopped", exit_code=self._comfy_process.returncode)
+            raise RuntimeError(f"ComfyUI exited with code {self._comfy_process.returncode}")
+        raise RuntimeError(f"ComfyUI did not become ready within {timeout:.0f}s")
+
+    @property
+    def bundles(self) -> Optional["BundleStore"]:
+        """Drive bundles for small model files; None when FLUX_BUNDLE_MAX_FILE_BYTES=0"""
+        if self._bundles is None:
+            self._bundles = store_from_env(self.model_drive, self._model_paths)
+            if self._bundles is not None:
+                self._bundles.start()
+        return self._bundles
+
+    @property
+    def peers(self) -> Optional["PeerNode"]:
+        """Model files shared with sibling instances; None unless FLUX_PEER_TOKEN is set"""
+        if self._peers is None:
+            self._peers = peers_from_env(self._model_manager)
+            if self._peers is not None:
+                self._peers.start()
+        return self._peers
+
+    def _model_paths(self):
+        return [model.path for model in list(self._model_manager.models.values())]
+
+    def _drive_get(self, path: str):
+        with DRIVE_SYNC_DURATION.time(operation="restore"), TRACER.span("drive.get", path=path):
+            self.model_drive.get(path, overwrite=True)
+
+    def persist_index(self):
+        """Upload the catalog index now, e.g. at shutdown"""
+        if self._index_uploader is not None:
+            self._index_uploader.upload()
+
+    def is_persisted(self, model: ModelInfo) -> bool:
+        """Only models with a copy on the Drive may be evicted from local disk"""
+        if self.bundles is not None and self.bundles.contains(model.path):
+            return True
+        return self.model_drive.exists(model.path)
+
+    def persist_model(self, model: ModelInfo):
+        """Copy a newly added model to the persistent Drive; small files are queued for a bundle"""
+        if self.bundles is not None and self.bundles.accepts(model.path):
+            self.bundles.add(model.path)
+            return
+        with DRIVE_SYNC_DURATION.time(operation="upload"), TRACER.span("drive.put", path=model.path):
+            self.model_drive.put(model.path, model.path)
+
+    def restore_model(self, model: ModelInfo):
+        """Fetch one catalogued model file from a peer instance or the persistent Drive"""
+        if self.peers is not None and self.peers.fetch_model(model):
+            return
+        if self.bundles is not None and self.bundles.restore_member(model.path):
+            return
+        if self.model_drive.exists(model.path):
+            self._drive_get(model.path)
+
+    def _restore_remaining_models(self):
+        if self.peers is not None:
+            # Siblings that already have a file spare the Drive the transfer
+            self.peers.restore(list(self._model_manager.models.values()))
+        if self.bundles is not None:
+            # One transfer per bundle instead of one per small file
+            try:
+                self.bundles.restore()
+            except Exception as e:
+                print(f"Failed to restore bundled models: {e}")
+            self.bundles.clear_cache()
+        for model in list(self._model_manager.models.values()):
+            if not os.path.exists(model.path):
+                try:
+                    self.restore_model(model)
+                except Exception as e:
+                    print(f"Failed to restore {model.name}: {e}")
+
+    @property
+    def model_manager(self) -> ModelManager:
+        return self._model_manager
+
+    @property
+    def _civitai(self) -> "CivitaiClient":
+        if self._civitai_client is None:
+            from civitai_client import CivitaiClient
+            self._civitai_client = CivitaiClient(os.getenv("CIVITAI_API_KEY"))
+        return self._civitai_client
+
+    @property
+    def _huggingface(self) -> "HuggingFaceClient":
+        if self._huggingface_client is None:
+            from huggingface_client import HuggingFaceClient
+            self._huggingface_client = HuggingFaceClient(os.getenv("HUGGINGFACE_TOKEN"))
+        return self._huggingface_client
 
     def add_model(self, name: str, model_type: ModelType, source: str, file_path: str, metadata: dict = None):
         """Add a model to the manager"""
@@ -114,7 +274,7 @@ class ComfyUIWork(LightningWork):
         """Search for models on Civitai"""
         return self._civitai.search_models(query, model_type, nsfw, limit)
 
-    def download_civitai_model(self, model: CivitaiModel) -> str:
+    def download_civitai_model(self, model: "CivitaiModel") -> str:
         """Download a model from Civitai and add it to the model manager"""
         return self._civitai.download_model(model)
 
@@ -122,213 +282,14 @@ class ComfyUIWork(LightningWork):
         """Search for models on Hugging Face"""
         return self._huggingface.search_models(query, model_type, flux_only, limit)
 
-    def download_huggingface_model(self, model: HuggingFaceModel) -> str:
+    def download_huggingface_model(self, model: "HuggingFaceModel") -> str:
         """Download a model from Hugging Face and add it to the model manager"""
         return self._huggingface.download_model(model.id)
 
-class WebUI(LightningWork):
-    def __init__(self):
-        super().__init__(parallel=True)
-        self.ready = False
-        self.model_drive = Drive("model_storage")
-        
-    def run(self):
-        from flask import Flask, request, jsonify, render_template_string
-        
-        app = Flask(__name__)
-        
-        # Simple HTML template for the web interface
-        INDEX_HTML = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>FLUX Studio</title>
-            <link href="https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css" rel="stylesheet">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        </head>
-        <body class="bg-gray-100">
-            <div class="container mx-auto px-4 py-8">
-                <h1 class="text-4xl font-bold mb-8">FLUX Studio</h1>
-                
-                <!-- Quick Links -->
-                <div class="bg-white rounded-lg shadow-md p-6 mb-8">
-                    <h2 class="text-2xl font-semibold mb-4">Quick Links</h2>
-                    <div class="space-y-4">
-                        <a href="/proxy/8188" target="_blank" 
-                           class="block bg-blue-500 text-white px-4 py-2 rounded text-center hover:bg-blue-600">
-                            Open ComfyUI Interface
-                        </a>
-                    </div>
-                </div>
-                
-                <!-- Model Upload -->
-                <div class="bg-white rounded-lg shadow-md p-6 mb-8">
-                    <h2 class="text-2xl font-semibold mb-4">Upload Model</h2>
-                    <form id="uploadForm" class="space-y-4">
-                        <div>
-                            <label class="block text-sm font-medium text-gray-700">Model Type</label>
-                            <select id="modelType" class="mt-1 block w-full pl-3 pr-10 py-2 text-base border-gray-300 focus:outline-none focus:ring-blue-500 focus:border-blue-500 sm:text-sm rounded-md">
-                                <option value="checkpoints">Checkpoint</option>
-                                <option value="loras">LoRA</option>
-                                <option value="controlnet">ControlNet</option>
-                                <option value="vae">VAE</option>
-                            </select>
-                        </div>
-                        <div>
-                            <label class="block text-sm font-medium text-gray-700">Model File</label>
-                            <input type="file" id="modelFile" class="mt-1 block w-full">
-                        </div>
-                        <button type="submit" class="bg-green-500 text-white px-4 py-2 rounded hover:bg-green-600">
-                            Upload Model
-                        </button>
-                    </form>
-                </div>
-                
-                <!-- Model List -->
-                <div class="bg-white rounded-lg shadow-md p-6">
-                    <h2 class="text-2xl font-semibold mb-4">Available Models</h2>
-                    <div id="modelList" class="space-y-4"></div>
-                </div>
-            </div>
-            
-            <script>
-                // Load models on page load
-                loadModels();
-                
-                // Handle form submission
-                document.getElementById('uploadForm').addEventListener('submit', async (e) => {
-                    e.preventDefault();
-                    const formData = new FormData();
-                    const modelFile = document.getElementById('modelFile').files[0];
-                    const modelType = document.getElementById('modelType').value;
-                    
-                    formData.append('model', modelFile);
-                    formData.append('type', modelType);
-                    
-                    try {
-                        const response = await fetch('/api/upload', {
-                            method: 'POST',
-                            body: formData
-                        });
-                        const result = await response.json();
-                        alert(result.message || result.error);
-                        if (!result.error) {
-                            loadModels();
-                            document.getElementById('modelFile').value = '';
-                        }
-                    } catch (error) {
-                        alert('Error uploading model');
-                    }
-                });
-                
-                // Load and display models
-                async function loadModels() {
-                    try {
-                        const response = await fetch('/api/models');
-                        const data = await response.json();
-                        const modelList = document.getElementById('modelList');
-                        
-                        if (data.models.length === 0) {
-                            modelList.innerHTML = '<p class="text-gray-500">No models available</p>';
-                            return;
-                        }
-                        
-                        // Group models by type
-                        const modelsByType = {};
-                        data.models.forEach(model => {
-                            if (!modelsByType[model.type]) {
-                                modelsByType[model.type] = [];
-                            }
-                            modelsByType[model.type].push(model);
-                        });
-                        
-                        // Display models
-                        modelList.innerHTML = Object.entries(modelsByType).map(([type, models]) => `
-                            <div class="mb-4">
-                                <h3 class="text-lg font-medium mb-2">${type.charAt(0).toUpperCase() + type.slice(1)}</h3>
-                                <div class="space-y-2">
-                                    ${models.map(model => `
-                                        <div class="flex items-center justify-between border p-2 rounded">
-                                            <span>${model.name}</span>
-                                            <span class="text-gray-500">${formatSize(model.size)}</span>
-                                        </div>
-                                    `).join('')}
-                                </div>
-                            </div>
-                        `).join('');
-                    } catch (error) {
-                        console.error('Error loading models:', error);
-                    }
-                }
-                
-                // Format file size
-                function formatSize(bytes) {
-                    const units = ['B', 'KB', 'MB', 'GB'];
-                    let size = bytes;
-                    let unitIndex = 0;
-                    while (size >= 1024 && unitIndex < units.length - 1) {
-                        size /= 1024;
-                        unitIndex++;
-                    }
-                    return `${size.toFixed(1)} ${units[unitIndex]}`;
-                }
-            </script>
-        </body>
-        </html>
-        """
-        
-        @app.route('/')
-        def index():
-            return render_template_string(INDEX_HTML)
-            
-        @app.route('/api/models')
-        def list_models():
-            models = []
-            models_root = Path("models")
-            if models_root.exists():
-                for model_type in ["checkpoints", "loras", "controlnet", "vae"]:
-                    type_dir = models_root / model_type
-                    if type_dir.exists():
-                        for model in type_dir.iterdir():
-                            if model.is_file():
-                                models.append({
-                                    "name": model.name,
-                                    "type": model_type,
-                                    "size": model.stat().st_size
-                                })
-            return jsonify({"models": models})
-            
-        @app.route('/api/upload', methods=['POST'])
-        def upload_model():
-            if 'model' not in request.files or 'type' not in request.form:
-                return jsonify({"error": "Missing model file or type"}), 400
-                
-            model_file = request.files['model']
-            model_type = request.form['type']
-            
-            if model_file.filename == '':
-                return jsonify({"error": "No file selected"}), 400
-                
-            if model_type not in ["checkpoints", "loras", "controlnet", "vae"]:
-                return jsonify({"error": "Invalid model type"}), 400
-                
-            # Save the model
-            save_path = Path("models") / model_type / model_file.filename
-            model_file.save(save_path)
-            
-            # Save to persistent storage
-            self.model_drive.put(str(save_path), f"models/{model_type}/{model_file.filename}")
-            
-            return jsonify({"message": "Model uploaded successfully"})
-            
-        self.ready = True
-        app.run(host="0.0.0.0", port=7860)
-
 class ImageGenerationFlow(StudioFlow):
     def __init__(self):
         super().__init__()
         self.comfy_ui = ComfyUIWork()
-        self.webui = WebUI()
         self.ui = StudioUI()  # Add UI component
         self.browsers_opened = False
 
@@ -336,14 +297,16 @@ class ImageGenerationFlow(StudioFlow):
         # Run the parent StudioFlow
         super().run()
         
-        # Run ComfyUI component
+        # Run ComfyUI component (it also serves the web app)
         self.comfy_ui.run()
         
-        # Run Web UI component
-        self.webui.run()
-        
-        # Run UI component
-        self.ui.run()
+        # Publish the studio status; the UI work only runs when it changes
+        self.ui.run({
+            "comfy_port": self.comfy_ui.comfy_port,
+            "web_port": self.comfy_ui.web_port,
+            "lightning_port": self.comfy_ui.lightning_port,
+            "ready": self.comfy_ui.ready
+        })
         
         if self.comfy_ui.ready and not self.browsers_opened:
             print("\n=== Servers are ready! ===")
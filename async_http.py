@@ -0,0 +1,111 @@
+import os
+import time
+import asyncio
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, Optional
+from metrics import TRACER, record_download
+
+if TYPE_CHECKING:
+    import aiohttp
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+class SharedSession:
+    """Lazily created aiohttp session shared by all async model-source clients.
+
+    One session means one connection pool, so concurrent searches and downloads
+    against the same host reuse keep-alive connections.
+    """
+
+    def __init__(self, limit: int = 64, limit_per_host: int = 16, timeout: float = 60.0):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self._session: Optional["aiohttp.ClientSession"] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def get(self) -> "aiohttp.ClientSession":
+        """Return the session, creating it on first use in the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            # Imported here so the web server can start answering before aiohttp loads
+            import aiohttp
+            self._loop = loop
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host),
+                # Downloads can run for a long time; only bound connect and per-read stalls
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout)
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+async def stream_to_file(
+    session: "aiohttp.ClientSession",
+    url: str,
+    target_path: str,
+    headers: Dict = None,
+    source: str = "http",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    on_progress: Callable[[int, Optional[int]], None] = None,
+    resume: bool = False,
+    reserve: Optional[Callable[[str, int], Awaitable]] = None
+) -> int:
+    """Stream a URL to disk and return the size of the finished file.
+
+    Each chunk is written before the next one is read, so a slow disk applies
+    backpressure to the socket instead of buffering the file in memory. The
+    data goes to ``<target>.part`` and is renamed on success. Cancellation
+    removes the partial file. With ``resume`` a partial file left by an earlier
+    attempt is continued with a Range request and kept if this attempt fails.
+    With ``reserve`` (e.g. StorageGovernor.reserve_async) the remaining bytes
+    are reserved before anything is written; the reservation is released once
+    the file is complete.
+    """
+    os.makedirs(os.path.dirname(target_path) or ".", exist_ok=True)
+    part_path = target_path + ".part"
+    offset = os.path.getsize(part_path) if resume and os.path.exists(part_path) else 0
+    request_headers = dict(headers or {})
+    if offset:
+        request_headers["Range"] = f"bytes={offset}-"
+    written = offset
+    start = time.perf_counter()
+    try:
+        with TRACER.span(f"{source}.download", url=url, resume_offset=offset) as span:
+            async with session.get(url, headers=request_headers) as response:
+                if offset and response.status == 416:
+                    # Nothing left to fetch: the previous attempt got the whole file
+                    total = offset
+                else:
+                    response.raise_for_status()
+                    if offset and response.status != 206:
+                        # Server ignored the range; start over
+                        offset = written = 0
+                    length = response.content_length
+                    total = offset + length if length is not None else None
+                    reservation = await reserve(target_path, length) if reserve and length else None
+                    try:
+                        with open(part_path, "ab" if offset else "wb") as f:
+                            async for chunk in response.content.iter_chunked(chunk_size):
+                                await asyncio.to_thread(f.write, chunk)
+                                written += len(chunk)
+                                if on_progress:
+                                    on_progress(written, total)
+                    finally:
+                        if reservation is not None:
+                            reservation.release()
+            if span:
+                span.set_attribute("bytes", written - offset)
+        os.replace(part_path, target_path)
+    except asyncio.CancelledError:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    except BaseException:
+        if not resume and os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    record_download(source, written - offset, time.perf_counter() - start)
+    return written
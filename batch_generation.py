@@ -0,0 +1,172 @@
+import time
+import uuid
+import asyncio
+import itertools
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+from metrics import QUEUE_DEPTH
+
+@dataclass
+class BatchSpec:
+    """A prompt matrix / parameter grid; every combination becomes one job"""
+    prompts: List[str]
+    models: List[str]
+    negative_prompt: str = ""
+    seeds: List[Optional[int]] = field(default_factory=lambda: [None])
+    steps: List[int] = field(default_factory=lambda: [20])
+    cfg_scales: List[float] = field(default_factory=lambda: [7.0])
+    sizes: List[Tuple[int, int]] = field(default_factory=lambda: [(512, 512)])
+    loras: List[Dict[str, float]] = field(default_factory=lambda: [{}])
+
+    def axes(self) -> List[Sequence]:
+        """Per-model axes, in the order their indices are reported"""
+        return [self.prompts, self.seeds, self.steps, self.cfg_scales, self.sizes, self.loras]
+
+    def total(self) -> int:
+        count = len(dict.fromkeys(self.models))
+        for axis in self.axes():
+            count *= len(axis)
+        return count
+
+@dataclass
+class BatchItem:
+    index: int
+    params: Dict
+    coordinates: Dict[str, int]
+
+def order_models(models: Sequence[str], resident: Optional[str] = None) -> List[str]:
+    """Run the already-loaded model first, then the rest in request order, each once"""
+    ordered = list(dict.fromkeys(models))
+    if resident in ordered:
+        ordered.remove(resident)
+        ordered.insert(0, resident)
+    return ordered
+
+def expand(spec: BatchSpec, resident_model: Optional[str] = None, skip: Optional[Set[int]] = None) -> Iterator[BatchItem]:
+    """Lazily expand a spec into jobs, grouped by model so each checkpoint loads once.
+
+    Indices are stable regardless of the run order (they follow the order of
+    ``spec.models``), so indices in ``skip`` (e.g. items finished before a
+    restart) identify the same jobs on every run.
+    """
+    unique_models = list(dict.fromkeys(spec.models))
+    per_model = spec.total() // max(1, len(unique_models))
+    for model in order_models(spec.models, resident_model):
+        base = unique_models.index(model) * per_model
+        for offset, combo in enumerate(itertools.product(*(range(len(axis)) for axis in spec.axes()))):
+            index = base + offset
+            if skip and index in skip:
+                continue
+            prompt_i, seed_i, steps_i, cfg_i, size_i, lora_i = combo
+            width, height = spec.sizes[size_i]
+            yield BatchItem(
+                index=index,
+                params={
+                    "prompt": spec.prompts[prompt_i],
+                    "negative_prompt": spec.negative_prompt,
+                    "model_name": model,
+                    "seed": spec.seeds[seed_i],
+                    "steps": spec.steps[steps_i],
+                    "cfg_scale": spec.cfg_scales[cfg_i],
+                    "width": width,
+                    "height": height,
+                    "loras": spec.loras[lora_i]
+                },
+                coordinates={
+                    "prompt": prompt_i,
+                    "seed": seed_i,
+                    "steps": steps_i,
+                    "cfg_scale": cfg_i,
+                    "size": size_i,
+                    "lora": lora_i
+                }
+            )
+
+class BatchRunner:
+    """Runs an expanded batch with a bounded number of jobs in flight.
+
+    Jobs are pulled from the lazy expansion only when a slot frees up, so a
+    batch of thousands never materializes in memory, and since the expansion
+    is grouped by model, at most ``concurrency`` jobs straddle a model switch.
+    """
+
+    def __init__(self, run_item: Callable[[BatchItem], Awaitable[Dict]], concurrency: int = 2):
+        self.run_item = run_item
+        self.concurrency = max(1, concurrency)
+
+    async def run(self, spec: BatchSpec, resident_model: Optional[str] = None, batch_id: Optional[str] = None, skip: Optional[Set[int]] = None) -> AsyncIterator[Dict]:
+        """Yield a header, then an item and a progress event per finished job, then a summary"""
+        batch_id = batch_id or uuid.uuid4().hex
+        total = spec.total()
+        started = time.perf_counter()
+        completed = len(skip or ())
+        failed = 0
+        yield {"event": "batch", "batch_id": batch_id, "total": total, "models": order_models(spec.models, resident_model)}
+
+        jobs = expand(spec, resident_model, skip)
+        in_flight: Dict[asyncio.Task, BatchItem] = {}
+
+        def fill():
+            while len(in_flight) < self.concurrency:
+                item = next(jobs, None)
+                if item is None:
+                    return
+                in_flight[asyncio.ensure_future(self._run_one(item))] = item
+
+        # Shared by every running batch, so each adds and removes only its own items
+        outstanding = total - completed
+        QUEUE_DEPTH.inc(outstanding, queue="batch")
+        try:
+            fill()
+            while in_flight:
+                done, _ = await asyncio.wait(set(in_flight), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    del in_flight[task]
+                    event = task.result()
+                    outstanding -= 1
+                    QUEUE_DEPTH.dec(queue="batch")
+                    if event["status"] == "ok":
+                        completed += 1
+                    else:
+                        failed += 1
+                    yield event
+                    yield {
+                        "event": "progress",
+                        "batch_id": batch_id,
+                        "completed": completed,
+                        "failed": failed,
+                        "total": total,
+                        "elapsed": time.perf_counter() - started
+                    }
+                fill()
+        finally:
+            for task in in_flight:
+                task.cancel()
+            QUEUE_DEPTH.dec(outstanding, queue="batch")
+
+        yield {
+            "event": "done",
+            "batch_id": batch_id,
+            "completed": completed,
+            "failed": failed,
+            "total": total,
+            "elapsed": time.perf_counter() - started
+        }
+
+    async def _run_one(self, item: BatchItem) -> Dict:
+        start = time.perf_counter()
+        event = {
+            "event": "item",
+            "index": item.index,
+            "model": item.params["model_name"],
+            "seed": item.params["seed"],
+            "coordinates": item.coordinates
+        }
+        try:
+            event["result"] = await self.run_item(item)
+            event["status"] = "ok"
+        except Exception as e:
+            event["status"] = "error"
+            event["error"] = getattr(e, "detail", None) or str(e)
+        event["elapsed"] = time.perf_counter() - start
+        return event
@@ -0,0 +1,248 @@
+"""Offline stand-ins for the upstream services used by the benchmarks.
+
+Everything here runs on localhost threads so benchmark runs are reproducible
+and never touch Civitai, Hugging Face or a GPU.
+"""
+import base64
+import json
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+CHUNK_SIZE = 64 * 1024
+
+class _FakeServer:
+    """Base class running a ThreadingHTTPServer on an ephemeral port"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        handler = self._make_handler()
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+        self.requests_served = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, payload, status: int = 200):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                fake.requests_served += 1
+                fake.handle_get(self)
+
+            def do_POST(self):
+                fake.requests_served += 1
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length) if length else b""
+                fake.handle_post(self, body)
+
+        return Handler
+
+    def handle_get(self, handler):
+        handler._send_json({"error": "not found"}, 404)
+
+    def handle_post(self, handler, body: bytes):
+        handler._send_json({"error": "not found"}, 404)
+
+class FakeModelHub(_FakeServer):
+    """Serves the subset of the Civitai and Hugging Face APIs the clients use.
+
+    Civitai lives under ``/civitai/api/v1``, Hugging Face under ``/hf`` and
+    downloadable files under ``/files/<bytes>/<name>``.
+    """
+
+    def __init__(self, latency: float = 0.05, catalog_size: int = 500, **kwargs):
+        self.latency = latency
+        self.catalog_size = catalog_size
+        super().__init__(**kwargs)
+
+    @property
+    def civitai_url(self) -> str:
+        return f"{self.url}/civitai/api/v1"
+
+    @property
+    def hf_url(self) -> str:
+        return f"{self.url}/hf"
+
+    def file_url(self, name: str, size: int) -> str:
+        return f"{self.url}/files/{size}/{name}"
+
+    def _civitai_item(self, model_id: int) -> Dict:
+        kind = ("Checkpoint", "LORA", "TextualInversion", "VAE")[model_id % 4]
+        return {
+            "id": model_id,
+            "name": f"model-{model_id}",
+            "type": kind,
+            "description": f"Synthetic {kind} #{model_id}",
+            "nsfw": False,
+            "stats": {"downloadCount": (model_id * 7919) % 100000},
+            "modelVersions": [{
+                "id": model_id * 10,
+                "baseModel": "Flux.1 D" if model_id % 3 == 0 else "SDXL 1.0",
+                "downloadUrl": self.file_url(f"model-{model_id}.safetensors", 1024),
+                "images": [{"url": f"{self.url}/images/{model_id}.png"}]
+            }]
+        }
+
+    def _hf_item(self, index: int) -> Dict:
+        repo_id = f"bench/flux-model-{index}"
+        return {
+            "id": repo_id,
+            "modelId": repo_id,
+            "pipeline_tag": "text-to-image",
+            "tags": ["diffusers", "text-to-image", "flux"],
+            "downloads": (index * 104729) % 50000,
+            "likes": index % 300,
+            "private": False
+        }
+
+    def handle_get(self, handler):
+        parsed = urlparse(handler.path)
+        query = parse_qs(parsed.query)
+        path = parsed.path
+
+        if path.startswith("/files/"):
+            self._stream_file(handler, int(path.split("/")[2]))
+            return
+        if path.startswith("/hf/") and "/resolve/" in path:
+            self._stream_file(handler, 4096)
+            return
+
+        time.sleep(self.latency)
+        limit = int(query.get("limit", ["20"])[0])
+        if path == "/civitai/api/v1/models":
+            term = query.get("query", [""])[0]
+            items = [self._civitai_item(i) for i in range(self.catalog_size)]
+            items = [item for item in items if term in item["name"]][:limit]
+            handler._send_json({"items": items, "metadata": {"totalItems": len(items)}})
+        elif path.startswith("/civitai/api/v1/models/"):
+            handler._send_json(self._civitai_item(int(path.rsplit("/", 1)[-1])))
+        elif path == "/hf/api/models":
+            term = query.get("search", [""])[0]
+            items = [self._hf_item(i) for i in range(self.catalog_size)]
+            handler._send_json([item for item in items if term in item["id"]][:limit])
+        elif path.startswith("/hf/api/models/"):
+            item = self._hf_item(0)
+            item["id"] = item["modelId"] = path[len("/hf/api/models/"):]
+            item["siblings"] = [{"rfilename": "model_index.json"}, {"rfilename": "unet/model.safetensors"}]
+            handler._send_json(item)
+        else:
+            handler._send_json({"error": "not found"}, 404)
+
+    def _stream_file(self, handler, size: int):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/octet-stream")
+        handler.send_header("Content-Length", str(size))
+        handler.end_headers()
+        chunk = b"\0" * CHUNK_SIZE
+        remaining = size
+        while remaining > 0:
+            handler.wfile.write(chunk[:min(CHUNK_SIZE, remaining)])
+            remaining -= CHUNK_SIZE
+
+class FakeComfyUI(_FakeServer):
+    """Accepts generation requests and sleeps for a configurable render time"""
+
+    def __init__(self, render_time: float = 0.5, image: Optional[bytes] = None, **kwargs):
+        self.render_time = render_time
+        # Optional PNG returned inline as a data URL, like the predict endpoint does
+        self.image = image
+        self.generations = 0
+        self._lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def handle_get(self, handler):
+        if urlparse(handler.path).path in ("/", "/system_stats"):
+            handler._send_json({"system": {"fake": True}})
+        else:
+            handler._send_json({"error": "not found"}, 404)
+
+    def handle_post(self, handler, body: bytes):
+        if urlparse(handler.path).path not in ("/api/predict", "/prompt"):
+            handler._send_json({"error": "not found"}, 404)
+            return
+        workflow = json.loads(body or b"{}")
+        time.sleep(self.render_time)
+        with self._lock:
+            self.generations += 1
+            number = self.generations
+        result = {
+            "prompt_id": f"fake-{number}",
+            "seed": workflow.get("seed"),
+            "model": workflow.get("model"),
+            "images": []
+        }
+        if self.image:
+            result["image"] = "data:image/png;base64," + base64.b64encode(self.image).decode()
+        handler._send_json(result)
+
+def write_synthetic_safetensors(path: str, tensors: Dict[str, tuple], dtype: str = "F16") -> int:
+    """Write a zero-filled safetensors file with the given tensor shapes.
+
+    Returns the size of the written file in bytes.
+    """
+    itemsize = {"F32": 4, "F16": 2, "BF16": 2, "I8": 1}[dtype]
+    header = {}
+    offset = 0
+    for name, shape in tensors.items():
+        count = 1
+        for dim in shape:
+            count *= dim
+        header[name] = {"dtype": dtype, "shape": list(shape), "data_offsets": [offset, offset + count * itemsize]}
+        offset += count * itemsize
+    header_bytes = json.dumps(header).encode()
+    header_bytes += b" " * (-len(header_bytes) % 8)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        remaining = offset
+        zeros = b"\0" * CHUNK_SIZE
+        while remaining > 0:
+            f.write(zeros[:min(CHUNK_SIZE, remaining)])
+            remaining -= CHUNK_SIZE
+    return 8 + len(header_bytes) + offset
+
+def synthetic_lora_shapes(rank: int = 16, blocks: int = 8, dim: int = 768) -> Dict[str, tuple]:
+    """Tensor shapes resembling a small kohya-style LoRA"""
+    shapes = {}
+    for block in range(blocks):
+        base = f"lora_unet_double_blocks_{block}_img_attn_qkv"
+        shapes[f"{base}.lora_down.weight"] = (rank, dim)
+        shapes[f"{base}.lora_up.weight"] = (dim * 3, rank)
+        shapes[f"{base}.alpha"] = ()
+    return shapes
@@ -0,0 +1,191 @@
+"""Fetch model files from sibling instances running as separate local processes.
+
+Usage:
+    python -m benchmarks.peer_fetch --peers 3 --file-mb 256
+    python -m benchmarks.peer_fetch --output peers.json --compare old.json
+
+Starts ``--peers`` web_ui processes, each serving its own copy of the same
+model files (see ``peers.py``), then fetches the files into an empty catalog
+from the first 1, 2, ... of them and reports throughput per peer count. One
+more round fetches a file no peer has, which must fall through at once.
+All processes share this machine's disk and loopback, so the numbers show
+protocol and hashing overhead rather than network scaling.
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.run import MB, _git_revision, compare
+from model_manager import ModelManager, ModelType
+from peers import PeerNode
+
+TOKEN = "peer-benchmark"
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _write_random(path: Path, size: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, "wb") as f:
+        for offset in range(0, size, MB):
+            data = os.urandom(min(MB, size - offset))
+            digest.update(data)
+            f.write(data)
+    return digest.hexdigest()
+
+def _seed(directory: Path, files: Dict[str, Path]):
+    """A peer's working directory holding a catalog with a hard link to each file"""
+    directory.mkdir()
+    # Catalog paths are relative to the server's working directory
+    os.chdir(directory)
+    manager = ModelManager("models")
+    for name, source in files.items():
+        target = os.path.join("models", "lora", source.name)
+        os.link(source, target)
+        manager.add_model(name, ModelType.LORA, "local", target, move=False)
+
+def _wait_for_manifest(url: str, hashes: List[str], timeout: float = 300.0):
+    """Wait until a peer has hashed and advertises every file"""
+    request = urllib.request.Request(f"{url}/api/peers/manifest", headers={"Authorization": f"Bearer {TOKEN}"})
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                if set(hashes) <= set(json.loads(response.read())["files"]):
+                    return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Peer {url} did not advertise its files within {timeout:.0f}s")
+
+def _fetch_round(workdir: Path, urls: List[str], files: Dict[str, Path], hashes: Dict[str, str], args) -> Dict[str, float]:
+    directory = Path(tempfile.mkdtemp(prefix="fetch-", dir=workdir))
+    os.chdir(directory)
+    try:
+        node = PeerNode(ModelManager("models"), urls, TOKEN, chunk_size=args.chunk_mb * MB, workers=args.workers)
+        start = time.perf_counter()
+        total = 0
+        for name, source in files.items():
+            path = os.path.join("models", "lora", source.name)
+            if not node.fetch(path, hashes[name]):
+                raise RuntimeError(f"Could not fetch {path} from {len(urls)} peer(s)")
+            total += os.path.getsize(path)
+        elapsed = time.perf_counter() - start
+        miss_start = time.perf_counter()
+        missing = node.fetch(os.path.join("models", "lora", "missing.safetensors"), "0" * 64)
+        return {
+            "bytes": total,
+            "fetch_s": elapsed,
+            "mb_per_s": total / MB / elapsed,
+            "fallthrough_ms": (time.perf_counter() - miss_start) * 1000,
+            "fallthrough_ok": not missing
+        }
+    finally:
+        os.chdir(workdir)
+        shutil.rmtree(directory, ignore_errors=True)
+
+def serve_peer(port: int):
+    """Run one peer: web_ui over the catalog in the current directory"""
+    from catalog import CatalogHost
+    from web_ui import serve
+
+    serve(CatalogHost(), port=port, host="127.0.0.1")
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark peer-to-peer model fetches across local processes")
+    parser.add_argument("--peers", type=int, default=3, help="Peer processes to start")
+    parser.add_argument("--files", type=int, default=2, help="Model files each peer serves")
+    parser.add_argument("--file-mb", type=int, default=128, help="Size of each model file")
+    parser.add_argument("--chunk-mb", type=int, default=8, help="Chunk size for hashing and ranged reads")
+    parser.add_argument("--workers", type=int, default=8, help="Parallel chunk reads per fetch")
+    parser.add_argument("--output", help="Write JSON results to this path")
+    parser.add_argument("--compare", help="Baseline JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative regression threshold")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.serve:
+        serve_peer(args.serve)
+        return 0
+
+    original_cwd = os.getcwd()
+    workdir = Path(tempfile.mkdtemp(prefix="flux-peers-"))
+    processes: List[subprocess.Popen] = []
+    results = {}
+    try:
+        files = {f"peer-model-{i}": workdir / f"peer-model-{i}.safetensors" for i in range(args.files)}
+        hashes = {name: _write_random(path, args.file_mb * MB) for name, path in files.items()}
+        env = dict(os.environ, FLUX_PEER_TOKEN=TOKEN, FLUX_PEER_CHUNK_BYTES=str(args.chunk_mb * MB), FLUX_PEERS="")
+        urls = []
+        for i in range(args.peers):
+            directory = workdir / f"peer-{i}"
+            _seed(directory, files)
+            port = _free_port()
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "benchmarks.peer_fetch", "--serve", str(port)],
+                cwd=directory,
+                env=dict(env, PYTHONPATH=str(REPO_ROOT)),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            ))
+            urls.append(f"http://127.0.0.1:{port}")
+        print(f"Waiting for {args.peers} peer(s) to hash their files...", file=sys.stderr)
+        for url in urls:
+            _wait_for_manifest(url, list(hashes.values()))
+
+        os.chdir(workdir)
+        for count in range(1, args.peers + 1):
+            print(f"Fetching from {count} peer(s)...", file=sys.stderr)
+            results[f"peers_{count}"] = _fetch_round(workdir, urls[:count], files, hashes, args)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        os.chdir(original_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps({
+        "meta": {
+            "git_revision": _git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "serve")}
+        },
+        "results": results
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, json.loads(output), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold:.0%}", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+"""Replay a recorded traffic log against the web API and report latencies.
+
+Record with ``FLUX_TRAFFIC_LOG=traffic.jsonl`` set on the server (see
+``traffic.py``), then:
+
+    python -m benchmarks.replay traffic.jsonl --speed 1
+    python -m benchmarks.replay traffic.jsonl --speed 10 --output replay.json
+    python -m benchmarks.replay traffic.jsonl --concurrency 16 --target http://localhost:8000
+
+``--speed N`` keeps the recorded arrival pattern, N times faster (open loop);
+``--concurrency C`` ignores timestamps and keeps C requests in flight
+(closed loop). Without ``--target`` the log is replayed against an in-process
+web_ui backed by the fake ComfyUI and model hub from ``benchmarks/fakes.py``.
+Anonymized strings are replaced by synthetic ones of the same length, equal
+hashes mapping to equal strings, so cache behaviour is preserved.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.fakes import FakeComfyUI, FakeModelHub, write_synthetic_safetensors
+from benchmarks.run import BenchWorker, _asgi_client, _git_revision, compare, percentile, summarize
+from traffic import load_log
+
+# Fields that name a catalog model; their strings become stable model names
+MODEL_KEYS = frozenset({"model_name", "models", "model", "checkpoint"})
+# Multipart uploads are recorded by size only: the form each route expects
+UPLOAD_FORMS = {
+    "/api/upload": ("model", {"type": "lora"}),
+    "/api/upload/lora": ("file", {})
+}
+WORDS = (
+    "portrait", "landscape", "cinematic", "lighting", "detailed", "forest", "city", "night",
+    "watercolor", "photo", "studio", "soft", "dramatic", "mountain", "river", "neon",
+    "vintage", "macro", "golden", "hour", "fog", "castle", "ocean", "sunset"
+)
+
+class Synthesizer:
+    """Turns recorded shapes back into concrete request bodies"""
+
+    def __init__(self, file_url=None, download_bytes: int = 1024 * 1024):
+        self.file_url = file_url
+        self.download_bytes = download_bytes
+        self.models: Dict[str, str] = {}
+        self.loras: Dict[str, str] = {}
+        self._strings: Dict[str, str] = {}
+
+    def model(self, digest: str) -> str:
+        if digest not in self.models:
+            self.models[digest] = f"replay-model-{len(self.models)}"
+        return self.models[digest]
+
+    def lora(self, digest: str) -> str:
+        if digest not in self.loras:
+            self.loras[digest] = f"replay-lora-{len(self.loras)}"
+        return self.loras[digest]
+
+    def text(self, digest: str, length: int) -> str:
+        if digest not in self._strings:
+            seed = hashlib.sha256(digest.encode()).digest()
+            words = []
+            i = 0
+            while sum(len(w) + 1 for w in words) < length:
+                words.append(WORDS[seed[i % len(seed)] % len(WORDS)])
+                i += 1
+            self._strings[digest] = " ".join(words)[:length]
+        return self._strings[digest]
+
+    def string(self, value: Dict, key: Optional[str]) -> str:
+        digest, length = value["$h"], value["$s"]
+        if key in MODEL_KEYS:
+            return self.model(digest)
+        if key and key.endswith("url") and self.file_url is not None:
+            return self.file_url(f"{self.model(digest)}.safetensors", self.download_bytes)
+        return self.text(digest, length)
+
+    def value(self, shaped: Any, key: Optional[str] = None) -> Any:
+        if isinstance(shaped, list):
+            return [self.value(item, key) for item in shaped if not (isinstance(item, dict) and "$more" in item)]
+        if isinstance(shaped, dict):
+            if "$h" in shaped:
+                return self.string(shaped, key)
+            result = {}
+            for k, v in shaped.items():
+                if k.startswith("#"):
+                    # An anonymized dict key (a LoRA name)
+                    digest = k[1:].split(":")[0]
+                    result[self.lora(digest)] = self.value(v)
+                else:
+                    result[k] = self.value(v, k)
+            return result
+        return shaped
+
+def _request(entry: Dict, synth: Synthesizer, index: int) -> Dict:
+    """httpx request arguments for a log entry"""
+    kwargs: Dict[str, Any] = {"method": entry["method"], "url": entry["route"]}
+    if "path_params" in entry:
+        kwargs["url"] = entry["route"].format(**synth.value(entry["path_params"]))
+    if "query" in entry:
+        kwargs["params"] = synth.value(entry["query"])
+    body = entry.get("body")
+    if isinstance(body, dict) and "$bytes" in body:
+        if body.get("$type") == "multipart/form-data" and entry["route"] in UPLOAD_FORMS:
+            field, data = UPLOAD_FORMS[entry["route"]]
+            payload = os.urandom(max(0, body["$bytes"] - 512))
+            kwargs["files"] = {field: (f"replay-{index}.safetensors", payload, "application/octet-stream")}
+            kwargs["data"] = data
+        else:
+            kwargs["content"] = os.urandom(body["$bytes"])
+            kwargs["headers"] = {"content-type": body.get("$type") or "application/octet-stream"}
+    elif body is not None:
+        kwargs["json"] = synth.value(body)
+    return kwargs
+
+async def _send(client, entry: Dict, synth: Synthesizer, index: int, results: List[Tuple[Dict, Optional[int], float]]):
+    start = time.perf_counter()
+    status = None
+    try:
+        response = await client.request(**_request(entry, synth, index), timeout=None)
+        status = response.status_code
+    except Exception as e:
+        print(f"{entry['method']} {entry['route']} failed: {e}", file=sys.stderr)
+    results.append((entry, status, time.perf_counter() - start))
+
+async def replay(client, entries: List[Dict], synth: Synthesizer, speed: Optional[float] = None, concurrency: Optional[int] = None) -> Tuple[List[Tuple[Dict, Optional[int], float]], float, List[float]]:
+    """Play entries against client; returns (entry, status, latency) results, elapsed seconds and schedule lag"""
+    results: List[Tuple[Dict, Optional[int], float]] = []
+    lag: List[float] = []
+    start = time.perf_counter()
+    if concurrency:
+        queue = list(enumerate(entries))
+        queue.reverse()
+
+        async def worker():
+            while queue:
+                index, entry = queue.pop()
+                await _send(client, entry, synth, index, results)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    else:
+        first = entries[0]["ts"] if entries else 0.0
+        tasks = []
+        for index, entry in enumerate(entries):
+            due = start + (entry["ts"] - first) / (speed or 1.0)
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # How far behind the recorded arrival time each request was sent
+            lag.append(max(0.0, time.perf_counter() - due))
+            tasks.append(asyncio.create_task(_send(client, entry, synth, index, results)))
+        await asyncio.gather(*tasks)
+    return results, time.perf_counter() - start, lag
+
+def _group(entry: Dict) -> str:
+    return f"{entry['method']} {entry['route']}"
+
+def report(results: List[Tuple[Dict, Optional[int], float]], elapsed: float, lag: List[float]) -> Dict[str, Dict]:
+    """Per-route and overall latency percentiles and error rates"""
+    groups: Dict[str, List[Tuple[Dict, Optional[int], float]]] = {"all": results}
+    for result in results:
+        groups.setdefault(_group(result[0]), []).append(result)
+
+    summary = {}
+    for name, group in groups.items():
+        latencies = [latency for _, _, latency in group]
+        recorded = [entry["latency_ms"] / 1000 for entry, _, _ in group]
+        errors = sum(1 for _, status, _ in group if status is None or status >= 500)
+        rejected = sum(1 for _, status, _ in group if status is not None and 400 <= status < 500)
+        stats = {
+            "requests": len(group),
+            "error_rate": errors / len(group) if group else 0.0,
+            "client_error_rate": rejected / len(group) if group else 0.0,
+            "req_per_s": len(group) / elapsed if elapsed else 0.0
+        }
+        stats.update(summarize("latency", latencies))
+        stats["latency_p99_ms"] = percentile(latencies, 99) * 1000
+        # What the recorded server saw, for reference (no _ms suffix: not compared)
+        stats["recorded_p50"] = percentile(recorded, 50) * 1000
+        stats["recorded_p95"] = percentile(recorded, 95) * 1000
+        summary[name] = stats
+    if lag:
+        summary["all"]["schedule_lag_p95_ms"] = percentile(lag, 95) * 1000
+    return summary
+
+async def _replay_local(entries: List[Dict], args) -> Tuple[List, float, List[float]]:
+    """Replay against an in-process web_ui wired to the fakes"""
+    from model_manager import ModelManager, ModelType
+    from model_sources import ModelSources
+    from job_store import JobStore
+    import web_ui
+
+    workdir = Path(os.getcwd())
+    with FakeComfyUI(render_time=args.render_time) as comfy, FakeModelHub(latency=args.upstream_latency) as hub:
+        synth = Synthesizer(hub.file_url, args.download_bytes)
+        manager = ModelManager(str(workdir / "models"))
+        web_ui.app.comfy_ui = BenchWorker(manager, url=comfy.url)
+        web_ui.app.job_store = JobStore(str(workdir / "jobs.db"))
+        web_ui.app.sources = ModelSources(civitai_url=hub.civitai_url, huggingface_endpoint=hub.hf_url, reserve=web_ui.reserve_storage)
+        web_ui.app.federated_search = None
+        web_ui.app.storage = None
+
+        # Every model the log refers to exists, so baking and converting find real files
+        for entry in entries:
+            synth.value(entry.get("body"))
+        source = workdir / "replay-source.safetensors"
+        write_synthetic_safetensors(str(source), {"weight": (64, 64)})
+        for names, model_type in ((synth.models, ModelType.CHECKPOINT), (synth.loras, ModelType.LORA)):
+            for name in names.values():
+                path = workdir / "models" / model_type.value / f"{name}.safetensors"
+                path.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(source, path)
+                manager.add_model(name, model_type, "custom", str(path))
+
+        try:
+            async with _asgi_client(web_ui.app) as client:
+                return await replay(client, entries, synth, args.speed, args.concurrency)
+        finally:
+            await web_ui.get_sources().close()
+
+async def _replay_remote(entries: List[Dict], args) -> Tuple[List, float, List[float]]:
+    import httpx
+    async with httpx.AsyncClient(base_url=args.target, limits=httpx.Limits(max_connections=None)) as client:
+        return await replay(client, entries, Synthesizer(download_bytes=args.download_bytes), args.speed, args.concurrency)
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay a recorded web API traffic log")
+    parser.add_argument("log", help="Traffic log written by FLUX_TRAFFIC_LOG")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--speed", type=float, default=1.0, help="Replay the recorded arrivals N times faster")
+    mode.add_argument("--concurrency", type=int, help="Ignore timestamps and keep this many requests in flight")
+    parser.add_argument("--target", help="Base URL of a running server (default: in-process web_ui with fakes)")
+    parser.add_argument("--limit", type=int, help="Replay only the first N requests")
+    parser.add_argument("--output", help="Write JSON results to this path")
+    parser.add_argument("--compare", help="Baseline JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative regression threshold")
+    parser.add_argument("--render-time", type=float, default=0.2, help="Fake ComfyUI render time in seconds")
+    parser.add_argument("--upstream-latency", type=float, default=0.05, help="Fake upstream latency in seconds")
+    parser.add_argument("--download-bytes", type=int, default=1024 * 1024, help="Size of replayed model downloads")
+    args = parser.parse_args(argv)
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+
+    entries = load_log(args.log)[:args.limit]
+    if not entries:
+        parser.error(f"No requests in {args.log}")
+
+    original_cwd = os.getcwd()
+    workdir = Path(tempfile.mkdtemp(prefix="flux-replay-"))
+    # web_ui writes uploads/ and models/ relative to the working directory
+    os.chdir(workdir)
+    try:
+        run = _replay_remote if args.target else _replay_local
+        results, elapsed, lag = asyncio.run(run(entries, args))
+    finally:
+        os.chdir(original_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps({
+        "meta": {
+            "git_revision": _git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")}
+        },
+        "results": report(results, elapsed, lag)
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, json.loads(output), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold:.0%}", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,393 @@
+"""Reproducible offline benchmarks for the catalog, transfer and generation paths.
+
+Usage:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --only model_manager,listing --models 2000
+    python -m benchmarks.run --output new.json --compare old.json
+
+All upstream services are replaced by the fakes in ``benchmarks/fakes.py``, so
+the numbers only depend on this repository's code and the host machine.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.fakes import FakeComfyUI, FakeModelHub, write_synthetic_safetensors
+
+MB = 1024 * 1024
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(prefix: str, samples: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds"""
+    return {
+        f"{prefix}_p50_ms": percentile(samples, 50) * 1000,
+        f"{prefix}_p95_ms": percentile(samples, 95) * 1000,
+        f"{prefix}_mean_ms": statistics.fmean(samples) * 1000 if samples else 0.0
+    }
+
+class BenchWorker:
+    """Stand-in for ComfyUIWork exposing only what web_ui calls"""
+
+    def __init__(self, model_manager, civitai=None, huggingface=None, url: str = ""):
+        self._model_manager = model_manager
+        self._civitai = civitai
+        self._huggingface = huggingface
+        self.url = url
+
+    @property
+    def model_manager(self):
+        return self._model_manager
+
+    def add_model(self, name, model_type, source, file_path, metadata=None):
+        return self._model_manager.add_model(name, model_type, source, file_path, metadata)
+
+    def list_models(self, model_type=None):
+        return self._model_manager.list_models(model_type)
+
+    def search_civitai(self, query, model_type=None, nsfw=False, limit=10):
+        return self._civitai.search_models(query, model_type, nsfw, limit)
+
+    def search_huggingface(self, query, model_type=None, flux_only=False, limit=20):
+        return self._huggingface.search_models(query, model_type, flux_only, limit)
+
+def _write_index(base_path: Path, count: int):
+    """Pre-populate a model index with synthetic LoRA entries"""
+    index = {}
+    for i in range(count):
+        name = f"lora-{i:05d}"
+        index[name] = {
+            "name": name,
+            "type": "lora",
+            "source": "civitai" if i % 2 else "huggingface",
+            "path": str(base_path / "lora" / f"{name}.safetensors"),
+            "metadata": {"base_model": "Flux.1 D", "tags": ["style", f"tag{i % 50}"], "size": 150 * MB}
+        }
+    base_path.mkdir(parents=True, exist_ok=True)
+    with open(base_path / "model_index.json", "w") as f:
+        json.dump(index, f)
+
+def bench_model_manager(args, workdir: Path) -> Dict[str, float]:
+    """Load, add, list and remove at catalog scale"""
+    from model_manager import ModelManager, ModelType
+
+    base_path = workdir / "mm_models"
+    _write_index(base_path, args.models)
+
+    start = time.perf_counter()
+    manager = ModelManager(str(base_path))
+    load_s = time.perf_counter() - start
+
+    add_samples = []
+    for i in range(args.ops):
+        start = time.perf_counter()
+        manager.add_model(f"bench-add-{i}", ModelType.LORA, "custom", str(workdir / f"missing-{i}.safetensors"))
+        add_samples.append(time.perf_counter() - start)
+
+    list_samples = []
+    for i in range(args.ops):
+        start = time.perf_counter()
+        manager.list_models(ModelType.LORA if i % 2 else None)
+        list_samples.append(time.perf_counter() - start)
+
+    remove_samples = []
+    for i in range(args.ops):
+        start = time.perf_counter()
+        manager.remove_model(f"bench-add-{i}")
+        remove_samples.append(time.perf_counter() - start)
+
+    results = {"catalog_size": args.models, "load_s": load_s}
+    results.update(summarize("add", add_samples))
+    results.update(summarize("list", list_samples))
+    results.update(summarize("remove", remove_samples))
+    return results
+
+def _asgi_client(app):
+    import httpx
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+
+def bench_listing(args, workdir: Path) -> Dict[str, float]:
+    """GET /api/models latency through the FastAPI app"""
+    from model_manager import ModelManager
+    import web_ui
+
+    base_path = workdir / "listing_models"
+    _write_index(base_path, args.models)
+    web_ui.app.comfy_ui = BenchWorker(ModelManager(str(base_path)))
+
+    async def run():
+        samples = []
+        async with _asgi_client(web_ui.app) as client:
+            for i in range(args.requests):
+                params = {"model_type": "lora"} if i % 2 else {}
+                start = time.perf_counter()
+                response = await client.get("/api/models", params=params)
+                samples.append(time.perf_counter() - start)
+                response.raise_for_status()
+            return samples, len(response.content)
+
+    samples, body_bytes = asyncio.run(run())
+    results = {"catalog_size": args.models, "response_bytes": body_bytes}
+    results.update(summarize("list", samples))
+    return results
+
+def bench_upload(args, workdir: Path) -> Dict[str, float]:
+    """POST /api/upload/lora throughput with synthetic safetensors files"""
+    from model_manager import ModelManager
+    import web_ui
+
+    web_ui.app.comfy_ui = BenchWorker(ModelManager(str(workdir / "upload_models")))
+    source = workdir / "upload_source.safetensors"
+    size = write_synthetic_safetensors(str(source), {"weight": (args.file_mb * MB // 2,)})
+    payload = source.read_bytes()
+
+    async def run():
+        samples = []
+        async with _asgi_client(web_ui.app) as client:
+            for i in range(args.transfers):
+                start = time.perf_counter()
+                response = await client.post(
+                    "/api/upload/lora",
+                    files={"file": (f"upload-{i}.safetensors", payload, "application/octet-stream")}
+                )
+                samples.append(time.perf_counter() - start)
+                response.raise_for_status()
+        return samples
+
+    samples = asyncio.run(run())
+    results = {"file_bytes": size, "mb_per_s": size * len(samples) / MB / sum(samples)}
+    results.update(summarize("upload", samples))
+    return results
+
+def bench_download(args, workdir: Path) -> Dict[str, float]:
+    """ModelSources.download throughput for Civitai files served by the fake hub"""
+    from model_sources import ModelSources
+
+    size = args.file_mb * MB
+    with FakeModelHub(latency=0) as hub:
+
+        async def run():
+            sources = ModelSources(civitai_url=hub.civitai_url, huggingface_endpoint=hub.hf_url)
+            samples = []
+            try:
+                for i in range(args.transfers):
+                    model_data = {
+                        "id": i, "name": f"download-{i}", "type": "LORA", "description": "",
+                        "download_url": hub.file_url(f"download-{i}.safetensors", size),
+                        "version_id": i, "base_model": "Flux.1 D"
+                    }
+                    start = time.perf_counter()
+                    _, path, _, _ = await sources.download("civitai", model_data, str(workdir / "downloads"))
+                    samples.append(time.perf_counter() - start)
+                    os.remove(path)
+            finally:
+                await sources.close()
+            return samples
+
+        samples = asyncio.run(run())
+    results = {"file_bytes": size, "mb_per_s": size * len(samples) / MB / sum(samples)}
+    results.update(summarize("download", samples))
+    return results
+
+def bench_search(args, workdir: Path) -> Dict[str, float]:
+    """POST /api/models/search latency per source against the fake hub"""
+    from model_manager import ModelManager
+    from model_sources import ModelSources
+    import web_ui
+
+    results = {"upstream_latency_ms": args.upstream_latency * 1000}
+    queries = [f"model-{i}" for i in range(10)]
+    web_ui.app.comfy_ui = BenchWorker(ModelManager(str(workdir / "search_models")))
+    with FakeModelHub(latency=args.upstream_latency) as hub:
+
+        async def run(source: str):
+            # The shared HTTP session is bound to the event loop that created it
+            web_ui.app.sources = ModelSources(civitai_url=hub.civitai_url, huggingface_endpoint=hub.hf_url)
+            web_ui.app.federated_search = None
+            samples = []
+            try:
+                async with _asgi_client(web_ui.app) as client:
+                    for i in range(args.requests):
+                        start = time.perf_counter()
+                        response = await client.post("/api/models/search", json={
+                            "query": queries[i % len(queries)],
+                            "source": source,
+                            "limit": 20
+                        })
+                        samples.append(time.perf_counter() - start)
+                        response.raise_for_status()
+            finally:
+                await web_ui.app.sources.close()
+                web_ui.app.sources = None
+            return samples
+
+        for source in ("civitai", "huggingface", "all"):
+            results.update(summarize(source, asyncio.run(run(source))))
+    return results
+
+def bench_generate(args, workdir: Path) -> Dict[str, float]:
+    """/api/generate throughput at increasing concurrency against a fake ComfyUI"""
+    from model_manager import ModelManager
+    from job_store import JobStore
+    import web_ui
+
+    results = {"render_time_ms": args.render_time * 1000}
+    with FakeComfyUI(render_time=args.render_time) as comfy:
+        web_ui.app.comfy_ui = BenchWorker(ModelManager(str(workdir / "generate_models")), url=comfy.url)
+        web_ui.app.job_store = JobStore(str(workdir / "jobs.db"))
+
+        async def run(concurrency: int):
+            samples = []
+            total = concurrency * args.rounds
+
+            async with _asgi_client(web_ui.app) as client:
+                semaphore = asyncio.Semaphore(concurrency)
+
+                async def one(i: int):
+                    async with semaphore:
+                        start = time.perf_counter()
+                        response = await client.post("/api/generate", json={
+                            "prompt": f"benchmark prompt {i}",
+                            "model_name": f"model-{i % 3}",
+                            "seed": i
+                        }, timeout=None)
+                        samples.append(time.perf_counter() - start)
+                        response.raise_for_status()
+
+                start = time.perf_counter()
+                await asyncio.gather(*(one(i) for i in range(total)))
+                elapsed = time.perf_counter() - start
+            # The shared HTTP session is bound to this event loop
+            await web_ui.get_sources().close()
+            return total / elapsed, samples
+
+        for concurrency in args.concurrency:
+            throughput, samples = asyncio.run(run(concurrency))
+            results[f"c{concurrency}_req_per_s"] = throughput
+            results.update(summarize(f"c{concurrency}", samples))
+    return results
+
+BENCHMARKS: Dict[str, Callable] = {
+    "model_manager": bench_model_manager,
+    "listing": bench_listing,
+    "upload": bench_upload,
+    "download": bench_download,
+    "search": bench_search,
+    "generate": bench_generate
+}
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def _higher_is_better(metric: str) -> bool:
+    return metric.endswith("_per_s")
+
+def compare(baseline: Dict, current: Dict, threshold: float) -> List[str]:
+    """Print metric deltas and return the list of regressions above threshold"""
+    regressions = []
+    for bench, metrics in current["results"].items():
+        old_metrics = baseline.get("results", {}).get(bench, {})
+        for metric, value in metrics.items():
+            old = old_metrics.get(metric)
+            if not isinstance(old, (int, float)) or not isinstance(value, (int, float)) or old == 0:
+                continue
+            if not (metric.endswith("_ms") or metric.endswith("_s") or _higher_is_better(metric)):
+                continue
+            change = (value - old) / old
+            worse = -change if _higher_is_better(metric) else change
+            marker = "REGRESSION" if worse > threshold else ""
+            print(f"{bench:15s} {metric:32s} {old:12.3f} -> {value:12.3f} ({change:+.1%}) {marker}")
+            if marker:
+                regressions.append(f"{bench}.{metric}")
+    return regressions
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run offline FLUX benchmarks")
+    parser.add_argument("--only", help="Comma separated benchmark names", default=",".join(BENCHMARKS))
+    parser.add_argument("--output", help="Write JSON results to this path")
+    parser.add_argument("--compare", help="Baseline JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative regression threshold")
+    parser.add_argument("--models", type=int, default=10000, help="Catalog size for catalog benchmarks")
+    parser.add_argument("--ops", type=int, default=100, help="Operations per catalog measurement")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per latency measurement")
+    parser.add_argument("--transfers", type=int, default=3, help="Files per transfer measurement")
+    parser.add_argument("--file-mb", type=int, default=64, help="File size for transfer benchmarks")
+    parser.add_argument("--upstream-latency", type=float, default=0.05, help="Fake upstream latency in seconds")
+    parser.add_argument("--render-time", type=float, default=0.2, help="Fake ComfyUI render time in seconds")
+    parser.add_argument("--concurrency", type=lambda v: [int(x) for x in v.split(",")], default=[1, 4, 16])
+    parser.add_argument("--rounds", type=int, default=4, help="Generate requests per concurrency slot")
+    args = parser.parse_args(argv)
+
+    selected = [name.strip() for name in args.only.split(",") if name.strip()]
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    report = {
+        "meta": {
+            "git_revision": _git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "only")}
+        },
+        "results": {}
+    }
+
+    # web_ui writes static/ and uploads/ relative to the working directory
+    original_cwd = os.getcwd()
+    workdir = Path(tempfile.mkdtemp(prefix="flux-bench-"))
+    os.chdir(workdir)
+    try:
+        for name in selected:
+            print(f"Running {name}...", file=sys.stderr)
+            bench_dir = workdir / name
+            bench_dir.mkdir()
+            report["results"][name] = BENCHMARKS[name](args, bench_dir)
+    finally:
+        os.chdir(original_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold:.0%}", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
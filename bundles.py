@@ -0,0 +1,482 @@
+import os
+import json
+import time
+import uuid
+import struct
+import hashlib
+import logging
+import threading
+import urllib.request
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from metrics import DRIVE_SYNC_DURATION, TRACER
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"FLXBNDL1"
+ALIGNMENT = 64
+COPY_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Bundle layout (little-endian, uncompressed):
+#   MAGIC | u64 index length | JSON index | padding | member data, each aligned to ALIGNMENT
+# The index maps member name -> {"offset", "size", "mtime", "sha256"}, offsets
+# relative to the start of the file, so one member is a single ranged read.
+
+class FileRangeReader:
+    """Ranged reads from a local file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_RDONLY)
+
+    def read(self, offset: int, length: int) -> bytes:
+        return os.pread(self._fd, length, offset)
+
+    def close(self):
+        os.close(self._fd)
+
+class HttpRangeReader:
+    """Ranged reads over HTTP (a server that honours Range, e.g. a signed object URL)"""
+
+    def __init__(self, url: str, timeout: float = 60.0):
+        self.url = url
+        self.timeout = timeout
+
+    def read(self, offset: int, length: int) -> bytes:
+        if length <= 0:
+            return b""
+        request = urllib.request.Request(self.url, headers={"Range": f"bytes={offset}-{offset + length - 1}"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            data = response.read()
+            if response.status == 200:
+                # The server ignored the range and sent the whole object
+                data = data[offset:offset + length]
+        return data
+
+    def close(self):
+        pass
+
+def write_bundle(path: str, members: Sequence[Tuple[str, str]]) -> Dict[str, Dict]:
+    """Pack (member name, local file) pairs into a bundle at path; returns its index"""
+    index = {}
+    sizes = []
+    for name, source in members:
+        st = os.stat(source)
+        sizes.append(st.st_size)
+        index[name] = {"offset": 0, "size": st.st_size, "mtime": st.st_mtime, "sha256": ""}
+    # Offsets depend on the index length, which depends on the offsets: size the
+    # index with placeholder hashes and a generous offset width, then pad it
+    placeholder = {n: dict(e, sha256="0" * 64, offset=10 ** 15) for n, e in index.items()}
+    header_room = len(json.dumps(placeholder, separators=(",", ":")).encode())
+    data_start = -(-(len(MAGIC) + 8 + header_room) // ALIGNMENT) * ALIGNMENT
+    offset = data_start
+    for (name, _), size in zip(members, sizes):
+        index[name]["offset"] = offset
+        offset = -(-(offset + size) // ALIGNMENT) * ALIGNMENT
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.seek(data_start)
+        for name, source in members:
+            entry = index[name]
+            f.seek(entry["offset"])
+            digest = hashlib.sha256()
+            written = 0
+            with open(source, "rb") as src:
+                while True:
+                    chunk = src.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+                    written += len(chunk)
+            if written != entry["size"]:
+                raise ValueError(f"{source} changed while it was being bundled")
+            entry["sha256"] = digest.hexdigest()
+        f.truncate(offset)
+        encoded = json.dumps(index, separators=(",", ":")).encode()
+        f.seek(0)
+        f.write(MAGIC + struct.pack("<Q", data_start - len(MAGIC) - 8) + encoded.ljust(data_start - len(MAGIC) - 8))
+    os.replace(tmp_path, path)
+    return index
+
+class BundleReader:
+    """Random access to the members of a bundle through any ranged reader"""
+
+    def __init__(self, reader):
+        self.reader = reader
+        head = reader.read(0, len(MAGIC) + 8)
+        if head[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a model bundle")
+        (length,) = struct.unpack("<Q", head[len(MAGIC):])
+        self.index: Dict[str, Dict] = json.loads(reader.read(len(MAGIC) + 8, length))
+
+    def iter_member(self, name: str, chunk_size: int = COPY_CHUNK_SIZE) -> Iterator[bytes]:
+        entry = self.index[name]
+        for start in range(0, entry["size"], chunk_size):
+            yield self.reader.read(entry["offset"] + start, min(chunk_size, entry["size"] - start))
+
+    def read(self, name: str) -> bytes:
+        return b"".join(self.iter_member(name))
+
+    def extract(self, name: str, destination: str):
+        """Write one member to destination, verifying its hash and restoring its mtime"""
+        entry = self.index[name]
+        directory = os.path.dirname(destination)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{destination}.part"
+        digest = hashlib.sha256()
+        with open(tmp_path, "wb") as f:
+            for chunk in self.iter_member(name):
+                digest.update(chunk)
+                f.write(chunk)
+        if digest.hexdigest() != entry["sha256"]:
+            os.remove(tmp_path)
+            raise ValueError(f"Bundle member {name} is corrupt")
+        os.utime(tmp_path, (entry["mtime"], entry["mtime"]))
+        os.replace(tmp_path, destination)
+
+    def close(self):
+        self.reader.close()
+
+    def __enter__(self) -> "BundleReader":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+@dataclass
+class BundleInfo:
+    group: str
+    size: int
+    members: List[str]
+
+class BundleStore:
+    """Keeps small model files on the Drive as a few large bundles instead of one object each.
+
+    ``add`` queues a file; a background thread packs queued files into a new
+    bundle once they stop changing, uploads it and then the manifest. Groups
+    (the model type folder) are repacked when dead space from replaced or
+    removed files passes half of their bundles, or when they fragment into too
+    many bundles. ``restore`` fetches each needed bundle once and extracts its
+    members with ranged reads.
+    """
+
+    def __init__(
+        self,
+        drive,
+        directory: str = os.path.join("models", ".bundles"),
+        max_file_bytes: int = 32 * 1024 ** 2,
+        target_bytes: int = 512 * 1024 ** 2,
+        max_bundles_per_group: int = 8,
+        settle_seconds: float = 5.0,
+        live_paths: Optional[Callable[[], Iterable[str]]] = None
+    ):
+        self.drive = drive
+        self.directory = directory
+        self.max_file_bytes = max_file_bytes
+        self.target_bytes = target_bytes
+        self.max_bundles_per_group = max_bundles_per_group
+        self.settle_seconds = settle_seconds
+        self.live_paths = live_paths
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self.bundles: Dict[str, BundleInfo] = {}
+        self.members: Dict[str, Dict] = {}  # path -> {"bundle", "size", "mtime", "sha256"}
+        self._pending: Dict[str, float] = {}  # path -> time queued
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        os.makedirs(directory, exist_ok=True)
+
+    # Manifest
+
+    def load(self):
+        """Fetch and read the manifest from the Drive; a missing one means no bundles"""
+        if self.drive.exists(self.manifest_path):
+            self._drive_get(self.manifest_path)
+        if not os.path.exists(self.manifest_path):
+            return
+        with open(self.manifest_path) as f:
+            data = json.load(f)
+        with self._lock:
+            self.bundles = {bundle_id: BundleInfo(**info) for bundle_id, info in data["bundles"].items()}
+            self.members = data["members"]
+
+    def _save(self):
+        data = {
+            "bundles": {bundle_id: info.__dict__ for bundle_id, info in self.bundles.items()},
+            "members": self.members
+        }
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, self.manifest_path)
+        with DRIVE_SYNC_DURATION.time(operation="upload"), TRACER.span("drive.put", path=self.manifest_path):
+            self.drive.put(self.manifest_path, self.manifest_path)
+
+    def _bundle_path(self, bundle_id: str) -> str:
+        return os.path.join(self.directory, f"{bundle_id}.bundle")
+
+    def _drive_get(self, path: str):
+        with DRIVE_SYNC_DURATION.time(operation="restore"), TRACER.span("drive.get", path=path):
+            self.drive.get(path, overwrite=True)
+
+    # Persisting
+
+    def accepts(self, path: str) -> bool:
+        """Whether a file is small enough to be bundled"""
+        try:
+            return os.path.getsize(path) <= self.max_file_bytes
+        except OSError:
+            return False
+
+    def add(self, path: str):
+        """Queue a file for the next bundle"""
+        with self._lock:
+            self._pending[path] = time.monotonic()
+        self._wake.set()
+
+    def contains(self, path: str) -> bool:
+        """Whether the Drive holds this file's current contents in a bundle"""
+        with self._lock:
+            entry = self.members.get(path)
+        if entry is None:
+            return False
+        try:
+            st = os.stat(path)
+        except OSError:
+            return True
+        return st.st_size == entry["size"] and st.st_mtime == entry["mtime"]
+
+    def flush(self, force: bool = True) -> Optional[str]:
+        """Pack queued files into a new bundle; without force only files that settled"""
+        with self._lock:
+            now = time.monotonic()
+            ready = [
+                path for path, queued in self._pending.items()
+                if force or now - queued >= self.settle_seconds
+            ]
+            for path in ready:
+                self._pending.pop(path)
+        ready = [path for path in ready if os.path.exists(path) and not self.contains(path)]
+        bundle_id = None
+        # Files of one type restore together, so they share bundles
+        groups: Dict[str, List[str]] = {}
+        for path in ready:
+            groups.setdefault(_group(path), []).append(path)
+        for group, paths in groups.items():
+            sizes = {path: os.path.getsize(path) for path in paths}
+            for batch in _batches(paths, sizes, self.target_bytes):
+                bundle_id = self._upload(group, batch)
+        self.prune()
+        self.compact()
+        return bundle_id
+
+    def _upload(self, group: str, paths: List[str], sources: Optional[Dict[str, str]] = None) -> str:
+        bundle_id = f"{group}-{uuid.uuid4().hex[:12]}"
+        path = self._bundle_path(bundle_id)
+        with TRACER.span("bundle.pack", group=group, files=len(paths)):
+            index = write_bundle(path, [(member, (sources or {}).get(member, member)) for member in paths])
+        try:
+            with DRIVE_SYNC_DURATION.time(operation="upload"), TRACER.span("drive.put", path=path):
+                self.drive.put(path, path)
+            with self._lock:
+                self.bundles[bundle_id] = BundleInfo(group, os.path.getsize(path), sorted(index))
+                for member, entry in index.items():
+                    self.members[member] = {"bundle": bundle_id, "size": entry["size"], "mtime": entry["mtime"], "sha256": entry["sha256"]}
+                # The manifest goes up after the bundle, so it never names a missing bundle
+                self._save()
+        finally:
+            os.remove(path)
+        logger.info(f"Bundled {len(paths)} file(s) into {bundle_id}")
+        return bundle_id
+
+    def prune(self):
+        """Forget members whose model left the catalog"""
+        if self.live_paths is None:
+            return
+        live = set(self.live_paths())
+        with self._lock:
+            removed = [path for path in self.members if path not in live]
+            for path in removed:
+                del self.members[path]
+            if removed:
+                self._save()
+
+    def _live_bytes(self) -> Dict[str, int]:
+        live: Dict[str, int] = {}
+        for entry in self.members.values():
+            live[entry["bundle"]] = live.get(entry["bundle"], 0) + entry["size"]
+        return live
+
+    def compact(self):
+        """Repack groups with too much dead space or too many bundles; drop empty bundles"""
+        with self._lock:
+            live = self._live_bytes()
+            by_group: Dict[str, List[str]] = {}
+            for bundle_id, info in self.bundles.items():
+                by_group.setdefault(info.group, []).append(bundle_id)
+        for group, bundle_ids in by_group.items():
+            total = sum(self.bundles[b].size for b in bundle_ids)
+            live_total = sum(live.get(b, 0) for b in bundle_ids)
+            empty = [b for b in bundle_ids if not live.get(b)]
+            if live_total and (live_total * 2 < total or len(bundle_ids) > self.max_bundles_per_group):
+                self._repack(group, bundle_ids)
+            elif empty:
+                self._drop(empty)
+
+    def _repack(self, group: str, bundle_ids: List[str]):
+        members = sorted(path for path, entry in self.members.items() if entry["bundle"] in bundle_ids)
+        with TRACER.span("bundle.repack", group=group, files=len(members)):
+            staging = os.path.join(self.directory, "repack")
+            sources = {}
+            try:
+                for path in members:
+                    if self.contains(path) and os.path.exists(path):
+                        sources[path] = path
+                    else:
+                        # Not on local disk: take it out of its current bundle
+                        staged = os.path.join(staging, hashlib.sha256(path.encode()).hexdigest())
+                        self._extract(path, staged)
+                        sources[path] = staged
+                sizes = {path: self.members[path]["size"] for path in members}
+                for batch in _batches(members, sizes, self.target_bytes):
+                    self._upload(group, batch, sources)
+            finally:
+                for staged in sources.values():
+                    if staged.startswith(staging) and os.path.exists(staged):
+                        os.remove(staged)
+                self._clear_cache(bundle_ids)
+        self._drop(bundle_ids)
+
+    def _drop(self, bundle_ids: List[str]):
+        with self._lock:
+            still_used = {entry["bundle"] for entry in self.members.values()}
+            dropped = [b for b in bundle_ids if b not in still_used and b in self.bundles]
+            for bundle_id in dropped:
+                del self.bundles[bundle_id]
+            if dropped:
+                self._save()
+        delete = getattr(self.drive, "delete", None)
+        for bundle_id in dropped:
+            if delete is not None:
+                try:
+                    delete(self._bundle_path(bundle_id))
+                except Exception as e:
+                    logger.warning(f"Could not delete bundle {bundle_id}: {e}")
+
+    # Restoring
+
+    def _fetch(self, bundle_id: str) -> str:
+        path = self._bundle_path(bundle_id)
+        if not os.path.exists(path):
+            self._drive_get(path)
+        return path
+
+    def _extract(self, member: str, destination: str):
+        entry = self.members[member]
+        with BundleReader(FileRangeReader(self._fetch(entry["bundle"]))) as bundle:
+            bundle.extract(member, destination)
+
+    def restore_member(self, path: str) -> bool:
+        """Restore one bundled file; its bundle stays cached for its neighbours"""
+        with self._lock:
+            if path not in self.members:
+                return False
+        self._extract(path, path)
+        return True
+
+    def restore(self, paths: Optional[Iterable[str]] = None, keep_cache: bool = False) -> int:
+        """Restore bundled files missing locally (all of them by default), one transfer per bundle"""
+        with self._lock:
+            wanted = list(self.members) if paths is None else [p for p in paths if p in self.members]
+            by_bundle: Dict[str, List[str]] = {}
+            for path in wanted:
+                if not os.path.exists(path):
+                    by_bundle.setdefault(self.members[path]["bundle"], []).append(path)
+        restored = 0
+        for bundle_id, members in by_bundle.items():
+            with TRACER.span("bundle.restore", bundle=bundle_id, files=len(members)):
+                with BundleReader(FileRangeReader(self._fetch(bundle_id))) as bundle:
+                    for member in members:
+                        try:
+                            bundle.extract(member, member)
+                            restored += 1
+                        except (KeyError, ValueError) as e:
+                            logger.warning(f"Could not restore {member} from {bundle_id}: {e}")
+            if not keep_cache:
+                self._clear_cache([bundle_id])
+        return restored
+
+    def _clear_cache(self, bundle_ids: Optional[Iterable[str]] = None):
+        """Delete locally cached bundle files"""
+        if bundle_ids is None:
+            bundle_ids = [name[:-len(".bundle")] for name in os.listdir(self.directory) if name.endswith(".bundle")]
+        for bundle_id in bundle_ids:
+            path = self._bundle_path(bundle_id)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def clear_cache(self):
+        self._clear_cache()
+
+    # Background repacking
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="bundle-repack", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.settle_seconds)
+            self._wake.clear()
+            if self._stopping:
+                break
+            # Files queued less than settle_seconds ago wait for the next round
+            if self._pending:
+                try:
+                    self.flush(force=False)
+                except Exception as e:
+                    logger.warning(f"Bundle repack failed: {e}")
+
+    def stop(self, flush: bool = True):
+        """Stop the repack thread, packing anything still queued"""
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if flush and self._pending:
+            self.flush()
+
+def _group(path: str) -> str:
+    return os.path.basename(os.path.dirname(os.path.normpath(path))) or "root"
+
+def _batches(paths: List[str], sizes: Dict[str, int], target_bytes: int) -> Iterator[List[str]]:
+    """Split paths into runs of about target_bytes"""
+    batch: List[str] = []
+    size = 0
+    for path in paths:
+        file_size = sizes[path]
+        if batch and size + file_size > target_bytes:
+            yield batch
+            batch, size = [], 0
+        batch.append(path)
+        size += file_size
+    if batch:
+        yield batch
+
+def store_from_env(drive, live_paths: Optional[Callable[[], Iterable[str]]] = None) -> Optional[BundleStore]:
+    """A BundleStore over drive, unless FLUX_BUNDLE_MAX_FILE_BYTES=0 disables bundling"""
+    max_file = int(os.getenv("FLUX_BUNDLE_MAX_FILE_BYTES", str(32 * 1024 ** 2)))
+    if drive is None or max_file <= 0:
+        return None
+    return BundleStore(
+        drive,
+        max_file_bytes=max_file,
+        target_bytes=int(os.getenv("FLUX_BUNDLE_TARGET_BYTES", str(512 * 1024 ** 2))),
+        live_paths=live_paths
+    )
@@ -0,0 +1,134 @@
+import os
+import time
+import logging
+import threading
+from typing import Dict, List, Sequence
+from model_manager import ModelInfo, ModelManager, ModelType
+from storage import default_is_persisted
+from metrics import DRIVE_SYNC_DURATION, TRACER
+from bundles import store_from_env
+from peers import peers_from_env
+
+COMFYUI_MODELS = os.path.join("ComfyUI", "models")
+
+logger = logging.getLogger(__name__)
+
+class IndexUploader:
+    """Keeps the Drive's copy of models/model_index.json current.
+
+    Boot restores the catalog and usage history from that copy. Every index
+    save (a catalog change or a usage flush) schedules an upload on a
+    background thread; saves within ``settle_seconds`` share one upload.
+    ``upload`` sends the current index right away, e.g. at shutdown.
+    """
+
+    def __init__(self, drive, manager: ModelManager, settle_seconds: float = 5.0):
+        self.drive = drive
+        self.manager = manager
+        self.path = os.path.join(str(manager.base_path), "model_index.json")
+        self.settle_seconds = settle_seconds
+        self._dirty = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self.manager.savers.append(self._dirty.set)
+            self._thread = threading.Thread(target=self._run, name="index-upload", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._dirty.wait()
+            time.sleep(self.settle_seconds)
+            try:
+                self.upload()
+            except Exception as e:
+                logger.warning(f"Model index upload failed: {e}")
+
+    def upload(self):
+        with self._lock:
+            self._dirty.clear()
+            if not os.path.exists(self.path):
+                return
+            with DRIVE_SYNC_DURATION.time(operation="upload"), TRACER.span("drive.put", path=self.path):
+                self.drive.put(self.path, self.path)
+
+class CatalogHost:
+    """The interface web_ui expects from its host (``app.comfy_ui``) for standalone use.
+
+    Inside the Lightning app ComfyUIWork plays this role; main.py and
+    lightning_studio/Main.py use this class. Either way there is one
+    ModelManager over models/<type>/, exposed to ComfyUI through
+    extra_model_paths.yaml.
+    """
+
+    def __init__(
+        self,
+        models_root: str = "models",
+        comfy_url: str = "http://127.0.0.1:8188",
+        drive=None,
+        legacy_roots: Sequence[str] = (COMFYUI_MODELS,)
+    ):
+        self._model_manager = ModelManager(models_root)
+        self._model_manager.sync_directory(list(legacy_roots))
+        self.url = comfy_url
+        self.ready = False
+        self.drive = drive
+        # The catalog and usage counts go back to the Drive whenever the index is saved
+        self.index_uploader = IndexUploader(drive, self._model_manager) if drive is not None else None
+        if self.index_uploader is not None:
+            self.index_uploader.start()
+        # Small files go to the Drive in bundles rather than one object each
+        self.bundles = store_from_env(drive, self._model_paths)
+        if self.bundles is not None:
+            self.bundles.load()
+            self.bundles.start()
+        # Sibling instances serve each other's model files (FLUX_PEER_TOKEN, FLUX_PEERS)
+        self.peers = peers_from_env(self._model_manager)
+        if self.peers is not None:
+            self.peers.start()
+
+    @property
+    def model_manager(self) -> ModelManager:
+        return self._model_manager
+
+    def add_model(self, name: str, model_type: ModelType, source: str, file_path: str, metadata: Dict = None):
+        """Add a model to the manager"""
+        return self._model_manager.add_model(name, model_type, source, file_path, metadata)
+
+    def list_models(self, model_type: ModelType = None) -> List[ModelInfo]:
+        """List available models"""
+        return self._model_manager.list_models(model_type)
+
+    def _model_paths(self) -> List[str]:
+        return [model.path for model in list(self._model_manager.models.values())]
+
+    def persist_model(self, model: ModelInfo):
+        """Copy a model to the persistent Drive, if there is one"""
+        if self.bundles is not None and self.bundles.accepts(model.path):
+            self.bundles.add(model.path)
+        elif self.drive is not None:
+            with DRIVE_SYNC_DURATION.time(operation="upload"), TRACER.span("drive.put", path=model.path):
+                self.drive.put(model.path, model.path)
+
+    def persist_index(self):
+        """Upload the catalog index now, if there is a Drive"""
+        if self.index_uploader is not None:
+            self.index_uploader.upload()
+
+    def is_persisted(self, model: ModelInfo) -> bool:
+        if self.bundles is not None and self.bundles.contains(model.path):
+            return True
+        if self.drive is not None:
+            return self.drive.exists(model.path)
+        return default_is_persisted(model)
+
+    def restore_model(self, model: ModelInfo):
+        if self.peers is not None and self.peers.fetch_model(model):
+            return
+        if self.bundles is not None and self.bundles.restore_member(model.path):
+            return
+        if self.drive is not None and self.drive.exists(model.path):
+            with DRIVE_SYNC_DURATION.time(operation="restore"), TRACER.span("drive.get", path=model.path):
+                self.drive.get(model.path, overwrite=True)
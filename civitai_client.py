@@ -1,8 +1,13 @@
 import os
+import re
+import time
+import asyncio
 import requests
 from typing import Dict, List, Optional
 from dataclasses import dataclass
-from model_manager import ModelType
+from model_manager import ModelType, parse_model_type
+from metrics import TRACER, record_download
+from async_http import SharedSession, stream_to_file
 
 @dataclass
 class CivitaiModel:
@@ -15,23 +20,88 @@ class CivitaiModel:
     base_model: str
     image_url: Optional[str] = None
     nsfw: bool = False
+    downloads: int = 0
+    likes: int = 0
+    sha256: Optional[str] = None
+
+_UNSAFE_FILENAME = re.compile(r"[^A-Za-z0-9._ ()+-]")
+_SAFE_EXTENSION = re.compile(r"\.[A-Za-z0-9]{1,12}")
+
+# Internal ModelType -> Civitai "type" filter values
+CIVITAI_TYPES = {
+    ModelType.CHECKPOINT: "Checkpoint",
+    ModelType.LORA: "LORA",
+    ModelType.EMBEDDING: "TextualInversion",
+    ModelType.VAE: "VAE",
+    ModelType.CONTROLNET: "Controlnet"
+}
+
+def _parse_model(item: Dict) -> CivitaiModel:
+    """Build a CivitaiModel from an API item using its latest version"""
+    latest_version = item["modelVersions"][0]
+    stats = item.get("stats") or {}
+    files = latest_version.get("files") or [{}]
+    # downloadUrl fetches the version's primary file, so its hash is the one to record
+    primary = next((f for f in files if f.get("primary")), files[0])
+    return CivitaiModel(
+        id=item["id"],
+        name=item["name"],
+        type=item["type"],
+        description=item.get("description", ""),
+        download_url=latest_version["downloadUrl"],
+        version_id=latest_version["id"],
+        base_model=latest_version.get("baseModel", "unknown"),
+        image_url=(latest_version.get("images") or [{}])[0].get("url"),
+        nsfw=item.get("nsfw", False),
+        downloads=stats.get("downloadCount", 0),
+        likes=stats.get("thumbsUpCount", 0),
+        sha256=(primary.get("hashes") or {}).get("SHA256")
+    )
+
+def _file_stem(name: str) -> str:
+    """A model name (from the API or a request body) made safe to use as a file name inside target_dir"""
+    stem = _UNSAFE_FILENAME.sub("_", os.path.basename(name.replace("\\", "/"))).lstrip(".")
+    if not stem:
+        raise ValueError(f"Cannot derive a file name from model name {name!r}")
+    return stem
+
+def _target_path(model: CivitaiModel, target_dir: str) -> str:
+    # Determine file extension from URL
+    file_ext = os.path.splitext(model.download_url)[1]
+    if not _SAFE_EXTENSION.fullmatch(file_ext):
+        file_ext = ".safetensors"  # Default to safetensors if no (usable) extension
+    return os.path.join(target_dir, f"{_file_stem(model.name)}{file_ext}")
+
+def _civitai_type(model_type: Optional[str]) -> Optional[str]:
+    """Accept either a ModelType value ("lora") or a raw Civitai type ("LORA")"""
+    if not model_type:
+        return None
+    try:
+        return CIVITAI_TYPES.get(parse_model_type(model_type), model_type)
+    except ValueError:
+        return model_type
 
 class CivitaiClient:
     BASE_URL = "https://civitai.com/api/v1"
     
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None):
         self.api_key = api_key
         self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        if base_url:
+            self.BASE_URL = base_url.rstrip("/")
 
     def _get(self, endpoint: str, params: Dict = None) -> Dict:
         """Make GET request to Civitai API"""
-        response = requests.get(
-            f"{self.BASE_URL}/{endpoint}",
-            headers=self.headers,
-            params=params
-        )
-        response.raise_for_status()
-        return response.json()
+        with TRACER.span("civitai.get", endpoint=endpoint) as span:
+            response = requests.get(
+                f"{self.BASE_URL}/{endpoint}",
+                headers=self.headers,
+                params=params
+            )
+            if span:
+                span.set_attribute("http.status_code", response.status_code)
+            response.raise_for_status()
+            return response.json()
 
     def search_models(self, query: str, type: str = None, nsfw: bool = False, limit: int = 10) -> List[CivitaiModel]:
         """Search for models on Civitai"""
@@ -40,64 +110,36 @@ class CivitaiClient:
             "limit": limit,
             "nsfw": nsfw
         }
-        if type:
-            params["type"] = type
+        civitai_type = _civitai_type(type)
+        if civitai_type:
+            params["types"] = civitai_type
 
         data = self._get("models", params)
-        
-        models = []
-        for item in data.get("items", []):
-            latest_version = item["modelVersions"][0]
-            model = CivitaiModel(
-                id=item["id"],
-                name=item["name"],
-                type=item["type"],
-                description=item.get("description", ""),
-                download_url=latest_version["downloadUrl"],
-                version_id=latest_version["id"],
-                base_model=latest_version.get("baseModel", "unknown"),
-                image_url=latest_version.get("images", [{}])[0].get("url"),
-                nsfw=item.get("nsfw", False)
-            )
-            models.append(model)
-        
-        return models
+        return [_parse_model(item) for item in data.get("items", [])]
 
     def get_model_info(self, model_id: int) -> CivitaiModel:
         """Get detailed information about a specific model"""
-        data = self._get(f"models/{model_id}")
-        latest_version = data["modelVersions"][0]
-        
-        return CivitaiModel(
-            id=data["id"],
-            name=data["name"],
-            type=data["type"],
-            description=data.get("description", ""),
-            download_url=latest_version["downloadUrl"],
-            version_id=latest_version["id"],
-            base_model=latest_version.get("baseModel", "unknown"),
-            image_url=latest_version.get("images", [{}])[0].get("url"),
-            nsfw=data.get("nsfw", False)
-        )
+        return _parse_model(self._get(f"models/{model_id}"))
 
     def download_model(self, model: CivitaiModel, target_dir: str) -> str:
         """Download a model file from Civitai"""
         os.makedirs(target_dir, exist_ok=True)
-        
-        # Determine file extension from URL
-        file_ext = os.path.splitext(model.download_url)[1]
-        if not file_ext:
-            file_ext = ".safetensors"  # Default to safetensors if no extension
-        
-        target_path = os.path.join(target_dir, f"{model.name}{file_ext}")
+        target_path = _target_path(model, target_dir)
         
         # Stream download to avoid memory issues with large files
-        response = requests.get(model.download_url, stream=True)
-        response.raise_for_status()
-        
-        with open(target_path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        start = time.perf_counter()
+        downloaded = 0
+        with TRACER.span("civitai.download", model=model.name, version_id=model.version_id) as span:
+            response = requests.get(model.download_url, stream=True)
+            response.raise_for_status()
+            
+            with open(target_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    f.write(chunk)
+                    downloaded += len(chunk)
+            if span:
+                span.set_attribute("bytes", downloaded)
+        record_download("civitai", downloaded, time.perf_counter() - start)
         
         return target_path
 
@@ -108,6 +150,68 @@ class CivitaiClient:
             "Checkpoint": ModelType.CHECKPOINT,
             "LORA": ModelType.LORA,
             "TextualInversion": ModelType.EMBEDDING,
-            "VAE": ModelType.VAE
+            "VAE": ModelType.VAE,
+            "Controlnet": ModelType.CONTROLNET
         }
         return type_mapping.get(civitai_type, ModelType.CHECKPOINT)
+
+
+class AsyncCivitaiClient:
+    """asyncio variant of CivitaiClient built on a shared aiohttp session"""
+    BASE_URL = CivitaiClient.BASE_URL
+
+    def __init__(self, api_key: Optional[str] = None, session: Optional[SharedSession] = None, base_url: Optional[str] = None, reserve=None, peers=None):
+        self.api_key = api_key
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.session = session or SharedSession()
+        self.reserve = reserve  # disk-space admission hook passed to stream_to_file
+        self.peers = peers  # PeerNode asked for the file by sha256 before Civitai
+        if base_url:
+            self.BASE_URL = base_url.rstrip("/")
+
+    async def _get(self, endpoint: str, params: Dict = None) -> Dict:
+        """Make GET request to Civitai API"""
+        # aiohttp only accepts str/int/float query values
+        params = {k: str(v).lower() if isinstance(v, bool) else v for k, v in (params or {}).items()}
+        with TRACER.span("civitai.get", endpoint=endpoint) as span:
+            async with self.session.get().get(f"{self.BASE_URL}/{endpoint}", headers=self.headers, params=params) as response:
+                if span:
+                    span.set_attribute("http.status_code", response.status)
+                response.raise_for_status()
+                return await response.json()
+
+    async def search_models(self, query: str, type: str = None, nsfw: bool = False, limit: int = 10) -> List[CivitaiModel]:
+        """Search for models on Civitai"""
+        params = {
+            "query": query,
+            "limit": limit,
+            "nsfw": nsfw
+        }
+        civitai_type = _civitai_type(type)
+        if civitai_type:
+            params["types"] = civitai_type
+
+        data = await self._get("models", params)
+        return [_parse_model(item) for item in data.get("items", [])]
+
+    async def get_model_info(self, model_id: int) -> CivitaiModel:
+        """Get detailed information about a specific model"""
+        return _parse_model(await self._get(f"models/{model_id}"))
+
+    async def download_model(self, model: CivitaiModel, target_dir: str, on_progress=None, resume: bool = False) -> str:
+        """Stream a model file from Civitai to disk, optionally resuming a partial download"""
+        target_path = _target_path(model, target_dir)
+        if self.peers is not None and model.sha256:
+            if await asyncio.to_thread(self.peers.fetch, target_path, model.sha256.lower()):
+                return target_path
+        await stream_to_file(
+            self.session.get(),
+            model.download_url,
+            target_path,
+            headers=self.headers,
+            source="civitai",
+            on_progress=on_progress,
+            resume=resume,
+            reserve=self.reserve
+        )
+        return target_path
@@ -0,0 +1,397 @@
+import os
+import json
+import mmap
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from metrics import TRACER, record_cache
+
+class TextEncoder:
+    """Interface for prompt encoders (T5, CLIP, or a stand-in).
+
+    ``model_hash`` identifies the weights, so cached outputs are never reused
+    across encoders; ``encode`` maps a batch of texts to one array each.
+    """
+
+    model_hash: str = ""
+    batch_size: int = 16
+
+    def encode(self, texts: Sequence[str]) -> List[np.ndarray]:
+        raise NotImplementedError
+
+class HashingTextEncoder(TextEncoder):
+    """Small deterministic CPU encoder for tests and benchmarks.
+
+    Each whitespace token maps to a fixed pseudo-random vector, so equal
+    prompts give equal outputs and the cost grows with batch size like a
+    real encoder's, without any model weights.
+    """
+
+    def __init__(self, dim: int = 64, max_tokens: int = 77, seed: int = 0):
+        self.dim = dim
+        self.max_tokens = max_tokens
+        self.seed = seed
+        self.model_hash = f"hashing-{dim}x{max_tokens}-{seed}"
+        self.calls = 0
+
+    def _token(self, token: str) -> np.ndarray:
+        digest = hashlib.blake2b(f"{self.seed}:{token}".encode(), digest_size=8).digest()
+        return np.random.default_rng(int.from_bytes(digest, "little")).standard_normal(self.dim).astype(np.float32)
+
+    def encode(self, texts: Sequence[str]) -> List[np.ndarray]:
+        self.calls += 1
+        outputs = []
+        for text in texts:
+            out = np.zeros((self.max_tokens, self.dim), dtype=np.float32)
+            for i, token in enumerate(text.lower().split()[:self.max_tokens]):
+                out[i] = self._token(token)
+            outputs.append(out)
+        return outputs
+
+def _file_sha256(path: str, chunk_size: int = 8 * 1024 ** 2) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _cached_commit(model_id: str, revision: str) -> Optional[str]:
+    """The commit a revision last resolved to in the local Hugging Face cache, for offline workers"""
+    from huggingface_hub.constants import HF_HUB_CACHE
+    ref = os.path.join(HF_HUB_CACHE, "models--" + model_id.replace("/", "--"), "refs", revision)
+    if os.path.exists(ref):
+        with open(ref) as f:
+            return f.read().strip()
+    return None
+
+class TransformersTextEncoder(TextEncoder):
+    """A Hugging Face text encoder (e.g. google/t5-v1_1-xxl), loaded on first use.
+
+    ``model_hash`` covers the weights actually loaded: the file hashes of a
+    local directory, or the commit a Hub revision resolves to (which is then
+    the revision loaded). Needs torch and transformers, which only GPU
+    workers install.
+    """
+
+    def __init__(self, model_id: str, max_length: int = 512, device: Optional[str] = None, batch_size: int = 8, revision: str = "main"):
+        self.model_id = model_id
+        self.max_length = max_length
+        self.device = device
+        self.batch_size = batch_size
+        self.revision = revision
+        self._model_hash: Optional[str] = None
+        self._hash_lock = threading.Lock()
+        self._model = None
+        self._tokenizer = None
+
+    @property
+    def model_hash(self) -> str:
+        with self._hash_lock:
+            if self._model_hash is None:
+                self._model_hash = hashlib.sha256(f"{self._weights_id()}:{self.max_length}".encode()).hexdigest()
+            return self._model_hash
+
+    def _weights_id(self) -> str:
+        if os.path.isdir(self.model_id):
+            names = sorted(name for name in os.listdir(self.model_id) if name.endswith(".safetensors"))
+            if not names:
+                names = sorted(name for name in os.listdir(self.model_id) if name.endswith(".bin"))
+            if not names:
+                raise ValueError(f"No weights found in {self.model_id}")
+            return ",".join(f"{name}={_file_sha256(os.path.join(self.model_id, name))}" for name in names)
+        # Pin the revision to a commit so the hash and the loaded weights agree
+        from huggingface_hub import HfApi
+        try:
+            commit = HfApi().model_info(self.model_id, revision=self.revision).sha
+        except Exception:
+            commit = _cached_commit(self.model_id, self.revision)
+            if commit is None:
+                raise
+        self.revision = commit
+        return f"{self.model_id}@{commit}"
+
+    def _load(self):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+        self.device = self.device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.model_hash  # resolves self.revision before anything is fetched
+        self._tokenizer = AutoTokenizer.from_pretrained(self.model_id, revision=self.revision)
+        model = AutoModel.from_pretrained(
+            self.model_id,
+            revision=self.revision,
+            torch_dtype=torch.float16 if self.device == "cuda" else torch.float32
+        )
+        self._model = (model.get_encoder() if hasattr(model, "get_encoder") else model).to(self.device).eval()
+
+    def encode(self, texts: Sequence[str]) -> List[np.ndarray]:
+        import torch
+        if self._model is None:
+            self._load()
+        tokens = self._tokenizer(
+            list(texts),
+            padding="max_length",
+            max_length=self.max_length,
+            truncation=True,
+            return_tensors="pt"
+        ).to(self.device)
+        with torch.inference_mode():
+            hidden = self._model(**tokens).last_hidden_state
+        return list(hidden.float().cpu().numpy())
+
+def count_bytes(shape: Sequence[int]) -> int:
+    """Size of an fp16 array of this shape"""
+    return int(np.prod(shape, dtype=np.int64)) * 2
+
+class _Segment:
+    """An append-only file of fp16 arrays plus a JSON-lines index, read through mmap"""
+
+    def __init__(self, directory: str, number: int):
+        self.number = number
+        self.data_path = os.path.join(directory, f"segment-{number:06d}.bin")
+        self.index_path = os.path.join(directory, f"segment-{number:06d}.idx")
+        self.entries: Dict[str, Tuple[int, Tuple[int, ...]]] = {}
+        self.size = 0
+        index_size = 0
+        if os.path.exists(self.index_path):
+            data_size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+            with open(self.index_path, "rb") as f:
+                for line in f:
+                    try:
+                        key, offset, shape = json.loads(line)
+                    except ValueError:
+                        break  # torn final line from a crash
+                    end = offset + count_bytes(shape)
+                    if not line.endswith(b"\n") or end > data_size:
+                        break
+                    self.entries[key] = (offset, tuple(shape))
+                    self.size = max(self.size, end)
+                    index_size += len(line)
+        # Drop anything past the last complete entry before appending
+        self._data = open(self.data_path, "ab")
+        self._data.truncate(self.size)
+        self._index = open(self.index_path, "ab")
+        self._index.truncate(index_size)
+        self._reader = open(self.data_path, "rb")
+        self._mmap = None
+        self._mapped_size = 0
+
+    def append(self, key: str, array: np.ndarray):
+        data = np.ascontiguousarray(array, dtype=np.float16)
+        offset = self.size
+        self._data.write(data.tobytes())
+        self._data.flush()
+        # Index after data: a crash can lose an entry but never point at missing bytes
+        self._index.write(json.dumps([key, offset, list(data.shape)]).encode() + b"\n")
+        self._index.flush()
+        self.entries[key] = (offset, data.shape)
+        self.size += data.nbytes
+
+    def read(self, key: str) -> Optional[np.ndarray]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        offset, shape = entry
+        if self._mapped_size < offset + count_bytes(shape):
+            # Remap after appends; views handed out earlier keep the old mapping alive
+            self._mmap = mmap.mmap(self._reader.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped_size = len(self._mmap)
+        count = int(np.prod(shape))
+        return np.frombuffer(self._mmap, dtype=np.float16, count=count, offset=offset).reshape(shape)
+
+    def close(self, delete: bool = False):
+        self._data.close()
+        self._index.close()
+        self._reader.close()
+        self._mmap = None
+        if delete:
+            for path in (self.data_path, self.index_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+class ConditioningCache:
+    """Text-encoder outputs keyed by (encoder model hash, text), stored as fp16.
+
+    Two tiers: an in-memory LRU bounded by ``memory_bytes`` and a directory of
+    memory-mapped, append-only segments bounded by ``disk_bytes`` (the oldest
+    segment is dropped first). Misses from a call are encoded together in
+    batches of ``encoder.batch_size``.
+    """
+
+    def __init__(
+        self,
+        encoder: TextEncoder,
+        directory: Optional[str] = None,
+        memory_bytes: int = 256 * 1024 ** 2,
+        disk_bytes: int = 4 * 1024 ** 3,
+        segment_bytes: int = 64 * 1024 ** 2
+    ):
+        self.encoder = encoder
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.segment_bytes = segment_bytes
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._memory_used = 0
+        self._segments: List[_Segment] = []
+        self._lock = threading.Lock()
+        # Keys being encoded by some call, so concurrent calls wait instead of encoding them twice
+        self._encoding: Dict[str, Future] = {}
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "encoder_batches": 0}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            numbers = sorted(
+                int(name[len("segment-"):-len(".idx")])
+                for name in os.listdir(directory)
+                if name.startswith("segment-") and name.endswith(".idx")
+            )
+            self._segments = [_Segment(directory, n) for n in numbers]
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.encoder.model_hash}\0{text}".encode()).hexdigest()
+
+    # Tiers
+
+    def _remember(self, key: str, array: np.ndarray):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = array
+        self._memory_used += array.nbytes
+        while self._memory_used > self.memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= evicted.nbytes
+
+    def _read_disk(self, key: str) -> Optional[np.ndarray]:
+        for segment in reversed(self._segments):
+            array = segment.read(key)
+            if array is not None:
+                return array
+        return None
+
+    def _write_disk(self, key: str, array: np.ndarray):
+        if not self.directory:
+            return
+        if not self._segments or self._segments[-1].size >= self.segment_bytes:
+            number = self._segments[-1].number + 1 if self._segments else 0
+            self._segments.append(_Segment(self.directory, number))
+        self._segments[-1].append(key, array)
+        while len(self._segments) > 1 and sum(s.size for s in self._segments) > self.disk_bytes:
+            self._segments.pop(0).close(delete=True)
+
+    def _lookup(self, key: str) -> Optional[np.ndarray]:
+        array = self._memory.get(key)
+        if array is not None:
+            self._memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return array
+        array = self._read_disk(key)
+        if array is not None:
+            self.stats["disk_hits"] += 1
+            self._remember(key, array)
+        return array
+
+    def lookup(self, key: str) -> Optional[np.ndarray]:
+        """A cached output by key, from either tier, without encoding"""
+        with self._lock:
+            return self._lookup(key)
+
+    # Encoding
+
+    def get_many(self, texts: Sequence[str]) -> List[np.ndarray]:
+        """fp16 conditioning for each text, encoding all misses in as few batches as possible.
+
+        A text another call is already encoding is waited for, not encoded again.
+        """
+        keys = [self.key(text) for text in texts]
+        results: Dict[str, np.ndarray] = {}
+        claimed: Dict[str, str] = {}
+        waiting: Dict[str, Future] = {}
+        with self._lock:
+            for key, text in zip(keys, texts):
+                if key in results or key in claimed or key in waiting:
+                    continue
+                array = self._lookup(key)
+                record_cache("conditioning", array is not None)
+                if array is not None:
+                    results[key] = array
+                elif key in self._encoding:
+                    waiting[key] = self._encoding[key]
+                else:
+                    self._encoding[key] = Future()
+                    claimed[key] = text
+
+        pending = list(claimed.items())
+        try:
+            for start in range(0, len(pending), max(1, self.encoder.batch_size)):
+                batch = pending[start:start + self.encoder.batch_size]
+                with TRACER.span("conditioning.encode", texts=len(batch)):
+                    outputs = self.encoder.encode([text for _, text in batch])
+                with self._lock:
+                    self.stats["encoder_batches"] += 1
+                    self.stats["misses"] += len(batch)
+                    for (key, _), output in zip(batch, outputs):
+                        array = np.asarray(output, dtype=np.float16)
+                        self._remember(key, array)
+                        self._write_disk(key, array)
+                        results[key] = array
+                        self._encoding.pop(key).set_result(array)
+        except BaseException as e:
+            # Waiters on texts this call never finished see the same failure
+            with self._lock:
+                for key in claimed:
+                    if key not in results:
+                        self._encoding.pop(key).set_exception(e)
+            raise
+        for key, future in waiting.items():
+            results[key] = future.result()
+        return [results[key] for key in keys]
+
+    def get(self, text: str) -> np.ndarray:
+        return self.get_many([text])[0]
+
+    def ensure(self, texts: Sequence[str]) -> List[str]:
+        """Make sure every text is cached and return their keys"""
+        self.get_many(texts)
+        return [self.key(text) for text in texts]
+
+    def report(self) -> Dict:
+        with self._lock:
+            return {
+                "encoder": self.encoder.model_hash,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_used,
+                "disk_entries": sum(len(s.entries) for s in self._segments),
+                "disk_bytes": sum(s.size for s in self._segments),
+                **self.stats
+            }
+
+    def close(self):
+        with self._lock:
+            for segment in self._segments:
+                segment.close()
+            self._segments = []
+            self._memory.clear()
+            self._memory_used = 0
+
+def encoder_from_env() -> Optional[TextEncoder]:
+    """FLUX_TEXT_ENCODER: unset (no cache), "hashing" (CPU stand-in) or a Hugging Face model id"""
+    name = os.getenv("FLUX_TEXT_ENCODER")
+    if not name:
+        return None
+    if name == "hashing":
+        return HashingTextEncoder()
+    return TransformersTextEncoder(name, max_length=int(os.getenv("FLUX_TEXT_ENCODER_MAX_LENGTH", "512")))
+
+def cache_from_env() -> Optional[ConditioningCache]:
+    encoder = encoder_from_env()
+    if encoder is None:
+        return None
+    return ConditioningCache(
+        encoder,
+        directory=os.getenv("FLUX_CONDITIONING_DIR", "conditioning_cache"),
+        memory_bytes=int(os.getenv("FLUX_CONDITIONING_MEMORY_BYTES", str(256 * 1024 ** 2))),
+        disk_bytes=int(os.getenv("FLUX_CONDITIONING_DISK_BYTES", str(4 * 1024 ** 3)))
+    )
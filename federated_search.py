@@ -0,0 +1,224 @@
+import re
+import math
+import asyncio
+import bisect
+import logging
+import threading
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from model_manager import ModelInfo, ModelManager, ModelType, find_model_type
+from model_sources import ModelSources, SOURCES
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# How much a query token matching each field counts towards the local score
+FIELD_WEIGHTS = {"name": 3.0, "tags": 2.0, "base_model": 1.5, "type": 1.0}
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(str(text).lower())
+
+def dedupe_keys(model: Dict) -> Set[Tuple[str, str]]:
+    """Identity keys shared by local entries and upstream hits for the same file"""
+    metadata = model.get("metadata") or {}
+    keys = set()
+    sha256 = model.get("sha256") or metadata.get("sha256")
+    if sha256:
+        keys.add(("sha256", sha256.lower()))
+    repo_id = metadata.get("repo_id") or (model.get("id") if model.get("source") == "huggingface" else None)
+    if repo_id:
+        keys.add(("repo", str(repo_id).lower()))
+    version_id = metadata.get("version_id") or (model.get("version_id") if model.get("source") == "civitai" else None)
+    if version_id:
+        keys.add(("civitai_version", str(version_id)))
+    return keys
+
+class CatalogIndex:
+    """In-memory inverted index over the local ModelManager catalog.
+
+    Names, tags, base model and type are tokenized into a token -> model map.
+    The index is rebuilt lazily whenever the manager's version changes.
+    """
+
+    def __init__(self, manager: ModelManager):
+        self.manager = manager
+        self._version = -1
+        self._postings: Dict[str, Dict[str, float]] = {}
+        self._tokens: List[str] = []
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        if self._version == self.manager.version:
+            return
+        with self._lock:
+            if self._version == self.manager.version:
+                return
+            version = self.manager.version
+            postings: Dict[str, Dict[str, float]] = defaultdict(dict)
+            for model in list(self.manager.models.values()):
+                for field, tokens in self._fields(model).items():
+                    weight = FIELD_WEIGHTS[field]
+                    for token in tokens:
+                        current = postings[token].get(model.name, 0.0)
+                        postings[token][model.name] = max(current, weight)
+            self._postings = dict(postings)
+            self._tokens = sorted(self._postings)
+            self._version = version
+
+    @staticmethod
+    def _fields(model: ModelInfo) -> Dict[str, Iterable[str]]:
+        metadata = model.metadata or {}
+        tags = metadata.get("tags") or []
+        return {
+            "name": tokenize(model.name),
+            "tags": [t for tag in tags for t in tokenize(tag)],
+            "base_model": tokenize(metadata.get("base_model", "")),
+            "type": tokenize(model.type.value)
+        }
+
+    def _matches(self, token: str) -> Dict[str, float]:
+        """Postings for a query token; prefixes match at a discount"""
+        exact = self._postings.get(token, {})
+        scores = dict(exact)
+        start = bisect.bisect_left(self._tokens, token)
+        for candidate in self._tokens[start:]:
+            if not candidate.startswith(token):
+                break
+            if candidate == token:
+                continue
+            for name, weight in self._postings[candidate].items():
+                scores[name] = max(scores.get(name, 0.0), weight * 0.5)
+        return scores
+
+    def search(self, query: str, model_type: Optional[ModelType] = None, limit: int = 20) -> List[Tuple[ModelInfo, float]]:
+        """Return (model, score) pairs; every query token must match something"""
+        self._refresh()
+        tokens = tokenize(query)
+        if not tokens:
+            candidates = dict.fromkeys(list(self.manager.models), 0.0)
+        else:
+            candidates = None
+            for token in tokens:
+                matches = self._matches(token)
+                if candidates is None:
+                    candidates = matches
+                else:
+                    candidates = {n: s + matches[n] for n, s in candidates.items() if n in matches}
+                if not candidates:
+                    return []
+
+        max_score = sum(FIELD_WEIGHTS["name"] for _ in tokens) or 1.0
+        results = []
+        for name, score in candidates.items():
+            model = self.manager.models.get(name)
+            if model is None or (model_type and model.type != model_type):
+                continue
+            results.append((model, score / max_score))
+        results.sort(key=lambda item: (-item[1], item[0].name))
+        return results[:limit]
+
+def local_result(model: ModelInfo, score: float) -> Dict:
+    metadata = model.metadata or {}
+    return {
+        "name": model.name,
+        "type": model.type.value,
+        "source": "local",
+        "origin": model.source,
+        "path": model.path,
+        "base_model": metadata.get("base_model"),
+        "tags": metadata.get("tags", []),
+        "metadata": metadata,
+        "match_score": score
+    }
+
+def upstream_score(model: Dict, query_tokens: List[str]) -> float:
+    """Blend text match with popularity so well-known exact matches rise to the top"""
+    name_tokens = set(tokenize(model.get("name", "")))
+    tag_tokens = {t for tag in model.get("tags") or [] for t in tokenize(tag)}
+    if query_tokens:
+        matched = sum(1.0 if t in name_tokens else 0.5 if t in tag_tokens else 0.0 for t in query_tokens)
+        match = matched / len(query_tokens)
+    else:
+        match = 0.0
+    popularity = math.log1p(model.get("downloads") or 0) / 12 + math.log1p(model.get("likes") or 0) / 8
+    return 2.0 * match + popularity
+
+class FederatedSearch:
+    """Local-first search across the catalog and all upstream sources"""
+
+    def __init__(self, manager: ModelManager, sources: ModelSources):
+        self.index = CatalogIndex(manager)
+        self.sources = sources
+
+    def search_local(self, query: str, model_type: Optional[str] = None, limit: int = 20) -> List[Dict]:
+        # A filter that names no catalog type (a raw Civitai type) doesn't narrow local results
+        return [local_result(m, s) for m, s in self.index.search(query, find_model_type(model_type), limit)]
+
+    def merge(self, query: str, local: List[Dict], upstream: List[Dict], limit: int) -> List[Dict]:
+        """Rank upstream hits, drop ones already present locally or seen twice, local first"""
+        seen: Set[Tuple[str, str]] = set()
+        for model in local:
+            seen |= dedupe_keys(model)
+
+        query_tokens = tokenize(query)
+        ranked = sorted(upstream, key=lambda m: upstream_score(m, query_tokens), reverse=True)
+        merged = list(local)
+        for model in ranked:
+            keys = dedupe_keys(model)
+            if keys & seen:
+                continue
+            seen |= keys
+            merged.append(dict(model, match_score=upstream_score(model, query_tokens)))
+        return merged[:max(limit, len(local))]
+
+    async def stream(
+        self,
+        query: str,
+        sources: Sequence[str] = SOURCES,
+        model_type: Optional[str] = None,
+        flux_only: bool = False,
+        limit: int = 20
+    ) -> AsyncIterator[Dict]:
+        """Yield the local results immediately, then a re-ranked merge as each upstream answers.
+
+        Like ModelSources.search, a failing upstream is skipped unless it was
+        the only one queried; if every upstream fails the last error is raised.
+        """
+        local = self.search_local(query, model_type, limit)
+        yield {"event": "local", "models": local}
+
+        upstream: List[Dict] = []
+        tasks = {
+            asyncio.ensure_future(self.sources.search_source(source, query, model_type, flux_only, limit)): source
+            for source in sources
+        }
+        error: Optional[Exception] = None
+        failed = 0
+        try:
+            for future in asyncio.as_completed(list(tasks)):
+                try:
+                    hits = await future
+                except Exception as e:
+                    if len(tasks) == 1:
+                        raise
+                    logger.warning(f"Federated search: upstream failed: {e}")
+                    error = e
+                    failed += 1
+                    continue
+                upstream.extend(hits)
+                yield {"event": "upstream", "models": self.merge(query, local, upstream, limit)}
+        finally:
+            for task in tasks:
+                task.cancel()
+        if tasks and failed == len(tasks):
+            raise error
+
+        yield {"event": "done", "models": self.merge(query, local, upstream, limit)}
+
+    async def search(self, query: str, sources: Sequence[str] = SOURCES, model_type: Optional[str] = None, flux_only: bool = False, limit: int = 20) -> List[Dict]:
+        """Non-streaming variant returning the final merged list"""
+        models: List[Dict] = []
+        async for event in self.stream(query, sources, model_type, flux_only, limit):
+            models = event["models"]
+        return models
@@ -1,8 +1,15 @@
 import os
+import re
+import time
 from typing import List, Optional, Dict
 from dataclasses import dataclass
-from huggingface_hub import HfApi, snapshot_download
-from model_manager import ModelType
+from model_manager import MODEL_EXTENSIONS, ModelType
+from metrics import TRACER, record_download
+from async_http import SharedSession, stream_to_file
+
+HF_ENDPOINT = "https://huggingface.co"
+
+_SHARD_NAME = re.compile(r"-\d{5}-of-\d{5}\.")
 
 @dataclass
 class HuggingFaceModel:
@@ -16,10 +23,19 @@ class HuggingFaceModel:
     pipeline_tag: Optional[str] = None
 
 class HuggingFaceClient:
-    def __init__(self, token: Optional[str] = None):
+    def __init__(self, token: Optional[str] = None, endpoint: Optional[str] = None):
         """Initialize the Hugging Face client"""
         self.token = token or os.getenv("HUGGINGFACE_TOKEN")
-        self.api = HfApi(token=self.token)
+        self.endpoint = endpoint
+        self._api = None
+
+    @property
+    def api(self):
+        # huggingface_hub is slow to import; load it on first use
+        if self._api is None:
+            from huggingface_hub import HfApi
+            self._api = HfApi(endpoint=self.endpoint, token=self.token)
+        return self._api
 
     def search_models(self, query: str, model_type: ModelType = None, flux_only: bool = False, limit: int = 20) -> List[HuggingFaceModel]:
         """Search for models on Hugging Face"""
@@ -33,8 +49,9 @@ class HuggingFaceClient:
         if flux_only:
             search_params["author"] = "FluxML"
         
-        # Perform the search
-        results = self.api.list_models(**search_params)
+        # Perform the search; list_models is lazy, so materialize inside the span
+        with TRACER.span("huggingface.search", query=query, limit=limit):
+            results = list(self.api.list_models(**search_params))
         
         # Convert results to HuggingFaceModel objects
         models = []
@@ -45,12 +62,12 @@ class HuggingFaceClient:
                 
             models.append(HuggingFaceModel(
                 id=model.id,
-                name=model.modelId,
+                name=getattr(model, "modelId", None) or model.id,
                 type=model_type_mapped,
-                description=model.description or "",
+                description=getattr(model, "description", None) or "",
                 downloads=getattr(model, "downloads", 0),
                 likes=getattr(model, "likes", 0),
-                tags=model.tags,
+                tags=model.tags or [],
                 pipeline_tag=model.pipeline_tag
             ))
         
@@ -58,18 +75,29 @@ class HuggingFaceClient:
 
     def download_model(self, model_id: str) -> str:
         """Download a model from Hugging Face"""
-        local_dir = snapshot_download(
-            repo_id=model_id,
-            token=self.token,
-            local_dir=os.path.join("models", "huggingface", model_id.split("/")[-1])
+        from huggingface_hub import snapshot_download
+        start = time.perf_counter()
+        with TRACER.span("huggingface.download", repo_id=model_id):
+            local_dir = snapshot_download(
+                repo_id=model_id,
+                token=self.token,
+                endpoint=self.endpoint,
+                local_dir=os.path.join("models", "huggingface", model_id.split("/")[-1])
+            )
+        size = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, files in os.walk(local_dir)
+            for name in files
         )
+        record_download("huggingface", size, time.perf_counter() - start)
         return local_dir
 
     def is_flux_model(self, model_id: str) -> bool:
         """Check if a model is a Flux model"""
         return model_id.startswith("FluxML/") or "flux" in model_id.lower()
 
-    def _map_model_type(self, pipeline_tag: str) -> ModelType:
+    @staticmethod
+    def _map_model_type(pipeline_tag: str) -> ModelType:
         """Map Hugging Face pipeline tags to ModelType"""
         tag_mapping = {
             "text-to-image": ModelType.CHECKPOINT,
@@ -80,3 +108,118 @@ class HuggingFaceClient:
             "vae": ModelType.VAE
         }
         return tag_mapping.get(pipeline_tag, ModelType.CHECKPOINT)
+
+
+def _check_name(name: str) -> str:
+    """A repository name used as a local file name must not leave the target folder"""
+    if not name or name in (".", "..") or "/" in name or "\\" in name:
+        raise ValueError(f"Refusing unsafe model name: {name!r}")
+    return name
+
+def pick_weight_file(siblings: List[Dict], filename: Optional[str] = None) -> Dict:
+    """The one file of a repository to download as a catalog model.
+
+    An explicit ``filename`` must name a file of the repository. Otherwise
+    the single-file checkpoint is chosen: files at the repository root before
+    nested ones (diffusers components), then by MODEL_EXTENSIONS order
+    (safetensors first), then the largest. Sharded weights
+    (``*-00001-of-00003.*``) are not one model file and are never chosen.
+    """
+    if filename:
+        for sibling in siblings:
+            if sibling["rfilename"] == filename:
+                return sibling
+        raise ValueError(f"{filename} is not a file of this repository")
+    candidates = [
+        sibling for sibling in siblings
+        if sibling["rfilename"].lower().endswith(MODEL_EXTENSIONS) and not _SHARD_NAME.search(sibling["rfilename"])
+    ]
+    if not candidates:
+        raise ValueError("Repository has no single-file weights; pass a filename to choose one")
+
+    def rank(sibling: Dict):
+        name = sibling["rfilename"].lower()
+        extension = next(i for i, ext in enumerate(MODEL_EXTENSIONS) if name.endswith(ext))
+        return ("/" in name, extension, -(sibling.get("size") or 0))
+    return min(candidates, key=rank)
+
+def _check_relative(filename: str):
+    """Repository file names come from the remote API; keep them inside the download folder"""
+    parts = filename.replace("\\", "/").split("/")
+    if not filename or os.path.isabs(filename) or filename.startswith(("/", "\\")) or ".." in parts:
+        raise ValueError(f"Refusing unsafe repository file name: {filename!r}")
+
+class AsyncHuggingFaceClient:
+    """asyncio variant of HuggingFaceClient using the Hub REST API over a shared aiohttp session"""
+
+    def __init__(self, token: Optional[str] = None, session: Optional[SharedSession] = None, endpoint: Optional[str] = None, reserve=None):
+        self.token = token or os.getenv("HUGGINGFACE_TOKEN")
+        self.headers = {"Authorization": f"Bearer {self.token}"} if self.token else {}
+        self.session = session or SharedSession()
+        self.endpoint = (endpoint or HF_ENDPOINT).rstrip("/")
+        self.reserve = reserve  # disk-space admission hook passed to stream_to_file
+
+    async def _get(self, path: str, params: Dict = None):
+        with TRACER.span("huggingface.get", path=path) as span:
+            async with self.session.get().get(f"{self.endpoint}{path}", headers=self.headers, params=params) as response:
+                if span:
+                    span.set_attribute("http.status_code", response.status)
+                response.raise_for_status()
+                return await response.json()
+
+    async def search_models(self, query: str, model_type: ModelType = None, flux_only: bool = False, limit: int = 20) -> List[HuggingFaceModel]:
+        """Search for models on Hugging Face"""
+        params = {
+            "search": query,
+            "filter": "text-to-image",
+            "limit": limit
+        }
+        if flux_only:
+            params["author"] = "FluxML"
+
+        models = []
+        for item in await self._get("/api/models", params):
+            pipeline_tag = item.get("pipeline_tag")
+            model_type_mapped = HuggingFaceClient._map_model_type(pipeline_tag) if pipeline_tag else ModelType.CHECKPOINT
+            if model_type and model_type != model_type_mapped:
+                continue
+            repo_id = item.get("id") or item.get("modelId")
+            models.append(HuggingFaceModel(
+                id=repo_id,
+                name=item.get("modelId") or repo_id,
+                type=model_type_mapped,
+                description=item.get("description") or "",
+                downloads=item.get("downloads", 0),
+                likes=item.get("likes", 0),
+                tags=item.get("tags") or [],
+                pipeline_tag=pipeline_tag
+            ))
+        return models
+
+    async def download_model(self, model_id: str, target_dir: str, filename: Optional[str] = None, revision: str = "main", on_progress=None, resume: bool = False) -> str:
+        """Download one weight file of a repository (see pick_weight_file) into target_dir.
+
+        The file is saved as ``<repo name><ext>``, so the catalog entry is a
+        single file like any other model. With ``resume`` a partial file is
+        continued.
+        """
+        params = {"blobs": "true"}
+        if revision != "main":
+            params["revision"] = revision
+        info = await self._get(f"/api/models/{model_id}", params)
+        sibling = pick_weight_file(info.get("siblings", []), filename)
+        remote_name = sibling["rfilename"]
+        _check_relative(remote_name)
+        name = _check_name(model_id.split("/")[-1])
+        target_path = os.path.join(target_dir, name + os.path.splitext(remote_name)[1].lower())
+        await stream_to_file(
+            self.session.get(),
+            f"{self.endpoint}/{model_id}/resolve/{revision}/{remote_name}",
+            target_path,
+            headers=self.headers,
+            source="huggingface",
+            on_progress=on_progress,
+            resume=resume,
+            reserve=self.reserve
+        )
+        return target_path
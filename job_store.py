@@ -0,0 +1,269 @@
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Callable, Dict, List, Optional
+
+class JobStatus(Enum):
+    SUBMITTED = "submitted"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+UNFINISHED = (JobStatus.SUBMITTED, JobStatus.RUNNING)
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    status: JobStatus
+    inputs: Dict
+    outputs: Optional[Dict] = None
+    progress: Dict = field(default_factory=dict)
+    error: Optional[str] = None
+    parent_id: Optional[str] = None
+    attempts: int = 0
+    created_at: float = 0.0
+    updated_at: float = 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status.value,
+            "inputs": self.inputs,
+            "outputs": self.outputs,
+            "progress": self.progress,
+            "error": self.error,
+            "parent_id": self.parent_id,
+            "attempts": self.attempts,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at
+        }
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    inputs TEXT NOT NULL,
+    outputs TEXT,
+    progress TEXT NOT NULL DEFAULT '{}',
+    error TEXT,
+    parent_id TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, kind);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at);
+CREATE INDEX IF NOT EXISTS jobs_parent ON jobs (parent_id);
+"""
+
+class JobStore:
+    """Durable record of generation and download jobs, backed by SQLite in WAL mode.
+
+    Every state change is committed immediately, so after a crash or pod restart
+    ``recover()`` knows exactly which jobs never finished.
+    """
+
+    def __init__(self, path: str = "jobs.db", on_change: Optional[Callable[[str, Dict], None]] = None):
+        self.path = path
+        # Called with (job_id, changed fields) after every state change, e.g. to publish live status
+        self.on_change = on_change
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+
+    def _notify(self, job_id: str, **changes):
+        if self.on_change is not None:
+            self.on_change(job_id, changes)
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Job:
+        return Job(
+            id=row["id"],
+            kind=row["kind"],
+            status=JobStatus(row["status"]),
+            inputs=json.loads(row["inputs"]),
+            outputs=json.loads(row["outputs"]) if row["outputs"] else None,
+            progress=json.loads(row["progress"] or "{}"),
+            error=row["error"],
+            parent_id=row["parent_id"],
+            attempts=row["attempts"],
+            created_at=row["created_at"],
+            updated_at=row["updated_at"]
+        )
+
+    def submit(self, kind: str, inputs: Dict, parent_id: Optional[str] = None, job_id: Optional[str] = None) -> str:
+        """Record a new job and return its id"""
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (id, kind, status, inputs, parent_id, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, JobStatus.SUBMITTED.value, json.dumps(inputs), parent_id, now, now)
+        )
+        self._notify(job_id, kind=kind, status=JobStatus.SUBMITTED.value, parent_id=parent_id, created_at=now)
+        return job_id
+
+    def _set_status(self, job_id: str, status: JobStatus, **columns):
+        assignments = ["status = ?", "updated_at = ?"]
+        params = [status.value, time.time()]
+        for column, value in columns.items():
+            assignments.append(f"{column} = ?")
+            params.append(value)
+        params.append(job_id)
+        self._execute(f"UPDATE jobs SET {', '.join(assignments)} WHERE id = ?", tuple(params))
+        self._notify(job_id, status=status.value)
+
+    def start(self, job_id: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (JobStatus.RUNNING.value, time.time(), job_id)
+            )
+            row = self._conn.execute("SELECT kind, parent_id, created_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is not None:
+            self._notify(job_id, kind=row["kind"], status=JobStatus.RUNNING.value, parent_id=row["parent_id"], created_at=row["created_at"])
+
+    def update_progress(self, job_id: str, **progress):
+        """Merge keys into the job's progress record (e.g. download offsets)"""
+        with self._lock:
+            row = self._conn.execute("SELECT progress FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            merged = json.loads(row["progress"] or "{}")
+            merged.update(progress)
+            self._conn.execute(
+                "UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(merged), time.time(), job_id)
+            )
+        self._notify(job_id, progress=progress)
+
+    def complete(self, job_id: str, outputs: Optional[Dict] = None):
+        self._set_status(job_id, JobStatus.COMPLETED, outputs=json.dumps(outputs or {}))
+
+    def fail(self, job_id: str, error: str):
+        self._set_status(job_id, JobStatus.FAILED, error=error)
+
+    def cancel(self, job_id: str, reason: str = "cancelled"):
+        self._set_status(job_id, JobStatus.CANCELLED, error=reason)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        row = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list(self, kind: Optional[str] = None, status: Optional[JobStatus] = None, parent_id: Optional[str] = None, limit: int = 100, before: Optional[float] = None) -> List[Job]:
+        """Job history, newest first"""
+        clauses, params = [], []
+        if kind:
+            clauses.append("kind = ?")
+            params.append(kind)
+        if status:
+            clauses.append("status = ?")
+            params.append(status.value)
+        if parent_id:
+            clauses.append("parent_id = ?")
+            params.append(parent_id)
+        if before:
+            clauses.append("created_at < ?")
+            params.append(before)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        params.append(limit)
+        rows = self._execute(f"SELECT * FROM jobs {where} ORDER BY created_at DESC LIMIT ?", tuple(params)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def children(self, parent_id: str, status: Optional[JobStatus] = None) -> List[Job]:
+        """All jobs recorded under a parent (e.g. a batch's items), oldest first"""
+        sql = "SELECT * FROM jobs WHERE parent_id = ?"
+        params = [parent_id]
+        if status:
+            sql += " AND status = ?"
+            params.append(status.value)
+        rows = self._execute(sql + " ORDER BY created_at", tuple(params)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def unfinished(self, kind: Optional[str] = None) -> List[Job]:
+        """Jobs that were submitted or running, oldest first"""
+        sql = "SELECT * FROM jobs WHERE status IN (?, ?)"
+        params = [s.value for s in UNFINISHED]
+        if kind:
+            sql += " AND kind = ?"
+            params.append(kind)
+        rows = self._execute(sql + " ORDER BY created_at", tuple(params)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def recover(self, max_attempts: int = 3) -> List[Job]:
+        """Reset interrupted jobs to submitted and return the ones to re-enqueue.
+
+        Jobs that already used up ``max_attempts`` are marked failed instead, so
+        a job that crashes the process cannot loop forever.
+        """
+        recovered = []
+        for job in self.unfinished():
+            if job.attempts >= max_attempts:
+                self.fail(job.id, f"Gave up after {job.attempts} attempts")
+                continue
+            self._set_status(job.id, JobStatus.SUBMITTED)
+            job.status = JobStatus.SUBMITTED
+            recovered.append(job)
+        return recovered
+
+    @contextmanager
+    def track(self, kind: str, inputs: Dict, job_id: Optional[str] = None, parent_id: Optional[str] = None, shutting_down: Callable[[], bool] = lambda: False):
+        """Record a job around a block of work.
+
+        The job is completed with ``handle.outputs`` when the block succeeds and
+        failed when it raises. If the work is cancelled it is marked cancelled,
+        unless ``shutting_down()`` is true: then it stays running so the next
+        process recovers it.
+        """
+        if job_id is None:
+            job_id = self.submit(kind, inputs, parent_id)
+        self.start(job_id)
+        handle = JobHandle(self, job_id)
+        try:
+            yield handle
+        except Exception as e:
+            self.fail(job_id, getattr(e, "detail", None) or str(e) or type(e).__name__)
+            raise
+        except BaseException:
+            if not shutting_down():
+                self.cancel(job_id)
+            raise
+        else:
+            self.complete(job_id, handle.outputs)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class JobHandle:
+    """Handle given to the body of JobStore.track"""
+
+    def __init__(self, store: JobStore, job_id: str, progress_interval: float = 1.0):
+        self.store = store
+        self.id = job_id
+        self.outputs: Optional[Dict] = None
+        self.progress_interval = progress_interval
+        self._last_progress = 0.0
+
+    def progress(self, force: bool = False, **progress):
+        """Persist progress, at most once per progress_interval unless forced"""
+        now = time.monotonic()
+        if force or now - self._last_progress >= self.progress_interval:
+            self._last_progress = now
+            self.store.update_progress(self.id, **progress)
@@ -1,24 +1,20 @@
 from lightning_app import LightningWork
-from lightning_app.components import serve
-from lightning_app.utilities.state import AppState
-import time
+from typing import Dict
 
 class StudioUI(LightningWork):
+    """Holds the studio's status (ports, readiness) as Lightning state.
+
+    The flow calls run() on every loop with the current status. Calls are
+    cached by argument, so the work only runs, and Lightning only sends a
+    state delta, when the status actually changes. Per-job detail is streamed
+    by the web app at /api/status/events.
+    """
+
     def __init__(self):
-        super().__init__()
+        super().__init__(cache_calls=True)
         self.ready = False
+        self.status: Dict = {}
 
-    def run(self):
-        @serve
-        def studio_ui(state: AppState):
-            return {
-                "status": "running",
-                "comfy_port": state.comfy_ui.comfy_port,
-                "web_port": state.comfy_ui.web_port,
-                "lightning_port": state.comfy_ui.lightning_port,
-                "ready": state.comfy_ui.ready
-            }
-        
+    def run(self, status: Dict):
+        self.status = {"status": "running", **status}
         self.ready = True
-        while True:
-            time.sleep(1) 
\ No newline at end of file
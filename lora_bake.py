@@ -0,0 +1,266 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from model_manager import ModelInfo, ModelManager, ModelType
+from safetensors_io import FLOAT_DTYPES, SafetensorsFile, SafetensorsWriter, file_sha256, from_float32
+from metrics import REGISTRY, TRACER
+
+logger = logging.getLogger(__name__)
+
+BAKE_VERSION = 1  # bump when the merge math changes, so cached bakes are rebuilt
+
+BAKE_DURATION = REGISTRY.histogram(
+    "flux_lora_bake_seconds",
+    "Time to merge LoRAs into a checkpoint",
+    ["cached"],
+    buckets=(0.1, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+)
+
+# Checkpoint key prefixes and the kohya-style LoRA prefixes that address them
+_KOHYA_PREFIXES = (
+    ("model.diffusion_model.", "lora_unet_"),
+    ("diffusion_model.", "lora_unet_"),
+    ("", "lora_unet_"),
+    ("cond_stage_model.transformer.", "lora_te_"),
+    ("conditioner.embedders.0.transformer.", "lora_te1_"),
+    ("conditioner.embedders.1.model.", "lora_te2_"),
+    ("text_encoders.clip_l.transformer.", "lora_te1_"),
+    ("text_encoders.t5xxl.transformer.", "lora_te2_")
+)
+# Prefixes dotted (diffusers/PEFT-style) LoRA keys may carry on top of the module path
+_DOTTED_PREFIXES = ("base_model.model.", "transformer.", "unet.", "diffusion_model.", "model.diffusion_model.")
+_LORA_SUFFIX = re.compile(r"\.(lora_down|lora_up|lora_A|lora_B|down|up)\.weight$|\.alpha$")
+
+@dataclass
+class LoraPatch:
+    """One low-rank update: weight += strength * scale * up @ down"""
+    down: str
+    up: str
+    scale: float
+    strength: float
+    lora: int  # index into the bake's LoRA list
+
+@dataclass
+class BakeResult:
+    model: ModelInfo
+    cached: bool
+    patched: int = 0
+    unmatched: Dict[str, List[str]] = field(default_factory=dict)
+    elapsed: float = 0.0
+
+def _lora_modules(lora: SafetensorsFile) -> Dict[str, Tuple[str, str, float]]:
+    """Module name -> (down key, up key, alpha / rank) for every LoRA pair in a file"""
+    modules = {}
+    for key in lora.keys():
+        match = _LORA_SUFFIX.search(key)
+        if match is None or match.group(1) not in ("lora_down", "lora_A", "down"):
+            continue
+        module = key[:match.start()]
+        suffix = match.group(1)
+        up_suffix = {"lora_down": "lora_up", "lora_A": "lora_B", "down": "up"}[suffix]
+        up = f"{module}.{up_suffix}.weight"
+        if up not in lora:
+            continue
+        rank = lora.shape(key)[0]
+        alpha_key = f"{module}.alpha"
+        alpha = float(np.asarray(lora.float32(alpha_key)).reshape(-1)[0]) if alpha_key in lora else float(rank)
+        modules[module] = (key, up, alpha / rank)
+    return modules
+
+def _module_index(checkpoint: SafetensorsFile) -> Dict[str, str]:
+    """Every name a LoRA may use for a checkpoint weight -> that weight's key"""
+    index = {}
+    for key in checkpoint.keys():
+        if not key.endswith(".weight") or checkpoint.dtype(key) not in FLOAT_DTYPES:
+            continue
+        module = key[:-len(".weight")]
+        index.setdefault(module, key)
+        for ckpt_prefix, kohya_prefix in _KOHYA_PREFIXES:
+            if module.startswith(ckpt_prefix):
+                index.setdefault(kohya_prefix + module[len(ckpt_prefix):].replace(".", "_"), key)
+                if ckpt_prefix:
+                    index.setdefault(module[len(ckpt_prefix):], key)
+    return index
+
+def _resolve(module: str, index: Dict[str, str]) -> Optional[str]:
+    if module in index:
+        return index[module]
+    for prefix in _DOTTED_PREFIXES:
+        if module.startswith(prefix) and module[len(prefix):] in index:
+            return index[module[len(prefix):]]
+    return None
+
+def _delta(lora: SafetensorsFile, patch: LoraPatch, shape: Tuple[int, ...]) -> np.ndarray:
+    down = lora.float32(patch.down)
+    up = lora.float32(patch.up)
+    rank = down.shape[0]
+    delta = up.reshape(up.shape[0], rank) @ down.reshape(rank, -1)
+    return (delta * (patch.strength * patch.scale)).reshape(shape)
+
+def bake_key(checkpoint_hash: str, loras: List[Tuple[str, float]]) -> str:
+    """Cache key for a bake: the checkpoint's and LoRAs' content hashes plus strengths.
+
+    LoRA updates are additive, so the order they are listed in doesn't matter.
+    """
+    parts = [f"v{BAKE_VERSION}", checkpoint_hash]
+    parts.extend(f"{lora_hash}:{strength:.6g}" for lora_hash, strength in sorted(loras))
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+def merge_loras(checkpoint_path: str, loras: List[Tuple[str, float]], output_path: str, metadata: Optional[Dict[str, str]] = None) -> Tuple[int, Dict[str, List[str]]]:
+    """Write checkpoint + sum of LoRA updates to output_path, one tensor at a time.
+
+    Both inputs are memory-mapped. Unpatched tensors are copied byte for byte;
+    patched ones are merged in float32 and cast back to their stored dtype, so
+    peak memory is a few copies of the largest patched tensor. Returns the
+    number of patched tensors and, per LoRA path, the modules that matched no
+    checkpoint weight.
+    """
+    files = [SafetensorsFile(path) for path, _ in loras]
+    try:
+        with SafetensorsFile(checkpoint_path) as checkpoint:
+            index = _module_index(checkpoint)
+            patches: Dict[str, List[LoraPatch]] = {}
+            unmatched: Dict[str, List[str]] = {}
+            for i, ((path, strength), lora) in enumerate(zip(loras, files)):
+                for module, (down, up, scale) in _lora_modules(lora).items():
+                    key = _resolve(module, index)
+                    if key is None:
+                        unmatched.setdefault(path, []).append(module)
+                        continue
+                    patches.setdefault(key, []).append(LoraPatch(down, up, scale, strength, i))
+
+            names = checkpoint.keys()
+            specs = [(name, checkpoint.dtype(name), checkpoint.shape(name)) for name in names]
+            merged_metadata = dict(checkpoint.metadata)
+            merged_metadata.update(metadata or {})
+            with SafetensorsWriter(output_path, specs, merged_metadata) as writer:
+                for name in names:
+                    if name not in patches:
+                        writer.write(name, checkpoint.raw(name))
+                        continue
+                    dtype = checkpoint.dtype(name)
+                    weight = checkpoint.float32(name)
+                    for patch in patches[name]:
+                        weight += _delta(files[patch.lora], patch, weight.shape)
+                    writer.write(name, from_float32(weight, dtype))
+                    del weight
+            return len(patches), unmatched
+    finally:
+        for lora in files:
+            lora.close()
+
+class LoraBaker:
+    """Bakes checkpoint + LoRA combinations into single derived checkpoints.
+
+    Results are registered in the ModelManager as checkpoints with source
+    "baked" and a ``derived_from`` provenance record, and are looked up by a
+    key over the inputs' content hashes, so asking for the same combination
+    again returns the existing file.
+    """
+
+    def __init__(self, manager: ModelManager, reserve: Optional[Callable[[str, int], object]] = None):
+        self.manager = manager
+        self.reserve = reserve
+        self._lock = threading.Lock()
+
+    def content_hash(self, model: ModelInfo) -> str:
+        """The model's sha256, computed once and stored in the catalog"""
+        sha256 = self.manager.get_stats(model.name)[2]
+        if sha256 is None:
+            with TRACER.span("bake.hash", model=model.name):
+                sha256 = file_sha256(model.path)
+            self.manager.update_metadata(model.name, sha256=sha256)
+        return sha256
+
+    def find(self, key: str) -> Optional[ModelInfo]:
+        for model in list(self.manager.models.values()):
+            if model.metadata.get("bake_key") == key and os.path.exists(model.path):
+                return model
+        return None
+
+    def _input(self, name: str, model_type: ModelType) -> ModelInfo:
+        model = self.manager.get_model(name)
+        if model is None or model.type != model_type:
+            raise ValueError(f"{model_type.value} {name} not found")
+        if not os.path.exists(model.path):
+            raise ValueError(f"{model_type.value} {name} is not on local disk")
+        if not model.path.endswith((".safetensors", ".sft")):
+            raise ValueError(f"Only safetensors files can be baked: {model.path}")
+        return model
+
+    def bake(self, checkpoint: str, loras: Dict[str, float], name: Optional[str] = None) -> BakeResult:
+        """Merge loras (name -> strength) into checkpoint, reusing a cached bake if there is one"""
+        start = time.perf_counter()
+        base = self._input(checkpoint, ModelType.CHECKPOINT)
+        inputs = [(self._input(lora, ModelType.LORA), strength) for lora, strength in loras.items() if strength]
+        if not inputs:
+            raise ValueError("At least one LoRA with a non-zero strength is required")
+        base_hash = self.content_hash(base)
+        lora_hashes = [(self.content_hash(lora), strength) for lora, strength in inputs]
+        key = bake_key(base_hash, lora_hashes)
+
+        # One bake at a time: they are disk-bound, and a concurrent request for
+        # the same combination should wait for the first rather than redo it
+        with self._lock:
+            cached = self.find(key)
+            if cached is not None:
+                BAKE_DURATION.observe(time.perf_counter() - start, cached="true")
+                return BakeResult(cached, cached=True, elapsed=time.perf_counter() - start)
+
+            name = name or f"{checkpoint}+{'+'.join(lora.name for lora, _ in inputs)}"
+            if self.manager.get_model(name) is not None:
+                name = f"{name}-{key[:8]}"
+            provenance = {
+                "checkpoint": {"name": base.name, "sha256": base_hash},
+                "loras": [
+                    {"name": lora.name, "sha256": lora_hash, "strength": strength}
+                    for (lora, strength), (lora_hash, _) in zip(inputs, lora_hashes)
+                ],
+                "version": BAKE_VERSION
+            }
+            staging = self.manager.base_path / ".staging"
+            staging.mkdir(exist_ok=True)
+            output_path = str(staging / f"{key[:16]}.safetensors")
+            reservation = self.reserve(output_path, os.path.getsize(base.path)) if self.reserve else None
+            try:
+                with TRACER.span("bake.merge", checkpoint=base.name, loras=len(inputs)):
+                    patched, unmatched = merge_loras(
+                        base.path,
+                        [(lora.path, strength) for lora, strength in inputs],
+                        output_path,
+                        {"flux.derived_from": json.dumps(provenance)}
+                    )
+                if not patched:
+                    raise ValueError(f"No LoRA weights matched {base.name}")
+                metadata = {"bake_key": key, "derived_from": provenance}
+                if base.metadata.get("base_model"):
+                    metadata["base_model"] = base.metadata["base_model"]
+                self.manager.add_model(
+                    name=name,
+                    model_type=ModelType.CHECKPOINT,
+                    source="baked",
+                    file_path=output_path,
+                    metadata=metadata
+                )
+            except BaseException:
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                raise
+            finally:
+                if reservation is not None:
+                    reservation.release()
+
+        unmatched = {os.path.basename(path): modules for path, modules in unmatched.items()}
+        for lora_file, modules in unmatched.items():
+            logger.warning(f"{len(modules)} module(s) of {lora_file} match no weight in {base.name}")
+        elapsed = time.perf_counter() - start
+        BAKE_DURATION.observe(elapsed, cached="false")
+        logger.info(f"Baked {name} ({patched} weights patched) in {elapsed:.1f}s")
+        return BakeResult(self.manager.get_model(name), cached=False, patched=patched, unmatched=unmatched, elapsed=elapsed)
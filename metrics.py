@@ -0,0 +1,447 @@
+import os
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Dict[str, str] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.extend(f'{n}="{_escape(v)}"' for n, v in extra.items())
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        """Increment the counter for the given label values"""
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # label key -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        """Record one observation"""
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time spent inside the block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return int(state[-1]) if state else 0
+
+    def sum(self, **labels) -> float:
+        state = self._values.get(self._key(labels))
+        return state[-2] if state else 0.0
+
+    def totals(self) -> Dict[Tuple[str, ...], Tuple[float, int]]:
+        """(sum, count) for every label combination observed so far"""
+        with self._lock:
+            return {key: (state[-2], int(state[-1])) for key, state in self._values.items()}
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = []
+        for key, state in items:
+            cumulative = 0.0
+            for i, bound in enumerate(self.buckets):
+                cumulative += state[i]
+                labels = _format_labels(self.labelnames, key, {"le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{labels} {_format_value(cumulative)}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(state[-1])}")
+        return lines
+
+class MetricsRegistry:
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Metric {metric.name} already registered with a different shape")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    "flux_http_request_duration_seconds",
+    "HTTP request latency by route",
+    ["app", "method", "route", "status"]
+)
+QUEUE_DEPTH = REGISTRY.gauge(
+    "flux_queue_depth",
+    "Number of jobs waiting in a work queue",
+    ["queue"]
+)
+GENERATION_DURATION = REGISTRY.histogram(
+    "flux_generation_duration_seconds",
+    "ComfyUI generation time by model",
+    ["model", "status"]
+)
+DOWNLOAD_BYTES = REGISTRY.counter(
+    "flux_download_bytes_total",
+    "Bytes downloaded from upstream model sources",
+    ["source"]
+)
+DOWNLOAD_DURATION = REGISTRY.histogram(
+    "flux_download_duration_seconds",
+    "Time spent downloading a model file",
+    ["source"]
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "flux_cache_requests_total",
+    "Cache lookups by cache name and result (hit/miss)",
+    ["cache", "result"]
+)
+STARTUP_PHASE_DURATION = REGISTRY.gauge(
+    "flux_startup_phase_seconds",
+    "Duration of each startup phase of the most recent boot",
+    ["phase"]
+)
+DRIVE_SYNC_DURATION = REGISTRY.histogram(
+    "flux_drive_sync_duration_seconds",
+    "Duration of persistent Drive transfers",
+    ["operation"],
+    buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 300.0, 900.0, 1800.0)
+)
+
+def record_cache(cache: str, hit: bool):
+    """Count a cache lookup; the hit ratio is hits / (hits + misses)"""
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+def record_download(source: str, nbytes: int, seconds: float):
+    """Record a finished download for throughput reporting"""
+    DOWNLOAD_BYTES.inc(nbytes, source=source)
+    DOWNLOAD_DURATION.observe(seconds, source=source)
+
+# Tracing
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    start_time: float = 0.0
+    end_time: Optional[float] = None
+    attributes: Dict = field(default_factory=dict)
+    status: str = "ok"
+    error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end_time or time.time()) - self.start_time
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration": self.duration,
+            "attributes": self.attributes,
+            "status": self.status,
+            "error": self.error
+        }
+
+class SpanExporter:
+    """Base class for span exporters; receives every finished span"""
+
+    def export(self, span: Span):
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+class InMemorySpanExporter(SpanExporter):
+    """Keeps finished spans in a bounded list, mainly for tests"""
+
+    def __init__(self, max_spans: int = 10000):
+        self.max_spans = max_spans
+        self._spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        with self._lock:
+            self._spans.append(span)
+            if len(self._spans) > self.max_spans:
+                del self._spans[:len(self._spans) - self.max_spans]
+
+    def get_finished_spans(self) -> List[Span]:
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+class LoggingSpanExporter(SpanExporter):
+    """Writes finished spans to the log"""
+
+    def __init__(self, level: int = logging.INFO):
+        self.level = level
+
+    def export(self, span: Span):
+        logger.log(self.level, "span %s %.3fs status=%s %s", span.name, span.duration, span.status, span.attributes)
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("flux_current_span", default=None)
+
+class Tracer:
+    def __init__(self, exporters: List[SpanExporter] = None):
+        self._exporters: List[SpanExporter] = list(exporters or [])
+
+    def add_exporter(self, exporter: SpanExporter):
+        self._exporters.append(exporter)
+
+    def remove_exporter(self, exporter: SpanExporter):
+        if exporter in self._exporters:
+            self._exporters.remove(exporter)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._exporters)
+
+    @staticmethod
+    def current_span() -> Optional[Span]:
+        return _current_span.get()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Open a span around the block, nested under the current span if any"""
+        if not self._exporters:
+            yield None
+            return
+        parent = _current_span.get()
+        span = Span(
+            name=name,
+            trace_id=parent.trace_id if parent else uuid.uuid4().hex,
+            span_id=uuid.uuid4().hex[:16],
+            parent_id=parent.span_id if parent else None,
+            start_time=time.time(),
+            attributes=dict(attributes)
+        )
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end_time = time.time()
+            _current_span.reset(token)
+            for exporter in list(self._exporters):
+                try:
+                    exporter.export(span)
+                except Exception as e:
+                    logger.warning(f"Span exporter {type(exporter).__name__} failed: {e}")
+
+TRACER = Tracer()
+
+if os.getenv("FLUX_TRACE_LOG"):
+    TRACER.add_exporter(LoggingSpanExporter())
+
+# Startup profiling
+
+class StartupProfiler:
+    """Per-phase timings of the app boot (imports, Drive restore, installs, ComfyUI boot).
+
+    Offsets are measured from when this module was first imported, which the
+    entry points do before anything heavy. Phases always feed the
+    flux_startup_phase_seconds gauge; with FLUX_PROFILE_STARTUP set each one is
+    also logged as it finishes, followed by a summary once the app is ready.
+    """
+
+    def __init__(self, verbose: bool = False):
+        self.origin = time.perf_counter()
+        self.verbose = verbose
+        self.phases: Dict[str, Tuple[float, float]] = {}  # name -> (start offset, duration)
+        self.milestones: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.origin
+
+    @contextmanager
+    def phase(self, name: str):
+        start = self.elapsed()
+        try:
+            with TRACER.span(f"startup.{name}"):
+                yield
+        finally:
+            duration = self.elapsed() - start
+            with self._lock:
+                self.phases[name] = (start, duration)
+            STARTUP_PHASE_DURATION.set(duration, phase=name)
+            if self.verbose:
+                logger.info(f"startup phase {name}: {duration:.3f}s (at +{start:.3f}s)")
+
+    def mark(self, name: str):
+        """Record a milestone such as the first served request or ComfyUI ready"""
+        if name in self.milestones:
+            return
+        with self._lock:
+            if name in self.milestones:
+                return
+            self.milestones[name] = offset = self.elapsed()
+        if self.verbose:
+            logger.info(f"startup milestone {name}: +{offset:.3f}s")
+
+    def report(self) -> Dict:
+        with self._lock:
+            return {
+                "elapsed": self.elapsed(),
+                "phases": {name: {"start": start, "duration": duration} for name, (start, duration) in self.phases.items()},
+                "milestones": dict(self.milestones)
+            }
+
+    def summary(self) -> str:
+        report = self.report()
+        lines = ["Startup profile:"]
+        for name, phase in sorted(report["phases"].items(), key=lambda item: item[1]["start"]):
+            lines.append(f"  {name:<24} {phase['duration']:8.3f}s  (at +{phase['start']:.3f}s)")
+        for name, offset in sorted(report["milestones"].items(), key=lambda item: item[1]):
+            lines.append(f"  {name:<24} at +{offset:.3f}s")
+        return "\n".join(lines)
+
+STARTUP = StartupProfiler(verbose=bool(os.getenv("FLUX_PROFILE_STARTUP")))
@@ -0,0 +1,224 @@
+import os
+import re
+import time
+import struct
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+from model_manager import MODEL_EXTENSIONS, ModelManager, ModelType, parse_model_type
+from safetensors_io import file_sha256, read_header
+from metrics import TRACER
+
+logger = logging.getLogger(__name__)
+
+SAFETENSORS_EXTENSIONS = (".safetensors", ".sft")
+_LORA_KEY = re.compile(r"lora_(down|up|A|B)\b|\.lora\.(down|up)\.|\.alpha$|hada_w\d|lokr_w\d")
+_CONTROLNET_KEY = re.compile(r"^(control_model\.|controlnet_)|input_hint_block|zero_convs")
+_VAE_PREFIXES = ("encoder.", "decoder.", "quant_conv.", "post_quant_conv.", "first_stage_model.", "vae.")
+_CHECKPOINT_PREFIXES = (
+    "model.diffusion_model.", "diffusion_model.", "double_blocks.", "single_blocks.",
+    "transformer_blocks.", "input_blocks.", "down_blocks.", "joint_blocks."
+)
+_EMBEDDING_KEYS = ("emb_params", "string_to_param", "clip_l", "clip_g")
+
+def detect_type(header: Dict[str, Dict]) -> Optional[ModelType]:
+    """Guess a model's type from its safetensors tensor names and shapes; None if unsure"""
+    keys = list(header)
+    if not keys:
+        return None
+    if any(_LORA_KEY.search(key) for key in keys):
+        return ModelType.LORA
+    if any(_CONTROLNET_KEY.search(key) for key in keys):
+        return ModelType.CONTROLNET
+    if len(keys) <= 4 and (
+        any(key.startswith(_EMBEDDING_KEYS) for key in keys)
+        or all(len(header[key].get("shape", ())) == 2 for key in keys)
+    ):
+        return ModelType.EMBEDDING
+    if all(key.startswith(_VAE_PREFIXES) for key in keys):
+        return ModelType.VAE
+    if any(key.startswith(_CHECKPOINT_PREFIXES) for key in keys):
+        return ModelType.CHECKPOINT
+    return None
+
+def inspect_file(path: str, hash_file: bool = True) -> Dict:
+    """Size, mtime, sha256 and layout-detected type of one file; runs in pool workers"""
+    try:
+        st = os.stat(path)
+        report = {"size": st.st_size, "mtime": st.st_mtime, "type": None, "metadata": {}}
+        if path.lower().endswith(SAFETENSORS_EXTENSIONS):
+            with open(path, "rb") as f:
+                try:
+                    header, metadata, _ = read_header(f)
+                except (ValueError, struct.error) as e:
+                    return {"error": f"Not a safetensors file: {e}"}
+            model_type = detect_type(header)
+            report["type"] = model_type.value if model_type else None
+            base_model = metadata.get("modelspec.architecture") or metadata.get("ss_base_model_version")
+            if base_model:
+                report["metadata"]["base_model"] = base_model
+        if hash_file:
+            report["metadata"]["sha256"] = file_sha256(path)
+        return report
+    except OSError as e:
+        return {"error": str(e)}
+
+def _folder_hint(path: str) -> Optional[ModelType]:
+    """The type named by the nearest enclosing folder (loras/, checkpoints/, lora/, ...)"""
+    for part in reversed(Path(path).resolve().parent.parts):
+        try:
+            return parse_model_type(part)
+        except ValueError:
+            continue
+    return None
+
+def scan(roots: Sequence[str]) -> Iterator[str]:
+    """Model files under roots, skipping hidden/staging folders and variant shard folders"""
+    for root in roots:
+        if os.path.isfile(root):
+            yield root
+            continue
+        for directory, subdirs, files in os.walk(root):
+            # models/<type>/<name>/ next to <name>.safetensors.index.json holds one model's shards
+            subdirs[:] = sorted(
+                d for d in subdirs
+                if not d.startswith(".") and not os.path.exists(os.path.join(directory, f"{d}.safetensors.index.json"))
+            )
+            for name in sorted(files):
+                if name.lower().endswith(MODEL_EXTENSIONS):
+                    yield os.path.join(directory, name)
+
+@dataclass
+class ImportResult:
+    added: List[str] = field(default_factory=list)
+    updated: List[str] = field(default_factory=list)
+    unchanged: int = 0
+    duplicates: List[str] = field(default_factory=list)  # paths whose content is already in the catalog
+    failed: Dict[str, str] = field(default_factory=dict)  # path -> reason
+    elapsed: float = 0.0
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+class BulkImporter:
+    """Registers model files that already sit on disk, e.g. in ComfyUI/models or a Drive restore.
+
+    Files are hashed and their safetensors headers parsed across a process
+    pool; the type comes from the tensor layout, falling back to the folder
+    name. All catalog changes are committed with one index save. Files the
+    catalog already knows with the same size and mtime are skipped, so a
+    re-run only inspects what changed.
+    """
+
+    def __init__(self, manager: ModelManager, workers: Optional[int] = None, hash_files: bool = True, move: bool = False, source: str = "local"):
+        self.manager = manager
+        self.workers = workers or os.cpu_count() or 1
+        self.hash_files = hash_files
+        self.move = move
+        self.source = source
+
+    def _inspect(self, paths: List[str]) -> List[Dict]:
+        hashes = [self.hash_files] * len(paths)
+        if self.workers <= 1 or len(paths) <= 1:
+            return list(map(inspect_file, paths, hashes))
+        chunksize = max(1, len(paths) // (self.workers * 4))
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(paths))) as pool:
+            return list(pool.map(inspect_file, paths, hashes, chunksize=chunksize))
+
+    def _name(self, path: str, sha256: Optional[str]) -> str:
+        """The file's stem, made unique with its hash prefix or a counter"""
+        stem = Path(path).stem
+        if stem not in self.manager.models:
+            return stem
+        name = f"{stem}-{sha256[:8]}" if sha256 else stem
+        counter = 2
+        while name in self.manager.models:
+            name = f"{stem}-{counter}"
+            counter += 1
+        return name
+
+    def run(self, roots: Sequence[str]) -> ImportResult:
+        start = time.perf_counter()
+        result = ImportResult()
+        manager = self.manager
+        # Runs in a worker thread while requests read and record usage, so snapshot under the catalog lock
+        with manager.lock:
+            known = {os.path.abspath(m.path): name for name, m in manager.models.items()}
+            known_hashes = {}
+            for name in manager.models:
+                sha256 = manager.get_stats(name)[2]
+                if sha256:
+                    known_hashes[sha256] = name
+
+        candidates: List[Tuple[str, Optional[str]]] = []
+        for path in scan(roots):
+            existing = known.get(os.path.abspath(path))
+            if existing is not None:
+                size, mtime, _ = manager.get_stats(existing)
+                try:
+                    st = os.stat(path)
+                except OSError as e:
+                    result.failed[path] = str(e)
+                    continue
+                if st.st_size == size and st.st_mtime == mtime:
+                    result.unchanged += 1
+                    continue
+            candidates.append((path, existing))
+
+        with TRACER.span("import.inspect", files=len(candidates)):
+            reports = self._inspect([path for path, _ in candidates])
+
+        new_hashes: Set[str] = set()
+        with manager.batch():
+            for (path, existing), report in zip(candidates, reports):
+                if "error" in report:
+                    result.failed[path] = report["error"]
+                    continue
+                metadata = report["metadata"]
+                sha256 = metadata.get("sha256")
+                if existing is not None:
+                    manager.refresh_file(existing, **metadata)
+                    result.updated.append(existing)
+                    continue
+                if sha256 and (sha256 in known_hashes or sha256 in new_hashes):
+                    result.duplicates.append(path)
+                    continue
+                model_type = ModelType(report["type"]) if report["type"] else _folder_hint(path)
+                if model_type is None:
+                    result.failed[path] = "Unknown model type"
+                    continue
+                name = self._name(path, sha256)
+                move = self.move and not (manager.base_path / model_type.value / Path(path).name).exists()
+                manager.add_model(name, model_type, self.source, path, metadata, move=move)
+                if sha256:
+                    new_hashes.add(sha256)
+                result.added.append(name)
+
+        result.elapsed = time.perf_counter() - start
+        logger.info(
+            f"Imported {len(result.added)} model(s), updated {len(result.updated)}, "
+            f"{result.unchanged} unchanged, {len(result.duplicates)} duplicate(s), "
+            f"{len(result.failed)} failed in {result.elapsed:.1f}s"
+        )
+        return result
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Register model files already on disk in the catalog")
+    parser.add_argument("roots", nargs="*", default=["models", os.path.join("ComfyUI", "models")], help="Files or directories to scan")
+    parser.add_argument("--models-dir", default="models")
+    parser.add_argument("--workers", type=int, default=None, help="Inspection processes (default: one per CPU)")
+    parser.add_argument("--no-hash", action="store_true", help="Skip sha256 hashing")
+    parser.add_argument("--move", action="store_true", help="Move files into models/<type>/ instead of registering them in place")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    importer = BulkImporter(ModelManager(args.models_dir), args.workers, not args.no_hash, args.move)
+    result = importer.run([root for root in args.roots if os.path.exists(root)])
+    for path, reason in result.failed.items():
+        logger.warning(f"{path}: {reason}")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,12 @@
 import os
+import sys
+import time
 import json
-import requests
+import threading
+from array import array
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 from dataclasses import dataclass
 from enum import Enum
 
@@ -11,22 +15,124 @@ class ModelType(Enum):
     LORA = "lora"
     VAE = "vae"
     EMBEDDING = "embedding"
+    CONTROLNET = "controlnet"
+
+# ModelType -> ComfyUI model folder; models/<type>/ is mapped onto these through
+# ComfyUI's extra_model_paths.yaml so both read the same files
+COMFYUI_FOLDERS = {
+    ModelType.CHECKPOINT: "checkpoints",
+    ModelType.LORA: "loras",
+    ModelType.VAE: "vae",
+    ModelType.EMBEDDING: "embeddings",
+    ModelType.CONTROLNET: "controlnet"
+}
+_FOLDER_TYPES = {folder: model_type for model_type, folder in COMFYUI_FOLDERS.items()}
+MODEL_EXTENSIONS = (".safetensors", ".sft", ".ckpt", ".pt", ".pth", ".bin", ".gguf")
+
+def parse_model_type(value: str) -> ModelType:
+    """Accept both type names ("checkpoint") and ComfyUI folder names ("checkpoints")"""
+    if value in _FOLDER_TYPES:
+        return _FOLDER_TYPES[value]
+    return ModelType(value)
+
+def find_model_type(value: Optional[str]) -> Optional[ModelType]:
+    """Like parse_model_type, in any case; None if value names no ModelType (e.g. Civitai's "TextualInversion")"""
+    if not value:
+        return None
+    try:
+        return parse_model_type(value.lower())
+    except ValueError:
+        return None
 
 @dataclass
 class ModelInfo:
+    # Slotted: a large catalog holds tens of thousands of these
+    __slots__ = ("name", "type", "source", "path", "metadata")
     name: str
     type: ModelType
     source: str
     path: str
     metadata: Dict
 
+HASH_SIZE = 32  # raw sha256 digest bytes per row in the hash column
+_NO_HASH = bytes(HASH_SIZE)
+USAGE_HALF_LIFE = 3 * 86400  # seconds for a model's demand score to halve without use
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+def _intern_metadata(metadata: Dict) -> Dict:
+    """Intern the low-cardinality strings that repeat across the catalog"""
+    if "base_model" in metadata:
+        metadata["base_model"] = _intern(metadata["base_model"])
+    if isinstance(metadata.get("tags"), list):
+        metadata["tags"] = [_intern(tag) for tag in metadata["tags"]]
+    return metadata
+
+def shard_paths(index_path: str) -> List[str]:
+    """The shard files of a sharded model (a .safetensors.index.json), in order"""
+    with open(index_path) as f:
+        weight_map = json.load(f)["weight_map"]
+    root = os.path.dirname(index_path)
+    return [os.path.join(root, name) for name in sorted(set(weight_map.values()))]
+
+def model_files(model: ModelInfo) -> List[str]:
+    """Every file that makes up a model on disk"""
+    if model.metadata.get("sharded") and os.path.exists(model.path):
+        return [model.path, *shard_paths(model.path)]
+    return [model.path]
+
 class ModelManager:
     def __init__(self, base_path: str = "models"):
         self.base_path = Path(base_path)
         self.models: Dict[str, ModelInfo] = {}
+        # Held by every read and change; importers, hashing and usage flushes run in worker threads.
+        # Iterate models directly only under it (list(models.values()) is a safe snapshot)
+        self.lock = threading.RLock()
+        # Bumped on every catalog change so derived views (search index) can refresh
+        self.version = 0
+        # Called after every catalog change, e.g. to publish live status
+        self.listeners: List[Callable[[], None]] = []
+        # Called after the index file is rewritten (catalog changes and usage flushes), e.g. to upload it
+        self.savers: List[Callable[[], None]] = []
+        # Columnar per-file stats; each model owns one row
+        self._rows: Dict[str, int] = {}
+        self._free_rows: List[int] = []
+        self._sizes = array("q")
+        self._mtimes = array("d")
+        self._hashes = bytearray()
+        # Usage: request count, exponentially decayed demand score and last use
+        self._uses = array("q")
+        self._scores = array("d")
+        self._last_used = array("d")
+        self._usage_dirty = False
+        # Pre-serialized JSON per model and per listing (keyed by type, tagged with version)
+        self._fragments: Dict[str, bytes] = {}
+        self._entries: Dict[str, bytes] = {}
+        self._listings: Dict[Optional[ModelType], Tuple[int, bytes]] = {}
+        # Inside batch(): index saves and listener calls wait until the batch ends
+        self._batch_depth = 0
+        self._batch_saved = False
+        self._batch_notified = False
         self._init_directories()
         self._load_model_index()
 
+    def reload(self):
+        """Re-read the index from disk, e.g. after restoring it from persistent storage"""
+        with self.lock:
+            self.models.clear()
+            self._rows.clear()
+            self._free_rows.clear()
+            for column in (self._sizes, self._mtimes, self._uses, self._scores, self._last_used):
+                del column[:]
+            del self._hashes[:]
+            self._fragments.clear()
+            self._entries.clear()
+            self._listings.clear()
+            self._load_model_index()
+            self.version += 1
+            self._notify()
+
     def _init_directories(self):
         """Initialize directory structure for different model types"""
         for model_type in ModelType:
@@ -39,50 +145,331 @@ class ModelManager:
             with open(index_path, "r") as f:
                 data = json.load(f)
                 for model_data in data.values():
-                    self.models[model_data["name"]] = ModelInfo(
+                    model = ModelInfo(
                         name=model_data["name"],
                         type=ModelType(model_data["type"]),
-                        source=model_data["source"],
+                        source=_intern(model_data["source"]),
                         path=model_data["path"],
-                        metadata=model_data.get("metadata", {})
+                        metadata=_intern_metadata(model_data.get("metadata", {}))
                     )
+                    self.models[model.name] = model
+                    if "size" in model_data:
+                        self._set_stats(model, model_data["size"], model_data.get("mtime", 0.0), model_data.get("sha256"))
+                    else:
+                        self._stat_file(model)
+                    usage = model_data.get("usage")
+                    if usage:
+                        row = self._rows[model.name]
+                        self._uses[row] = usage.get("uses", 0)
+                        self._scores[row] = usage.get("score", 0.0)
+                        self._last_used[row] = usage.get("last_used", 0.0)
+
+    @contextmanager
+    def batch(self):
+        """Group catalog changes into one index save and one change notification"""
+        with self.lock:
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    save, self._batch_saved = self._batch_saved, False
+                    notify, self._batch_notified = self._batch_notified, False
+                    if save:
+                        self._save_model_index()
+                    if notify:
+                        self._notify()
 
     def _save_model_index(self):
-        """Save current model index to disk"""
+        """Save current model index to disk from the cached per-model fragments"""
+        if self._batch_depth:
+            self._batch_saved = True
+            return
         index_path = self.base_path / "model_index.json"
-        data = {
-            model.name: {
+        tmp_path = index_path.with_suffix(".json.tmp")
+        body = b"{" + b",\n".join(self._index_entry(name) for name in self.models) + b"}"
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+        os.replace(tmp_path, index_path)
+        self._usage_dirty = False
+        for saver in self.savers:
+            saver()
+
+    # Columnar stats
+
+    def _allocate_row(self, name: str) -> int:
+        row = self._rows.get(name)
+        if row is not None:
+            return row
+        if self._free_rows:
+            row = self._free_rows.pop()
+        else:
+            row = len(self._sizes)
+            self._sizes.append(0)
+            self._mtimes.append(0.0)
+            self._hashes.extend(_NO_HASH)
+            self._uses.append(0)
+            self._scores.append(0.0)
+            self._last_used.append(0.0)
+        self._rows[name] = row
+        return row
+
+    def _release_row(self, name: str):
+        row = self._rows.pop(name, None)
+        if row is not None:
+            self._sizes[row] = 0
+            self._mtimes[row] = 0.0
+            self._hashes[row * HASH_SIZE:(row + 1) * HASH_SIZE] = _NO_HASH
+            self._uses[row] = 0
+            self._scores[row] = 0.0
+            self._last_used[row] = 0.0
+            self._free_rows.append(row)
+
+    def _set_stats(self, model: ModelInfo, size: int, mtime: float, sha256: Optional[str] = None):
+        row = self._allocate_row(model.name)
+        self._sizes[row] = int(size)
+        self._mtimes[row] = float(mtime)
+        sha256 = sha256 or model.metadata.get("sha256")
+        if sha256:
+            try:
+                digest = bytes.fromhex(sha256)
+            except ValueError:
+                return
+            if len(digest) == HASH_SIZE:
+                self._hashes[row * HASH_SIZE:(row + 1) * HASH_SIZE] = digest
+
+    def _stat_file(self, model: ModelInfo):
+        try:
+            st = os.stat(model.path)
+            self._set_stats(model, st.st_size, st.st_mtime)
+        except OSError:
+            self._set_stats(model, 0, 0.0)
+
+    def get_stats(self, name: str) -> Tuple[int, float, Optional[str]]:
+        """Return (size, mtime, sha256 hex or None) for a model"""
+        with self.lock:
+            row = self._rows[name]
+            digest = bytes(self._hashes[row * HASH_SIZE:(row + 1) * HASH_SIZE])
+            return self._sizes[row], self._mtimes[row], digest.hex() if digest != _NO_HASH else None
+
+    # Usage
+
+    def record_use(self, name: str, now: Optional[float] = None):
+        """Count a request for a model; persisted on the next index save or flush_usage()"""
+        with self.lock:
+            row = self._rows.get(name)
+            if row is None:
+                return
+            now = now or time.time()
+            self._scores[row] = self._decayed_score(row, now) + 1.0
+            self._uses[row] += 1
+            self._last_used[row] = now
+            # Usage lives only in the index entry, so listings and the search index stay cached
+            self._entries.pop(name, None)
+            self._usage_dirty = True
+
+    def _decayed_score(self, row: int, now: float) -> float:
+        age = max(0.0, now - self._last_used[row])
+        return self._scores[row] * 0.5 ** (age / USAGE_HALF_LIFE)
+
+    def get_usage(self, name: str, now: Optional[float] = None) -> Dict:
+        """Return {"uses", "last_used", "demand"} for a model"""
+        with self.lock:
+            row = self._rows[name]
+            return {
+                "uses": self._uses[row],
+                "last_used": self._last_used[row],
+                "demand": self._decayed_score(row, now or time.time())
+            }
+
+    def top_models(self, n: int, model_type: ModelType = None, now: Optional[float] = None) -> List[ModelInfo]:
+        """The n used models with the highest predicted demand (recency-weighted use count)"""
+        with self.lock:
+            now = now or time.time()
+            ranked = []
+            for name, row in self._rows.items():
+                if self._uses[row] == 0:
+                    continue
+                model = self.models[name]
+                if model_type and model.type != model_type:
+                    continue
+                ranked.append((self._decayed_score(row, now), name))
+            ranked.sort(reverse=True)
+            return [self.models[name] for _, name in ranked[:n]]
+
+    def flush_usage(self):
+        """Persist usage recorded since the last save"""
+        with self.lock:
+            if self._usage_dirty:
+                self._save_model_index()
+
+    # Serialization cache
+
+    def _fragment(self, name: str) -> bytes:
+        fragment = self._fragments.get(name)
+        if fragment is None:
+            model = self.models[name]
+            size, mtime, sha256 = self.get_stats(name)
+            fragment = json.dumps({
                 "name": model.name,
                 "type": model.type.value,
                 "source": model.source,
                 "path": model.path,
-                "metadata": model.metadata
-            }
-            for model in self.models.values()
-        }
-        with open(index_path, "w") as f:
-            json.dump(data, f, indent=2)
+                "metadata": model.metadata,
+                "size": size,
+                "mtime": mtime,
+                "sha256": sha256
+            }, separators=(",", ":")).encode()
+            self._fragments[name] = fragment
+        return fragment
+
+    def _index_entry(self, name: str) -> bytes:
+        entry = self._entries.get(name)
+        if entry is None:
+            fragment = self._fragment(name)
+            row = self._rows[name]
+            if self._uses[row]:
+                usage = json.dumps({
+                    "uses": self._uses[row],
+                    "score": self._scores[row],
+                    "last_used": self._last_used[row]
+                }, separators=(",", ":")).encode()
+                fragment = fragment[:-1] + b',"usage":' + usage + b"}"
+            entry = self._entries[name] = json.dumps(name).encode() + b":" + fragment
+        return entry
+
+    def _changed(self, name: str):
+        """Invalidate cached serializations after a catalog change"""
+        self._fragments.pop(name, None)
+        self._entries.pop(name, None)
+        self._listings.clear()
+        self.version += 1
+        self._notify()
+
+    def _notify(self):
+        if self._batch_depth:
+            self._batch_notified = True
+            return
+        for listener in self.listeners:
+            listener()
+
+    def list_models_json(self, model_type: ModelType = None) -> bytes:
+        """Serialized {"models": [...]} listing, rebuilt only after catalog changes"""
+        with self.lock:
+            cached = self._listings.get(model_type)
+            if cached is not None and cached[0] == self.version:
+                return cached[1]
+            names = (m.name for m in self.list_models(model_type))
+            body = b'{"models":[' + b",".join(self._fragment(n) for n in names) + b"]}"
+            self._listings[model_type] = (self.version, body)
+            return body
+
+    def add_model(self, name: str, model_type: ModelType, source: str, file_path: str, metadata: Dict = None, move: bool = True):
+        """Add a new model to the manager; move=False registers the file where it is"""
+        with self.lock:
+            self._add(name, model_type, source, file_path, metadata, move)
+            self._save_model_index()
 
-    def add_model(self, name: str, model_type: ModelType, source: str, file_path: str, metadata: Dict = None):
-        """Add a new model to the manager"""
+    def _add(self, name: str, model_type: ModelType, source: str, file_path: str, metadata: Dict = None, move: bool = True):
         if name in self.models:
             raise ValueError(f"Model {name} already exists")
 
-        target_dir = self.base_path / model_type.value
-        target_path = str(target_dir / Path(file_path).name)
-        
-        # Copy or move file to models directory
-        if os.path.exists(file_path):
-            os.rename(file_path, target_path)
-        
-        self.models[name] = ModelInfo(
+        if move:
+            target_dir = self.base_path / model_type.value
+            target_path = str(target_dir / Path(file_path).name)
+
+            # Copy or move file to models directory
+            if os.path.exists(file_path):
+                os.rename(file_path, target_path)
+        else:
+            target_path = file_path
+
+        model = ModelInfo(
             name=name,
             type=model_type,
-            source=source,
+            source=_intern(source),
             path=target_path,
-            metadata=metadata or {}
+            metadata=_intern_metadata(metadata or {})
         )
-        self._save_model_index()
+        self.models[name] = model
+        self._stat_file(model)
+        self._changed(name)
+
+    def sync_directory(self, legacy_roots: List[str] = ()) -> List[str]:
+        """Register model files that were placed on disk without going through the catalog.
+
+        Scans models/<type>/ plus ComfyUI-style folders (models/checkpoints/,
+        and each of ``legacy_roots``, e.g. ComfyUI/models) and moves files from
+        the latter into the canonical layout. One pass at startup replaces the
+        per-request directory walks; returns the names added.
+        """
+        with self.lock:
+            known_paths = {os.path.abspath(m.path) for m in self.models.values()}
+            added = []
+            folders = [(self.base_path / t.value, t) for t in ModelType]
+            for root in [self.base_path, *map(Path, legacy_roots)]:
+                folders.extend((root / folder, t) for t, folder in COMFYUI_FOLDERS.items() if folder != t.value)
+                if root != self.base_path:
+                    folders.extend((root / folder, t) for t, folder in COMFYUI_FOLDERS.items() if folder == t.value)
+            for folder, model_type in folders:
+                if not folder.is_dir():
+                    continue
+                for entry in os.scandir(folder):
+                    if not entry.is_file() or not entry.name.lower().endswith(MODEL_EXTENSIONS):
+                        continue
+                    if os.path.abspath(entry.path) in known_paths:
+                        continue
+                    name = Path(entry.name).stem
+                    if name in self.models:
+                        continue
+                    self._add(name, model_type, "local", entry.path)
+                    added.append(name)
+            if added:
+                self._save_model_index()
+            return added
+
+    def refresh_file(self, name: str, **metadata):
+        """Re-read a model's size and mtime after its file changed on disk.
+
+        The stored hash is dropped unless ``metadata`` carries the new sha256.
+        """
+        with self.lock:
+            model = self.models.get(name)
+            if model is None:
+                raise ValueError(f"Model {name} not found")
+            model.metadata.pop("sha256", None)
+            model.metadata.update(metadata)
+            _intern_metadata(model.metadata)
+            row = self._allocate_row(name)
+            self._hashes[row * HASH_SIZE:(row + 1) * HASH_SIZE] = _NO_HASH
+            self._stat_file(model)
+            self._changed(name)
+            self._save_model_index()
+
+    def write_extra_model_paths(self, comfyui_dir: str = "ComfyUI") -> str:
+        """Point ComfyUI at this catalog's folders via extra_model_paths.yaml"""
+        lines = ["flux_catalog:", f"    base_path: {self.base_path.resolve()}"]
+        for model_type, folder in COMFYUI_FOLDERS.items():
+            lines.append(f"    {folder}: {model_type.value}")
+        path = os.path.join(comfyui_dir, "extra_model_paths.yaml")
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return path
+
+    def update_metadata(self, name: str, **changes):
+        """Merge changes into a model's metadata and persist them"""
+        with self.lock:
+            model = self.models.get(name)
+            if model is None:
+                raise ValueError(f"Model {name} not found")
+            model.metadata.update(changes)
+            _intern_metadata(model.metadata)
+            if changes.get("sha256"):
+                size, mtime, _ = self.get_stats(name)
+                self._set_stats(model, size, mtime, changes["sha256"])
+            self._changed(name)
+            self._save_model_index()
 
     def get_model(self, name: str) -> Optional[ModelInfo]:
         """Retrieve model information by name"""
@@ -90,18 +477,22 @@ class ModelManager:
 
     def list_models(self, model_type: ModelType = None) -> List[ModelInfo]:
         """List all models, optionally filtered by type"""
-        if model_type:
-            return [m for m in self.models.values() if m.type == model_type]
-        return list(self.models.values())
+        with self.lock:
+            if model_type:
+                return [m for m in self.models.values() if m.type == model_type]
+            return list(self.models.values())
 
     def remove_model(self, name: str):
         """Remove a model from the manager and delete its files"""
-        if name not in self.models:
-            raise ValueError(f"Model {name} not found")
-        
-        model = self.models[name]
-        if os.path.exists(model.path):
-            os.remove(model.path)
-        
-        del self.models[name]
-        self._save_model_index()
+        with self.lock:
+            if name not in self.models:
+                raise ValueError(f"Model {name} not found")
+
+            model = self.models[name]
+            if os.path.exists(model.path):
+                os.remove(model.path)
+
+            del self.models[name]
+            self._release_row(name)
+            self._changed(name)
+            self._save_model_index()
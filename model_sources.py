@@ -0,0 +1,127 @@
+import os
+import asyncio
+import logging
+from dataclasses import asdict, fields
+from enum import Enum
+from typing import Dict, List, Optional, Sequence, Tuple
+from model_manager import ModelInfo, ModelType, find_model_type
+from async_http import SharedSession
+from civitai_client import AsyncCivitaiClient, CivitaiClient, CivitaiModel
+from huggingface_client import AsyncHuggingFaceClient
+
+logger = logging.getLogger(__name__)
+
+SOURCES = ("civitai", "huggingface")
+
+def model_to_dict(model, source: str) -> Dict:
+    """Serialize a source-specific model dataclass, tagging it with its source"""
+    data = {k: v.value if isinstance(v, Enum) else v for k, v in asdict(model).items()}
+    data["source"] = source
+    return data
+
+def _interleave(result_lists: List[List[Dict]]) -> List[Dict]:
+    merged = []
+    for i in range(max((len(r) for r in result_lists), default=0)):
+        merged.extend(r[i] for r in result_lists if i < len(r))
+    return merged
+
+class ModelSources:
+    """Async facade over all upstream model sources sharing one HTTP session"""
+
+    def __init__(
+        self,
+        civitai_api_key: Optional[str] = None,
+        huggingface_token: Optional[str] = None,
+        session: Optional[SharedSession] = None,
+        civitai_url: Optional[str] = None,
+        huggingface_endpoint: Optional[str] = None,
+        reserve=None,
+        peers=None
+    ):
+        self.session = session or SharedSession()
+        self.civitai = AsyncCivitaiClient(civitai_api_key, self.session, civitai_url, reserve=reserve, peers=peers)
+        self.huggingface = AsyncHuggingFaceClient(huggingface_token, self.session, huggingface_endpoint, reserve=reserve)
+
+    async def search_source(self, source: str, query: str, model_type: Optional[str] = None, flux_only: bool = False, limit: int = 20) -> List[Dict]:
+        """Search a single source and return serialized results"""
+        if source == "civitai":
+            models = await self.civitai.search_models(query, model_type, limit=limit)
+            if flux_only:
+                models = [m for m in models if "flux" in m.base_model.lower()]
+        elif source == "huggingface":
+            models = await self.huggingface.search_models(
+                query,
+                find_model_type(model_type),
+                flux_only,
+                limit
+            )
+        else:
+            raise ValueError(f"Unknown source: {source}")
+        return [model_to_dict(m, source) for m in models]
+
+    async def search(self, query: str, sources: Sequence[str] = SOURCES, model_type: Optional[str] = None, flux_only: bool = False, limit: int = 20) -> List[Dict]:
+        """Query several sources concurrently and interleave their results.
+
+        A failing source is logged and contributes no results, so one slow or
+        broken upstream does not fail the whole search.
+        """
+        results = await asyncio.gather(
+            *(self.search_source(s, query, model_type, flux_only, limit) for s in sources),
+            return_exceptions=True
+        )
+        collected = []
+        for source, result in zip(sources, results):
+            if isinstance(result, BaseException):
+                if len(sources) == 1:
+                    raise result
+                logger.warning(f"Search on {source} failed: {result}")
+                continue
+            collected.append(result)
+        return _interleave(collected)
+
+    @staticmethod
+    def catalog_name(source: str, model_data: Dict) -> str:
+        """The catalog name a download of model_data registers, known before anything is fetched"""
+        if source == "civitai":
+            return model_data["name"]
+        if source == "huggingface":
+            return model_data["id"].split("/")[-1]
+        raise ValueError(f"Unknown source: {source}")
+
+    async def download(self, source: str, model_data: Dict, models_root: str = "models", on_progress=None, resume: bool = False) -> Tuple[str, str, ModelType, Dict]:
+        """Download a search result; returns (name, path, model type, metadata)"""
+        if source == "civitai":
+            known = {f.name for f in fields(CivitaiModel)}
+            model = CivitaiModel(**{k: v for k, v in model_data.items() if k in known})
+            model_type = CivitaiClient.map_model_type(model.type)
+            path = await self.civitai.download_model(model, f"{models_root}/{model_type.value}", on_progress, resume)
+            metadata = {"civitai_id": model.id, "version_id": model.version_id, "base_model": model.base_model}
+            if model.sha256:
+                metadata["sha256"] = model.sha256.lower()
+            # Enough of the search result to download the same file again (see redownload)
+            metadata["origin"] = {k: getattr(model, k) for k in ("id", "name", "type", "download_url", "version_id", "base_model", "sha256")}
+            return self.catalog_name(source, model_data), path, model_type, metadata
+        if source == "huggingface":
+            repo_id = model_data["id"]
+            model_type = find_model_type(model_data.get("type")) or ModelType.CHECKPOINT
+            filename = model_data.get("filename")
+            path = await self.huggingface.download_model(repo_id, f"{models_root}/{model_type.value}", filename, on_progress=on_progress, resume=resume)
+            metadata = {"repo_id": repo_id, "origin": {"id": repo_id, "type": model_data.get("type"), "filename": filename}}
+            return self.catalog_name(source, model_data), path, model_type, metadata
+        raise ValueError(f"Unknown source: {source}")
+
+    async def redownload(self, model: ModelInfo, models_root: str = "models") -> bool:
+        """Fetch a catalog model missing from local disk again from its source; False if it has none"""
+        origin = model.metadata.get("origin")
+        if model.source not in SOURCES or not origin:
+            return False
+        data = dict(origin)
+        data.setdefault("description", "")
+        _, path, _, _ = await self.download(model.source, data, models_root, resume=True)
+        # Downloads land in the source's folder; the catalog may have moved the first copy elsewhere
+        if os.path.abspath(path) != os.path.abspath(model.path):
+            os.replace(path, model.path)
+        return True
+
+    async def close(self):
+        await self.session.close()
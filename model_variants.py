@@ -0,0 +1,292 @@
+import os
+import re
+import json
+import shutil
+import logging
+import argparse
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from model_manager import ModelInfo, ModelManager, ModelType, model_files
+from safetensors_io import SafetensorsFile, SafetensorsWriter, from_float32, itemsize, to_float32
+from metrics import TRACER
+
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ("BF16", "F16")  # load-time preference order
+# Only full-precision tensors are narrowed; F16 <-> BF16 would lose precision both ways
+WIDE_DTYPES = ("F32", "F64")
+CONVERT_CHUNK_ELEMENTS = 4 * 1024 * 1024
+SHARD_ALIGNMENT = 4096  # page-aligned tensors can be read in parallel with direct I/O
+
+@dataclass
+class TensorPlan:
+    name: str
+    dtype: str  # stored dtype in the source
+    target: str  # dtype to write
+    shape: Tuple[int, ...]
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape, dtype=np.int64)) * itemsize(self.target)
+
+def _convert_chunks(source: SafetensorsFile, plan: TensorPlan) -> Iterator:
+    if plan.target == plan.dtype:
+        yield source.raw(plan.name)
+        return
+    flat = source.tensor(plan.name).reshape(-1)
+    for start in range(0, flat.size, CONVERT_CHUNK_ELEMENTS):
+        chunk = flat[start:start + CONVERT_CHUNK_ELEMENTS]
+        yield from_float32(to_float32(chunk, plan.dtype), plan.target)
+
+def plan_tensors(source: SafetensorsFile, precision: Optional[str]) -> List[TensorPlan]:
+    plans = []
+    for name in source.keys():
+        dtype = source.dtype(name)
+        target = precision if precision and dtype in WIDE_DTYPES else dtype
+        plans.append(TensorPlan(name, dtype, target, source.shape(name)))
+    return plans
+
+def plan_shards(plans: List[TensorPlan], shard_bytes: int) -> List[List[TensorPlan]]:
+    """Greedily fill shards in file order; a tensor larger than shard_bytes gets a shard of its own"""
+    shards, current, size = [], [], 0
+    for plan in plans:
+        padded = -(-plan.nbytes // SHARD_ALIGNMENT) * SHARD_ALIGNMENT
+        if current and size + padded > shard_bytes:
+            shards.append(current)
+            current, size = [], 0
+        current.append(plan)
+        size += padded
+    if current:
+        shards.append(current)
+    return shards
+
+def _write(source: SafetensorsFile, plans: List[TensorPlan], path: str, metadata: Dict[str, str], alignment: int):
+    specs = [(p.name, p.target, p.shape) for p in plans]
+    with SafetensorsWriter(path, specs, metadata, alignment=alignment) as writer:
+        for plan in plans:
+            writer.write_chunks(plan.name, _convert_chunks(source, plan))
+
+def convert_file(source_path: str, output_path: str, precision: Optional[str] = None, shard_bytes: Optional[int] = None) -> int:
+    """Write a narrowed and/or sharded copy of a safetensors file, one tensor chunk at a time.
+
+    Without sharding output_path is a single .safetensors file. With
+    shard_bytes it is a Hugging Face style ``.safetensors.index.json`` whose
+    shards (page-aligned tensors) go in a directory next to it named after the
+    index. Returns the number of bytes written.
+    """
+    with SafetensorsFile(source_path) as source:
+        plans = plan_tensors(source, precision)
+        metadata = dict(source.metadata)
+        if precision:
+            metadata["flux.precision"] = precision
+        if not shard_bytes:
+            _write(source, plans, output_path, metadata, alignment=8)
+            return os.path.getsize(output_path)
+
+        shard_dir = output_path[:-len(".safetensors.index.json")]
+        if os.path.isdir(shard_dir):
+            shutil.rmtree(shard_dir)
+        os.makedirs(shard_dir)
+        stem = os.path.basename(shard_dir)
+        shards = plan_shards(plans, shard_bytes)
+        weight_map, total = {}, 0
+        for i, shard in enumerate(shards, 1):
+            filename = f"{stem}/{stem}-{i:05d}-of-{len(shards):05d}.safetensors"
+            _write(source, shard, os.path.join(os.path.dirname(output_path), filename), metadata, alignment=SHARD_ALIGNMENT)
+            weight_map.update((plan.name, filename) for plan in shard)
+            total += sum(plan.nbytes for plan in shard)
+        with open(output_path, "w") as f:
+            json.dump({"metadata": {"total_size": total, **metadata}, "weight_map": weight_map}, f, indent=2)
+        return total
+
+def variant_name(name: str, precision: Optional[str], sharded: bool) -> str:
+    suffix = precision.lower() if precision else "original"
+    return f"{name}-{suffix}-sharded" if sharded else f"{name}-{suffix}"
+
+class VariantManager:
+    """Precision-converted and sharded alternates of catalog models.
+
+    A variant is a regular catalog entry (source "variant") whose metadata
+    names the model it was made from and the base file's size and mtime at
+    conversion time; the base lists its variants under ``variants``. At load
+    time ``select`` swaps a requested model for its smallest up-to-date
+    variant the loader can read.
+    """
+
+    def __init__(self, manager: ModelManager, reserve: Optional[Callable[[str, int], object]] = None):
+        self.manager = manager
+        self.reserve = reserve
+
+    def _source_stat(self, name: str) -> List[float]:
+        size, mtime, _ = self.manager.get_stats(name)
+        return [size, mtime]
+
+    def variants(self, name: str) -> List[ModelInfo]:
+        """Up-to-date variants of a model that are on local disk"""
+        model = self.manager.get_model(name)
+        if model is None:
+            return []
+        current = self._source_stat(name)
+        found = []
+        for alternate in model.metadata.get("variants", []):
+            variant = self.manager.get_model(alternate)
+            if variant is None or variant.metadata.get("source_stat") != current:
+                continue
+            if all(os.path.exists(path) for path in model_files(variant)):
+                found.append(variant)
+        return found
+
+    def select(self, name: str, precisions: Sequence[str] = PRECISIONS, sharded_ok: bool = False) -> str:
+        """The model name a loader should open for a request for name.
+
+        A variant qualifies when its precision is one of precisions or, for a
+        loader that reads shards, when it only changed the layout and kept the
+        original's precision.
+        """
+        model = self.manager.get_model(name)
+        original = model.metadata.get("precision") if model else None
+
+        def loadable(v: ModelInfo) -> bool:
+            if v.metadata.get("sharded"):
+                return sharded_ok and (v.metadata.get("precision") in precisions or v.metadata.get("precision") == original)
+            return v.metadata.get("precision") in precisions
+
+        candidates = [v for v in self.variants(name) if loadable(v)]
+        if not candidates:
+            return name
+        # Prefer the caller's precision order (the original's last), then sharded copies when the loader reads them, then the smaller one
+        rank = {p: i for i, p in enumerate(precisions)}
+        candidates.sort(key=lambda v: (
+            rank.get(v.metadata.get("precision"), len(precisions)),
+            not v.metadata.get("sharded"),
+            sum(os.path.getsize(path) for path in model_files(v))
+        ))
+        return candidates[0].name
+
+    def convert(self, name: str, precision: Optional[str] = "BF16", shard_bytes: Optional[int] = None) -> ModelInfo:
+        """Create (or refresh) a variant of a model and register it as an alternate"""
+        if precision is not None and precision not in PRECISIONS:
+            raise ValueError(f"Unsupported precision {precision}; expected one of {', '.join(PRECISIONS)}")
+        if precision is None and not shard_bytes:
+            raise ValueError("Nothing to do: give a precision, a shard size or both")
+        model = self.manager.get_model(name)
+        if model is None:
+            raise ValueError(f"Model {name} not found")
+        if model.metadata.get("variant_of"):
+            raise ValueError(f"{name} is itself a variant of {model.metadata['variant_of']}")
+        if not model.path.endswith((".safetensors", ".sft")) or not os.path.exists(model.path):
+            raise ValueError(f"Only local safetensors files can be converted: {model.path}")
+
+        sharded = bool(shard_bytes)
+        target = variant_name(name, precision, sharded)
+        existing = self.manager.get_model(target)
+        if existing is not None:
+            if existing in self.variants(name):
+                return existing
+            self.remove(target)
+
+        staging = self.manager.base_path / ".staging"
+        staging.mkdir(exist_ok=True)
+        if sharded:
+            # Shards live in a folder next to the index; sync_directory doesn't descend into it
+            output_path = str(self.manager.base_path / model.type.value / f"{target}.safetensors.index.json")
+        else:
+            output_path = str(staging / f"{target}.safetensors")
+        reservation = self.reserve(output_path, os.path.getsize(model.path)) if self.reserve else None
+        try:
+            with TRACER.span("variant.convert", model=name, precision=precision or "original", sharded=sharded):
+                convert_file(model.path, output_path, precision, shard_bytes)
+            metadata = {
+                "variant_of": name,
+                "precision": precision or model.metadata.get("precision"),
+                "sharded": sharded,
+                "source_stat": self._source_stat(name)
+            }
+            if model.metadata.get("base_model"):
+                metadata["base_model"] = model.metadata["base_model"]
+            self.manager.add_model(target, model.type, "variant", output_path, metadata)
+        except BaseException:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            if sharded:
+                shutil.rmtree(output_path[:-len(".safetensors.index.json")], ignore_errors=True)
+            raise
+        finally:
+            if reservation is not None:
+                reservation.release()
+
+        variants = [v for v in model.metadata.get("variants", []) if v != target]
+        self.manager.update_metadata(name, variants=variants + [target])
+        variant = self.manager.get_model(target)
+        logger.info(
+            f"Converted {name} -> {target}: {self.manager.get_stats(name)[0] / 1024 ** 2:.0f} MiB -> "
+            f"{sum(os.path.getsize(p) for p in model_files(variant)) / 1024 ** 2:.0f} MiB"
+        )
+        return variant
+
+    def remove(self, name: str):
+        """Delete a variant, including its shards"""
+        variant = self.manager.get_model(name)
+        if variant is None:
+            return
+        if variant.metadata.get("sharded"):
+            shutil.rmtree(variant.path[:-len(".safetensors.index.json")], ignore_errors=True)
+        self.manager.remove_model(name)
+        base = self.manager.get_model(variant.metadata.get("variant_of", ""))
+        if base is not None and name in base.metadata.get("variants", []):
+            self.manager.update_metadata(base.name, variants=[v for v in base.metadata["variants"] if v != name])
+
+    def convert_all(self, precision: Optional[str] = "BF16", shard_bytes: Optional[int] = None, min_bytes: int = 0, model_type: ModelType = ModelType.CHECKPOINT) -> List[ModelInfo]:
+        """Convert every eligible model of a type at least min_bytes large"""
+        converted = []
+        for model in self.manager.list_models(model_type):
+            if model.metadata.get("variant_of") or model.source == "variant":
+                continue
+            if not model.path.endswith((".safetensors", ".sft")) or not os.path.exists(model.path):
+                continue
+            if self.manager.get_stats(model.name)[0] < min_bytes:
+                continue
+            try:
+                converted.append(self.convert(model.name, precision, shard_bytes))
+            except ValueError as e:
+                logger.warning(f"Skipping {model.name}: {e}")
+        return converted
+
+def parse_precision(value: Optional[str]) -> Optional[str]:
+    """Map "fp16"/"bf16" (or "none"/None) to a safetensors dtype"""
+    if value is None or value.lower() == "none":
+        return None
+    precision = {"fp16": "F16", "f16": "F16", "bf16": "BF16"}.get(value.lower())
+    if precision is None:
+        raise ValueError(f"Unsupported precision {value}; expected fp16, bf16 or none")
+    return precision
+
+def parse_size(value: str) -> int:
+    """Parse "2GiB", "512M" or a plain byte count"""
+    match = re.fullmatch(r"\s*([\d.]+)\s*([kmgt]?)i?b?\s*", value.lower())
+    if match is None:
+        raise ValueError(f"Invalid size: {value}")
+    return int(float(match.group(1)) * 1024 ** " kmgt".index(match.group(2) or " "))
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Create fp16/bf16 and sharded variants of catalog models")
+    parser.add_argument("models", nargs="*", help="Model names (default: every checkpoint)")
+    parser.add_argument("--models-dir", default="models")
+    parser.add_argument("--precision", default="bf16", help="fp16, bf16 or none")
+    parser.add_argument("--shard-size", default=None, help="Reshard into files of about this size, e.g. 2GiB")
+    parser.add_argument("--min-size", default="0", help="With no model names, skip files smaller than this")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    precision = parse_precision(args.precision)
+    shard_bytes = parse_size(args.shard_size) if args.shard_size else None
+    variants = VariantManager(ModelManager(args.models_dir))
+    if args.models:
+        for name in args.models:
+            variants.convert(name, precision, shard_bytes)
+    else:
+        variants.convert_all(precision, shard_bytes, parse_size(args.min_size))
+
+if __name__ == "__main__":
+    main()
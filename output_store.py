@@ -0,0 +1,236 @@
+import os
+import re
+import time
+import base64
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from metrics import TRACER
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+    "avif": "image/avif"
+}
+
+THUMBNAIL_SIZE = 384
+_DATA_URL_RE = re.compile(r"^data:(?P<type>[\w/+.-]+)?(;base64)?,(?P<data>.*)$", re.DOTALL)
+
+@dataclass
+class OutputRecord:
+    digest: str
+    ext: str
+    size: int
+    path: str
+
+    @property
+    def content_type(self) -> str:
+        return CONTENT_TYPES.get(self.ext, "application/octet-stream")
+
+def _sniff_ext(data: bytes) -> str:
+    if data.startswith(b"\x89PNG"):
+        return "png"
+    if data.startswith(b"\xff\xd8"):
+        return "jpg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[4:12] in (b"ftypavif", b"ftypavis"):
+        return "avif"
+    return "bin"
+
+def decode_image_payload(value) -> Optional[bytes]:
+    """Decode a data URL or bare base64 image string, or return None"""
+    if not isinstance(value, str) or len(value) < 64:
+        return None
+    match = _DATA_URL_RE.match(value)
+    payload = match.group("data") if match else value
+    try:
+        return base64.b64decode(payload, validate=True)
+    except (ValueError, base64.binascii.Error):
+        return None
+
+def avif_supported() -> bool:
+    try:
+        from PIL import features
+        return bool(features.check("avif"))
+    except Exception:
+        return False
+
+def render_variants(source_path: str, target_dir: str, thumbnail_size: int = THUMBNAIL_SIZE, avif: bool = False) -> Dict[str, str]:
+    """Write thumbnail and alternate-format variants of one image.
+
+    Runs in a worker process; returns {variant name: path}.
+    """
+    from PIL import Image
+
+    os.makedirs(target_dir, exist_ok=True)
+    written = {}
+    with Image.open(source_path) as image:
+        image.load()
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+        formats = [("webp", "WEBP", {"quality": 90, "method": 4})]
+        if avif:
+            formats.append(("avif", "AVIF", {"quality": 70}))
+
+        for ext, fmt, options in formats:
+            path = os.path.join(target_dir, f"full.{ext}")
+            image.save(path, fmt, **options)
+            written[f"full.{ext}"] = path
+
+        thumbnail = image.copy()
+        thumbnail.thumbnail((thumbnail_size, thumbnail_size))
+        for ext, fmt, options in formats:
+            path = os.path.join(target_dir, f"thumb.{ext}")
+            thumbnail.save(path, fmt, **options)
+            written[f"thumb.{ext}"] = path
+    return written
+
+class OutputStore:
+    """Content-addressed store for generated images and their variants.
+
+    Originals live at ``objects/<aa>/<digest>.<ext>`` and derived variants in
+    ``variants/<digest>/``; identical outputs are stored once.
+    """
+
+    def __init__(self, root: str = "outputs", retention_days: float = 7.0, max_bytes: Optional[int] = None, workers: int = 2):
+        self.root = Path(root)
+        self.retention_seconds = retention_days * 86400
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self._avif = avif_supported()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        (self.root / "objects").mkdir(parents=True, exist_ok=True)
+        (self.root / "variants").mkdir(parents=True, exist_ok=True)
+
+    def _object_path(self, digest: str, ext: str) -> Path:
+        return self.root / "objects" / digest[:2] / f"{digest}.{ext}"
+
+    def put_bytes(self, data: bytes, ext: Optional[str] = None) -> OutputRecord:
+        """Store an image; storing the same bytes twice is a no-op"""
+        digest = hashlib.sha256(data).hexdigest()
+        ext = (ext or _sniff_ext(data)).lower().lstrip(".")
+        path = self._object_path(digest, ext)
+        try:
+            # A repeated output counts as new for retention, which goes by mtime
+            os.utime(path)
+        except FileNotFoundError:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(path.suffix + ".tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return OutputRecord(digest=digest, ext=ext, size=len(data), path=str(path))
+
+    def get(self, digest: str) -> Optional[OutputRecord]:
+        if not re.fullmatch(r"[0-9a-f]{64}", digest):
+            return None
+        folder = self.root / "objects" / digest[:2]
+        for path in folder.glob(f"{digest}.*"):
+            if path.suffix != ".tmp":
+                return OutputRecord(digest=digest, ext=path.suffix[1:], size=path.stat().st_size, path=str(path))
+        return None
+
+    # Variants
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def schedule_variants(self, record: OutputRecord) -> Future:
+        """Render variants in the process pool; concurrent calls share one job"""
+        with self._lock:
+            future = self._pending.get(record.digest)
+            if future is None:
+                future = self._get_executor().submit(
+                    render_variants,
+                    record.path,
+                    str(self.root / "variants" / record.digest),
+                    THUMBNAIL_SIZE,
+                    self._avif
+                )
+                self._pending[record.digest] = future
+                future.add_done_callback(lambda _: self._pending.pop(record.digest, None))
+            return future
+
+    def variant_path(self, digest: str, variant: str) -> Optional[Path]:
+        path = self.root / "variants" / digest / variant
+        return path if path.exists() else None
+
+    def negotiate(self, digest: str, accept: str = "", size: str = "full") -> Optional[Tuple[Path, str]]:
+        """Pick the smallest format the client accepts; fall back to the original"""
+        accept = (accept or "").lower()
+        for ext in ("avif", "webp"):
+            if CONTENT_TYPES[ext] in accept:
+                path = self.variant_path(digest, f"{size}.{ext}")
+                if path is not None:
+                    return path, CONTENT_TYPES[ext]
+        if size == "thumb":
+            # Thumbnails are always written as WebP, which every browser we serve understands
+            path = self.variant_path(digest, "thumb.webp")
+            if path is not None:
+                return path, CONTENT_TYPES["webp"]
+        record = self.get(digest)
+        if record is None:
+            return None
+        return Path(record.path), record.content_type
+
+    # Retention
+
+    def cleanup(self, now: Optional[float] = None) -> int:
+        """Delete outputs past retention, then the oldest ones over max_bytes; returns files removed"""
+        now = now or time.time()
+        entries: List[Tuple[float, int, Path]] = []
+        for path in (self.root / "objects").glob("*/*"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            if path.suffix == ".tmp":
+                # Still being written by put_bytes, unless a crash left it behind long ago
+                if now - st.st_mtime > self.retention_seconds:
+                    path.unlink(missing_ok=True)
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+
+        removed = 0
+        total = sum(size for _, size, _ in entries)
+        with TRACER.span("outputs.cleanup", files=len(entries)):
+            for mtime, size, path in entries:
+                expired = now - mtime > self.retention_seconds
+                over_budget = self.max_bytes is not None and total > self.max_bytes
+                if not (expired or over_budget):
+                    break
+                digest = path.name.split(".")[0]
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                variants = self.root / "variants" / digest
+                for variant in variants.glob("*"):
+                    variant.unlink(missing_ok=True)
+                if variants.exists():
+                    variants.rmdir()
+                total -= size
+                removed += 1
+        if removed:
+            logger.info(f"Output retention removed {removed} image(s)")
+        return removed
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
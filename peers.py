@@ -0,0 +1,421 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from model_manager import ModelInfo, ModelManager
+from metrics import REGISTRY, TRACER
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 16 * 1024 * 1024
+# A peer that fails this many chunk reads is not asked again during one fetch
+MAX_PEER_ERRORS = 3
+
+PEER_BYTES = REGISTRY.counter(
+    "flux_peer_bytes_total",
+    "Model file bytes served to or fetched from peer instances",
+    ["direction"]
+)
+PEER_CHUNK_FAILURES = REGISTRY.counter(
+    "flux_peer_chunk_failures_total",
+    "Chunk reads from peers that failed or did not match their hash",
+    ["reason"]
+)
+
+class PeerFetchError(Exception):
+    """Raised when a file cannot be completed from the peers that advertise it"""
+
+def hash_chunks(path: str, chunk_size: int = CHUNK_SIZE) -> Tuple[str, List[str]]:
+    """The sha256 of a file and of each of its chunk_size chunks, in one read"""
+    digest = hashlib.sha256()
+    chunks = []
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            digest.update(data)
+            chunks.append(hashlib.sha256(data).hexdigest())
+    return digest.hexdigest(), chunks
+
+def _file_sha256(path: str, chunk_size: int = CHUNK_SIZE) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb", buffering=0) as f:
+        for data in iter(lambda: f.read(chunk_size), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+class ChunkIndex:
+    """Chunk hashes of the catalog's local files, by content hash.
+
+    Entries ({"path", "size", "mtime", "sha256", "chunk_size", "chunks"}) are
+    kept in ``<models>/.peers/`` so a restart doesn't re-hash unchanged files;
+    an entry is only used while its file's size and mtime still match.
+    """
+
+    def __init__(self, manager: ModelManager, chunk_size: int = CHUNK_SIZE, directory: Optional[str] = None):
+        self.manager = manager
+        self.chunk_size = chunk_size
+        self.directory = directory or os.path.join(str(manager.base_path), ".peers")
+        os.makedirs(self.directory, exist_ok=True)
+        self._by_path: Dict[str, Dict] = {}
+        self._by_hash: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def _entry_path(self, path: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(os.path.normpath(path).encode()).hexdigest() + ".json")
+
+    def _fresh(self, entry: Optional[Dict]) -> bool:
+        if entry is None or entry.get("chunk_size") != self.chunk_size:
+            return False
+        try:
+            st = os.stat(entry["path"])
+        except OSError:
+            return False
+        return st.st_size == entry["size"] and st.st_mtime == entry["mtime"]
+
+    def lookup(self, path: str) -> Optional[Dict]:
+        """The entry for path if the file is unchanged since it was hashed"""
+        path = os.path.normpath(path)
+        with self._lock:
+            entry = self._by_path.get(path)
+        if entry is None:
+            try:
+                with open(self._entry_path(path)) as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                return None
+        if not self._fresh(entry):
+            return None
+        self._remember(entry)
+        return entry
+
+    def _remember(self, entry: Dict):
+        with self._lock:
+            self._by_path[entry["path"]] = entry
+            self._by_hash[entry["sha256"]] = entry
+
+    def add(self, path: str, sha256: str, chunks: List[str]) -> Dict:
+        """Record the hashes of a file as it is on disk now"""
+        st = os.stat(path)
+        entry = {
+            "path": os.path.normpath(path),
+            "size": st.st_size,
+            "mtime": st.st_mtime,
+            "sha256": sha256,
+            "chunk_size": self.chunk_size,
+            "chunks": chunks
+        }
+        tmp_path = self._entry_path(path) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f, separators=(",", ":"))
+        os.replace(tmp_path, self._entry_path(path))
+        self._remember(entry)
+        return entry
+
+    def index(self, path: str) -> Dict:
+        """The entry for path, hashing the file if it is new or changed"""
+        entry = self.lookup(path)
+        if entry is None:
+            with TRACER.span("peer.hash", path=path):
+                sha256, chunks = hash_chunks(path, self.chunk_size)
+            entry = self.add(path, sha256, chunks)
+        return entry
+
+    def get(self, sha256: str) -> Optional[Dict]:
+        """The entry of a local file with this content, if it is still unchanged"""
+        with self._lock:
+            entry = self._by_hash.get(sha256)
+        return entry if self._fresh(entry) else None
+
+    def refresh(self) -> int:
+        """Hash catalog files that are new or changed; returns how many were hashed"""
+        hashed = 0
+        live = set()
+        for model in list(self.manager.models.values()):
+            path = os.path.normpath(model.path)
+            if not os.path.isfile(path):
+                continue
+            live.add(path)
+            if self.lookup(path) is None:
+                try:
+                    self.index(path)
+                    hashed += 1
+                except OSError as e:
+                    logger.warning(f"Could not hash {path} for peers: {e}")
+        with self._lock:
+            for path in [p for p in self._by_path if p not in live]:
+                entry = self._by_path.pop(path)
+                if self._by_hash.get(entry["sha256"]) is entry:
+                    del self._by_hash[entry["sha256"]]
+        return hashed
+
+    def manifest(self) -> Dict:
+        """What this instance can serve: sha256 -> {"path", "size"}"""
+        with self._lock:
+            entries = list(self._by_hash.values())
+        return {
+            "chunk_size": self.chunk_size,
+            "files": {e["sha256"]: {"path": e["path"], "size": e["size"]} for e in entries if self._fresh(e)}
+        }
+
+class PeerNode:
+    """Shares this instance's model files with sibling instances and fetches from them.
+
+    Each instance advertises the sha256 of its local catalog files and serves
+    byte ranges of them (the /api/peers/* routes in web_ui). To fetch a file,
+    an instance asks every peer which files it has, takes the chunk hash list
+    from one holder and downloads the chunks from all holders in parallel,
+    round-robin, checking each chunk's hash and retrying a bad chunk on the
+    next holder. A fetched file is advertised at once, so later instances of
+    a scale-out spread their reads over more peers. If no peer has the file,
+    or it can't be completed, fetch() returns False and the caller falls back
+    to the Drive or the upstream source.
+    """
+
+    def __init__(
+        self,
+        manager: ModelManager,
+        peers: Sequence[str] = (),
+        token: str = "",
+        chunk_size: int = CHUNK_SIZE,
+        workers: int = 8,
+        timeout: float = 30.0,
+        manifest_ttl: float = 10.0,
+        reserve: Optional[Callable] = None
+    ):
+        self.index = ChunkIndex(manager, chunk_size)
+        self.peers = [peer.strip().rstrip("/") for peer in peers if peer.strip()]
+        self.token = token
+        self.workers = workers
+        self.timeout = timeout
+        self.manifest_ttl = manifest_ttl
+        # e.g. StorageGovernor.reserve, to admit the file's bytes before writing
+        self.reserve = reserve
+        self._manifests: Dict[str, Tuple[float, Optional[Dict]]] = {}
+        self._manifest_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+    # Serving
+
+    def manifest(self) -> Dict:
+        return self.index.manifest()
+
+    def entry(self, sha256: str) -> Optional[Dict]:
+        return self.index.get(sha256)
+
+    def start(self):
+        """Hash local files in the background, again after every catalog change"""
+        if self._thread is None:
+            self.index.manager.listeners.append(self._wake.set)
+            self._thread = threading.Thread(target=self._run, name="peer-hash", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                hashed = self.index.refresh()
+                if hashed:
+                    logger.info(f"Hashed {hashed} model file(s) for peers")
+            except Exception as e:
+                logger.warning(f"Peer hashing failed: {e}")
+            self._wake.wait()
+            self._wake.clear()
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._wake.set in self.index.manager.listeners:
+            self.index.manager.listeners.remove(self._wake.set)
+
+    # Fetching
+
+    def _open(self, peer: str, route: str, headers: Optional[Dict] = None):
+        headers = dict(headers or {})
+        headers["Authorization"] = f"Bearer {self.token}"
+        request = urllib.request.Request(peer + route, headers=headers)
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def _get_json(self, peer: str, route: str) -> Dict:
+        with self._open(peer, route) as response:
+            return json.loads(response.read())
+
+    def _manifest(self, peer: str) -> Optional[Dict]:
+        """A peer's manifest, cached for manifest_ttl; None while the peer is unreachable"""
+        now = time.monotonic()
+        with self._manifest_lock:
+            cached = self._manifests.get(peer)
+        if cached is not None and now - cached[0] < self.manifest_ttl:
+            return cached[1]
+        try:
+            manifest = self._get_json(peer, "/api/peers/manifest")
+        except (OSError, ValueError) as e:
+            logger.debug(f"Peer {peer} unavailable: {e}")
+            manifest = None
+        with self._manifest_lock:
+            self._manifests[peer] = (now, manifest)
+        return manifest
+
+    def locate(self, sha256: Optional[str] = None, path: Optional[str] = None) -> Tuple[Optional[str], List[str]]:
+        """The content hash to fetch and the peers that have it, matched by sha256 or else by path"""
+        if not self.peers:
+            return None, []
+        with ThreadPoolExecutor(max_workers=len(self.peers)) as pool:
+            manifests = list(pool.map(self._manifest, self.peers))
+        if sha256 is None and path is not None:
+            # Without a hash, take the content most peers hold at that path
+            path = os.path.normpath(path)
+            votes: Dict[str, int] = {}
+            for manifest in manifests:
+                for digest, info in (manifest or {}).get("files", {}).items():
+                    if info["path"] == path:
+                        votes[digest] = votes.get(digest, 0) + 1
+            sha256 = max(votes, key=votes.get) if votes else None
+        if sha256 is None:
+            return None, []
+        holders = [peer for peer, manifest in zip(self.peers, manifests) if manifest and sha256 in manifest.get("files", {})]
+        return sha256, holders
+
+    def _chunk_list(self, sha256: str, holders: List[str], size: Optional[int]) -> Optional[Dict]:
+        for peer in holders:
+            try:
+                entry = self._get_json(peer, f"/api/peers/files/{sha256}")
+            except (OSError, ValueError):
+                continue
+            chunk_size = entry.get("chunk_size") or 0
+            if (
+                entry.get("sha256") == sha256
+                and chunk_size > 0
+                and (size is None or entry["size"] == size)
+                and len(entry["chunks"]) == -(-entry["size"] // chunk_size)
+            ):
+                return entry
+        return None
+
+    def _read(self, peer: str, sha256: str, offset: int, length: int) -> bytes:
+        headers = {"Range": f"bytes={offset}-{offset + length - 1}"}
+        with self._open(peer, f"/api/peers/files/{sha256}/data", headers) as response:
+            if response.status != 206:
+                raise OSError(f"Peer answered {response.status} to a range request")
+            return response.read()
+
+    def _download(self, part_path: str, entry: Dict, holders: List[str]):
+        size, chunk_size, chunks = entry["size"], entry["chunk_size"], entry["chunks"]
+        errors = {peer: 0 for peer in holders}
+        failed = threading.Event()
+        lock = threading.Lock()
+        fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+
+            def fetch_chunk(i: int):
+                if failed.is_set():
+                    return
+                offset = i * chunk_size
+                length = min(chunk_size, size - offset)
+                # Chunk i starts at holder i mod n, so every holder serves a share
+                order = holders[i % len(holders):] + holders[:i % len(holders)]
+                last_error = "no usable peer"
+                for peer in order:
+                    with lock:
+                        if errors[peer] >= MAX_PEER_ERRORS:
+                            continue
+                    try:
+                        data = self._read(peer, entry["sha256"], offset, length)
+                    except OSError as e:
+                        reason, last_error = "error", f"{peer}: {e}"
+                    else:
+                        if len(data) == length and hashlib.sha256(data).hexdigest() == chunks[i]:
+                            os.pwrite(fd, data, offset)
+                            PEER_BYTES.inc(length, direction="received")
+                            return
+                        # Wrong content: don't trust this peer with the rest of the file
+                        reason, last_error = "hash", f"{peer}: chunk {i} does not match its hash"
+                        with lock:
+                            errors[peer] = MAX_PEER_ERRORS
+                    PEER_CHUNK_FAILURES.inc(reason=reason)
+                    with lock:
+                        errors[peer] += 1
+                failed.set()
+                raise PeerFetchError(f"Chunk {i} unavailable ({last_error})")
+
+            with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(chunks)))) as pool:
+                list(pool.map(fetch_chunk, range(len(chunks))))
+        finally:
+            os.close(fd)
+
+    def fetch(self, path: str, sha256: Optional[str] = None, size: Optional[int] = None) -> bool:
+        """Assemble path from the peers that have it; False if it has to come from elsewhere"""
+        sha256, holders = self.locate(sha256, path)
+        if not holders:
+            return False
+        entry = self._chunk_list(sha256, holders, size)
+        if entry is None:
+            return False
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        part_path = f"{path}.peer-part"
+        reservation = self.reserve(path, entry["size"]) if self.reserve else None
+        start = time.perf_counter()
+        try:
+            with TRACER.span("peer.fetch", path=path, peers=len(holders), bytes=entry["size"]):
+                self._download(part_path, entry, holders)
+                # Chunk hashes come from a peer; the whole-file hash ties them to the content asked for
+                if _file_sha256(part_path) != sha256:
+                    raise PeerFetchError("Assembled file does not match its sha256")
+            os.replace(part_path, path)
+        except (PeerFetchError, OSError) as e:
+            logger.warning(f"Could not fetch {path} from peers, falling back: {e}")
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            return False
+        finally:
+            if reservation is not None:
+                reservation.release()
+        self.index.add(path, sha256, entry["chunks"])
+        elapsed = time.perf_counter() - start
+        logger.info(f"Fetched {path} from {len(holders)} peer(s) in {elapsed:.1f}s ({entry['size'] / max(elapsed, 1e-9) / 1024 ** 2:.0f} MiB/s)")
+        return True
+
+    def fetch_model(self, model: ModelInfo) -> bool:
+        """Fetch a catalogued model, matched by its recorded sha256 when there is one"""
+        sha256 = model.metadata.get("sha256")
+        return self.fetch(model.path, sha256.lower() if sha256 else None)
+
+    def restore(self, models: Iterable[ModelInfo]) -> int:
+        """Fetch the models missing locally from peers; returns how many were fetched"""
+        if not self.peers:
+            return 0
+        fetched = 0
+        for model in models:
+            if os.path.exists(model.path):
+                continue
+            try:
+                fetched += self.fetch_model(model)
+            except Exception as e:
+                logger.warning(f"Peer restore of {model.name} failed: {e}")
+        return fetched
+
+def peers_from_env(manager: ModelManager) -> Optional[PeerNode]:
+    """A PeerNode over FLUX_PEERS (comma-separated base URLs), if FLUX_PEER_TOKEN is set"""
+    token = os.getenv("FLUX_PEER_TOKEN")
+    if not token:
+        return None
+    return PeerNode(
+        manager,
+        os.getenv("FLUX_PEERS", "").split(","),
+        token,
+        chunk_size=int(os.getenv("FLUX_PEER_CHUNK_BYTES", str(CHUNK_SIZE))),
+        workers=int(os.getenv("FLUX_PEER_WORKERS", "8"))
+    )
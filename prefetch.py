@@ -0,0 +1,132 @@
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+from model_manager import ModelInfo, ModelManager
+from metrics import TRACER
+
+logger = logging.getLogger(__name__)
+
+WARM_CHUNK_SIZE = 8 * 1024 * 1024
+
+def warm_page_cache(path: str, max_bytes: Optional[int] = None, chunk_size: int = WARM_CHUNK_SIZE) -> int:
+    """Read a file through once so the OS page cache holds it; returns bytes read"""
+    read = 0
+    buffer = bytearray(chunk_size)
+    with open(path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        while max_bytes is None or read < max_bytes:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            read += n
+    return read
+
+@dataclass
+class PrefetchResult:
+    restored: List[str] = field(default_factory=list)
+    warmed: List[str] = field(default_factory=list)
+    skipped: List[str] = field(default_factory=list)
+    bytes_restored: int = 0
+    bytes_warmed: int = 0
+    elapsed: float = 0.0
+
+class Prefetcher:
+    """Restores and pre-loads the models most likely to be requested next.
+
+    Models are ranked by ModelManager.top_models. Missing files are fetched
+    with ``restore`` (e.g. from the persistent Drive) while their total size
+    fits ``disk_budget``, and files are read into the page cache while they fit
+    ``ram_budget``, so the first request after a scale-up doesn't pay the cold
+    hydration and load cost.
+    """
+
+    def __init__(
+        self,
+        manager: ModelManager,
+        top_n: int = 5,
+        disk_budget: Optional[int] = None,
+        ram_budget: Optional[int] = 4 * 1024 ** 3,
+        restore: Optional[Callable[[ModelInfo], None]] = None,
+        select: Optional[Callable[[str], str]] = None
+    ):
+        self.manager = manager
+        self.top_n = top_n
+        self.disk_budget = disk_budget
+        self.ram_budget = ram_budget
+        self.restore = restore
+        # Maps a model to the variant loaders will actually open (see model_variants)
+        self.select = select
+
+    def prefetch(self) -> PrefetchResult:
+        """Run one restore-and-warm pass over the current top models (blocking)"""
+        result = PrefetchResult()
+        start = time.perf_counter()
+        disk_used = 0
+        ram_used = 0
+        with TRACER.span("prefetch", top_n=self.top_n):
+            for model in self.manager.top_models(self.top_n):
+                if self.select is not None:
+                    model = self.manager.get_model(self.select(model.name)) or model
+                size = self.manager.get_stats(model.name)[0]
+                if self.disk_budget is not None and disk_used + size > self.disk_budget:
+                    result.skipped.append(model.name)
+                    continue
+                if not os.path.exists(model.path):
+                    if self.restore is None:
+                        result.skipped.append(model.name)
+                        continue
+                    try:
+                        self.restore(model)
+                    except Exception as e:
+                        logger.warning(f"Prefetch could not restore {model.name}: {e}")
+                        result.skipped.append(model.name)
+                        continue
+                    result.restored.append(model.name)
+                    result.bytes_restored += size
+                disk_used += size
+
+                if self.ram_budget is not None and ram_used + size > self.ram_budget:
+                    continue
+                try:
+                    ram_used += warm_page_cache(model.path)
+                except OSError as e:
+                    logger.warning(f"Prefetch could not warm {model.name}: {e}")
+                    continue
+                result.warmed.append(model.name)
+        result.bytes_warmed = ram_used
+        result.elapsed = time.perf_counter() - start
+        if result.restored or result.warmed:
+            logger.info(
+                f"Prefetched {len(result.warmed)} model(s) ({ram_used / 1024 ** 2:.0f} MiB warm, "
+                f"{len(result.restored)} restored) in {result.elapsed:.1f}s"
+            )
+        return result
+
+    async def run_idle(self, is_idle: Callable[[], bool], interval: float = 300.0):
+        """Re-warm the top models and persist usage whenever the app is idle"""
+        while True:
+            await asyncio.sleep(interval)
+            if not is_idle():
+                continue
+            try:
+                await asyncio.to_thread(self.prefetch)
+                self.manager.flush_usage()
+            except Exception as e:
+                logger.warning(f"Idle prefetch failed: {e}")
+
+def prefetcher_from_env(manager: ModelManager, restore: Optional[Callable[[ModelInfo], None]] = None, select: Optional[Callable[[str], str]] = None) -> Prefetcher:
+    """Build a Prefetcher configured by FLUX_PREFETCH_TOP_N / _DISK_BYTES / _RAM_BYTES"""
+    disk_budget = os.getenv("FLUX_PREFETCH_DISK_BYTES")
+    ram_budget = os.getenv("FLUX_PREFETCH_RAM_BYTES")
+    return Prefetcher(
+        manager,
+        top_n=int(os.getenv("FLUX_PREFETCH_TOP_N", "5")),
+        disk_budget=int(disk_budget) if disk_budget else None,
+        ram_budget=int(ram_budget) if ram_budget else 4 * 1024 ** 3,
+        restore=restore,
+        select=select
+    )
@@ -0,0 +1,260 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Leaf frames of threads that are waiting rather than working
+IDLE_FRAMES = frozenset({
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("socket.py", "accept"),
+    ("thread.py", "_worker"),
+    ("connection.py", "wait")
+})
+MAX_SECONDS = 120.0
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+class _RequestTags:
+    """Which request each event-loop task is serving, recorded only while a profile runs"""
+
+    def __init__(self):
+        self.active = False
+        self.tasks: Dict[asyncio.Task, Dict] = {}
+
+    def route(self, scope: Dict) -> str:
+        route = scope.get("route")
+        return f"{scope.get('method', 'WS')} {getattr(route, 'path', scope.get('path', '?'))}"
+
+REQUESTS = _RequestTags()
+
+class RequestTagMiddleware:
+    """ASGI middleware tagging the task that runs each request's handler.
+
+    When no profile is running this is one attribute check per request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not REQUESTS.active or scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        task = asyncio.current_task()
+        REQUESTS.tasks[task] = scope
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            REQUESTS.tasks.pop(task, None)
+
+def _thread_cpu(ident: int) -> Optional[float]:
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError):
+        return None
+
+class SamplingProfiler:
+    """Time-boxed statistical profiler over every thread of this process.
+
+    A background thread reads ``sys._current_frames()`` every ``interval``
+    seconds and counts whole stacks, which come out in the collapsed format
+    flamegraph.pl and speedscope read. When ``loop`` is given, busy samples
+    of its thread are also counted against the request its running task
+    serves (see RequestTagMiddleware), which estimates each handler's time
+    on the event loop.
+    """
+
+    def __init__(self, interval: float = 0.005, include_idle: bool = False, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.interval = interval
+        self.include_idle = include_idle
+        self.loop = loop
+        self.loop_thread: Optional[int] = None
+        self.stacks: Counter = Counter()
+        self.handler_samples: Counter = Counter()
+        self.thread_samples: Counter = Counter()
+        self.samples = 0
+        self.idle_samples = 0
+        self._labels: Dict[object, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = 0.0
+        self._elapsed = 0.0
+        self._sampling_time = 0.0
+        self._cpu_start: Dict[int, float] = {}
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+        return label
+
+    def start(self):
+        if self.loop is not None:
+            self.loop_thread = threading.get_ident()
+        self._started = time.perf_counter()
+        self._cpu_start = {t.ident: _thread_cpu(t.ident) for t in threading.enumerate()}
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            start = time.perf_counter()
+            self._sample(own)
+            self._sampling_time += time.perf_counter() - start
+
+    def _sample(self, own: int):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            leaf = frame.f_code
+            if not self.include_idle and (os.path.basename(leaf.co_filename), leaf.co_name) in IDLE_FRAMES:
+                self.idle_samples += 1
+                continue
+            codes = []
+            while frame is not None:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            name = names.get(ident, str(ident))
+            self.stacks[";".join([name, *(self._label(code) for code in reversed(codes))])] += 1
+            self.thread_samples[name] += 1
+            if ident == self.loop_thread:
+                task = asyncio.current_task(self.loop)
+                scope = REQUESTS.tasks.get(task)
+                self.handler_samples[REQUESTS.route(scope) if scope is not None else "(not a request)"] += 1
+        self.samples += 1
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._elapsed = time.perf_counter() - self._started
+
+    def collapsed(self) -> str:
+        """One "frame;frame;... count" line per distinct stack, root first"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def thread_cpu(self) -> Dict[str, Dict[str, float]]:
+        """Measured CPU time per thread over the profile, plus its sample count"""
+        result = {}
+        for thread in threading.enumerate():
+            start = self._cpu_start.get(thread.ident)
+            end = _thread_cpu(thread.ident)
+            if thread.ident == getattr(self._thread, "ident", None):
+                continue
+            entry = {"samples": self.thread_samples.get(thread.name, 0)}
+            if start is not None and end is not None:
+                entry["cpu_ms"] = (end - start) * 1000
+            result[thread.name] = entry
+        return result
+
+    def report(self) -> Dict:
+        per_sample = self._elapsed / self.samples if self.samples else self.interval
+        return {
+            "duration_s": self._elapsed,
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "idle_samples": self.idle_samples,
+            # Share of the window the sampler itself spent walking stacks
+            "overhead": self._sampling_time / self._elapsed if self._elapsed else 0.0,
+            "handlers_loop_ms": {route: count * per_sample * 1000 for route, count in self.handler_samples.most_common()},
+            "threads": self.thread_cpu(),
+            "collapsed": self.collapsed()
+        }
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes a sleeping coroutine"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.lags: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - start - self.interval))
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def report(self) -> Dict[str, float]:
+        ordered = sorted(self.lags)
+
+        def pct(p: float) -> float:
+            if not ordered:
+                return 0.0
+            return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))] * 1000
+
+        return {
+            "checks": len(ordered),
+            "p50_ms": pct(50),
+            "p95_ms": pct(95),
+            "p99_ms": pct(99),
+            "max_ms": ordered[-1] * 1000 if ordered else 0.0
+        }
+
+_busy = threading.Lock()
+
+async def profile(
+    seconds: float,
+    interval: float = 0.005,
+    include_idle: bool = False,
+    wall_times: Optional[Callable[[], Dict[str, Tuple[float, int]]]] = None
+) -> Dict:
+    """Sample all threads for seconds while watching this event loop's lag.
+
+    Must run on the event loop serving requests. ``wall_times`` returns
+    route -> (total seconds, requests) so far; the report holds its change
+    over the window. Only one profile runs at a time.
+    """
+    if not _busy.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+    try:
+        seconds = min(max(seconds, interval), MAX_SECONDS)
+        before = wall_times() if wall_times else {}
+        profiler = SamplingProfiler(interval, include_idle, asyncio.get_running_loop())
+        lag = LoopLagMonitor()
+        lag.start()
+        REQUESTS.active = True
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.stop()
+            REQUESTS.active = False
+            REQUESTS.tasks.clear()
+            await lag.stop()
+        report = profiler.report()
+        report["loop_lag"] = lag.report()
+        if wall_times:
+            handlers_wall = {}
+            for route, (total, count) in wall_times().items():
+                old_total, old_count = before.get(route, (0.0, 0))
+                if count > old_count:
+                    handlers_wall[route] = {
+                        "requests": count - old_count,
+                        "wall_ms": (total - old_total) * 1000,
+                        "mean_ms": (total - old_total) * 1000 / (count - old_count)
+                    }
+            report["handlers_wall"] = handlers_wall
+        return report
+    finally:
+        _busy.release()
@@ -0,0 +1,210 @@
+import os
+import json
+import mmap
+import struct
+import hashlib
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+# safetensors dtype -> NumPy dtype; BF16 has no NumPy equivalent and is read as raw uint16
+DTYPES = {
+    "F64": np.float64,
+    "F32": np.float32,
+    "F16": np.float16,
+    "BF16": np.uint16,
+    "I64": np.int64,
+    "I32": np.int32,
+    "I16": np.int16,
+    "I8": np.int8,
+    "U8": np.uint8,
+    "BOOL": np.bool_
+}
+FLOAT_DTYPES = ("F64", "F32", "F16", "BF16")
+COPY_CHUNK_SIZE = 16 * 1024 * 1024
+MAX_HEADER_SIZE = 100 * 1024 * 1024  # the format's own limit
+
+def itemsize(dtype: str) -> int:
+    return np.dtype(DTYPES[dtype]).itemsize
+
+def bf16_to_float32(raw: np.ndarray) -> np.ndarray:
+    return (raw.astype(np.uint32) << 16).view(np.float32)
+
+def float32_to_bf16(values: np.ndarray) -> np.ndarray:
+    """Round to nearest even, as torch does"""
+    bits = np.ascontiguousarray(values, dtype=np.float32).view(np.uint32)
+    rounding = ((bits >> 16) & 1) + 0x7FFF
+    return ((bits + rounding) >> 16).astype(np.uint16)
+
+def to_float32(array: np.ndarray, dtype: str) -> np.ndarray:
+    """A float32 copy of a tensor read from a file"""
+    if dtype == "BF16":
+        return bf16_to_float32(array)
+    return array.astype(np.float32)
+
+def from_float32(values: np.ndarray, dtype: str) -> np.ndarray:
+    """Cast float32 values back to a safetensors float dtype"""
+    if dtype == "BF16":
+        return float32_to_bf16(values)
+    return values.astype(DTYPES[dtype])
+
+def read_header(f) -> Tuple[Dict[str, Dict], Dict[str, str], int]:
+    """(tensor entries, __metadata__, data offset) from a file opened in binary mode"""
+    (header_size,) = struct.unpack("<Q", f.read(8))
+    if header_size > MAX_HEADER_SIZE:
+        raise ValueError(f"header of {header_size} bytes")
+    header = json.loads(f.read(header_size))
+    if not isinstance(header, dict):
+        raise ValueError("header is not an object")
+    metadata = header.pop("__metadata__", None) or {}
+    return header, metadata, 8 + header_size
+
+class SafetensorsFile:
+    """Read-only, memory-mapped view of a .safetensors file.
+
+    Tensors are returned as NumPy views onto the mapping, so only the pages a
+    caller touches are read and nothing is copied until it does arithmetic.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            header, metadata, data_offset = read_header(self._file)
+        except (struct.error, ValueError) as e:
+            self._file.close()
+            raise ValueError(f"{path} is not a safetensors file: {e}")
+        self.metadata: Dict[str, str] = metadata
+        self.header: Dict[str, Dict] = header
+        self.data_offset = data_offset
+        self._mmap = None
+        if os.fstat(self._file.fileno()).st_size > self.data_offset:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def keys(self) -> List[str]:
+        """Tensor names in file order"""
+        return sorted(self.header, key=lambda name: self.header[name]["data_offsets"][0])
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.header
+
+    def dtype(self, name: str) -> str:
+        return self.header[name]["dtype"]
+
+    def shape(self, name: str) -> Tuple[int, ...]:
+        return tuple(self.header[name]["shape"])
+
+    def nbytes(self, name: str) -> int:
+        begin, end = self.header[name]["data_offsets"]
+        return end - begin
+
+    def raw(self, name: str) -> memoryview:
+        """The tensor's bytes, without copying"""
+        begin, end = self.header[name]["data_offsets"]
+        if self._mmap is None:
+            return memoryview(b"")
+        return memoryview(self._mmap)[self.data_offset + begin:self.data_offset + end]
+
+    def tensor(self, name: str) -> np.ndarray:
+        """A read-only array view (BF16 tensors come back as uint16 bit patterns)"""
+        info = self.header[name]
+        return np.frombuffer(self.raw(name), dtype=DTYPES[info["dtype"]]).reshape(info["shape"])
+
+    def float32(self, name: str) -> np.ndarray:
+        return to_float32(self.tensor(name), self.dtype(name))
+
+    def close(self):
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # A caller still holds a tensor view; the mapping closes when it is dropped
+                pass
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self) -> "SafetensorsFile":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class SafetensorsWriter:
+    """Streams tensors into a .safetensors file in a fixed, pre-declared order.
+
+    The header is written up front from (name, dtype, shape) specs, so each
+    tensor's data can be written as soon as it is produced and then dropped.
+    ``alignment`` pads every tensor's offset to that many bytes.
+    """
+
+    def __init__(self, path: str, specs: Iterable[Tuple[str, str, Tuple[int, ...]]], metadata: Optional[Dict[str, str]] = None, alignment: int = 8):
+        self.path = path
+        header = {}
+        self._order = []
+        offset = 0
+        for name, dtype, shape in specs:
+            offset = -(-offset // alignment) * alignment
+            size = int(np.prod(shape, dtype=np.int64)) * itemsize(dtype)
+            header[name] = {"dtype": dtype, "shape": list(shape), "data_offsets": [offset, offset + size]}
+            self._order.append(name)
+            offset += size
+        if metadata:
+            header["__metadata__"] = {str(k): str(v) for k, v in metadata.items()}
+        self.header = header
+        self.size = offset
+        encoded = json.dumps(header, separators=(",", ":")).encode()
+        # Pad so the data section starts aligned, as the reference implementation does
+        data_start = -(-(8 + len(encoded)) // alignment) * alignment
+        encoded += b" " * (data_start - 8 - len(encoded))
+        self._file = open(path, "wb")
+        self._file.write(struct.pack("<Q", len(encoded)) + encoded)
+        self._data_start = data_start
+        self._next = 0
+
+    @property
+    def total_size(self) -> int:
+        return self._data_start + self.size
+
+    def write(self, name: str, data):
+        """Write a tensor's bytes (an array or bytes-like); tensors must come in spec order"""
+        self.write_chunks(name, [data])
+
+    def write_chunks(self, name: str, chunks: Iterable):
+        """Write a tensor from consecutive pieces, so it never has to exist whole in memory"""
+        if self._next >= len(self._order) or self._order[self._next] != name:
+            raise ValueError(f"Expected tensor {self._order[self._next] if self._next < len(self._order) else None}, got {name}")
+        begin, end = self.header[name]["data_offsets"]
+        self._file.seek(self._data_start + begin)
+        written = 0
+        for data in chunks:
+            if isinstance(data, np.ndarray):
+                data = np.ascontiguousarray(data).data.cast("B")
+            view = memoryview(data)
+            for start in range(0, view.nbytes, COPY_CHUNK_SIZE):
+                self._file.write(view[start:start + COPY_CHUNK_SIZE])
+            written += view.nbytes
+        if written != end - begin:
+            raise ValueError(f"Tensor {name} is {written} bytes, expected {end - begin}")
+        self._next += 1
+
+    def close(self):
+        if not self._file.closed:
+            # Trailing alignment padding is never written; extend to the declared size
+            self._file.truncate(self.total_size)
+            self._file.close()
+
+    def __enter__(self) -> "SafetensorsWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def file_sha256(path: str, chunk_size: int = COPY_CHUNK_SIZE) -> str:
+    digest = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            digest.update(memoryview(buffer)[:n])
+    return digest.hexdigest()
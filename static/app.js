@@ -87,7 +87,16 @@ function displayModels(models) {
         `;
         
         const downloadBtn = card.querySelector('.download-btn');
-        downloadBtn.addEventListener('click', () => downloadModel(model));
+        if (model.source === 'local') {
+            // Already in the library: select it instead of downloading again
+            downloadBtn.textContent = 'Use Model';
+            downloadBtn.addEventListener('click', () => {
+                currentModel = model.name;
+                showSuccess(`Selected ${model.name}`);
+            });
+        } else {
+            downloadBtn.addEventListener('click', () => downloadModel(model));
+        }
         
         modelList.appendChild(card);
     });
@@ -103,7 +112,7 @@ async function downloadModel(model) {
             },
             body: JSON.stringify({
                 ...model,
-                source: modelSource.value
+                source: model.source || modelSource.value
             })
         });
 
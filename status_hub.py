@@ -0,0 +1,161 @@
+import copy
+import time
+import asyncio
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+def merge_patch(target: Dict, patch: Dict) -> Dict:
+    """Apply a JSON merge patch (RFC 7386) in place: None deletes a key, dicts merge"""
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        elif isinstance(value, dict):
+            if not isinstance(target.get(key), dict):
+                target[key] = {}
+            merge_patch(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+    return target
+
+def _compose(pending: Dict, patch: Dict):
+    """Fold a later merge patch into an earlier unsent one, keeping deletions"""
+    for key, value in patch.items():
+        if isinstance(value, dict) and isinstance(pending.get(key), dict):
+            _compose(pending[key], value)
+        else:
+            pending[key] = copy.deepcopy(value)
+
+def _differs(target: Dict, patch: Dict) -> bool:
+    """Whether applying patch would change target"""
+    for key, value in patch.items():
+        if value is None:
+            if key in target:
+                return True
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            if _differs(target[key], value):
+                return True
+        elif target.get(key) != value:
+            return True
+    return False
+
+class Subscription:
+    """One listener's view of the hub: a coalesced patch waiting to be sent.
+
+    Updates that arrive faster than the client reads are merged into the
+    pending patch instead of queueing, so a slow dashboard costs one dict
+    however busy the hub is.
+    """
+
+    def __init__(self, hub: "StatusHub", loop: asyncio.AbstractEventLoop):
+        self.hub = hub
+        self.loop = loop
+        self._pending: Dict = {}
+        self._version = 0
+        self._event = asyncio.Event()
+
+    def _offer(self, patch: Dict, version: int):
+        # Called with the hub lock held, from any thread
+        _compose(self._pending, patch)
+        self._version = version
+        self.loop.call_soon_threadsafe(self._event.set)
+
+    async def next(self, timeout: Optional[float] = None) -> Optional[Tuple[int, Dict]]:
+        """Wait for the next (version, patch); None on timeout"""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        with self.hub._lock:
+            self._event.clear()
+            patch, self._pending = self._pending, {}
+            return self._version, patch
+
+    def close(self):
+        self.hub._unsubscribe(self)
+
+class StatusHub:
+    """Live application state, published to subscribers as merge-patch deltas.
+
+    State is a JSON-able dict of sections (``components``, ``queue``, ``jobs``,
+    ``models``). Writers call ``update`` from any thread; every change bumps
+    ``version`` and wakes waiters and subscribers, so dashboards stream deltas
+    instead of polling the full state and workers block on ``wait_for``
+    instead of sleeping in a loop.
+    """
+
+    def __init__(self):
+        self._state: Dict[str, Any] = {"components": {}, "queue": {}, "jobs": {}, "models": {}}
+        self.version = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._subscribers: List[Subscription] = []
+
+    def snapshot(self) -> Tuple[int, Dict]:
+        with self._lock:
+            return self.version, copy.deepcopy(self._state)
+
+    def get(self, section: str, key: Optional[str] = None, default=None):
+        with self._lock:
+            value = self._state.get(section, {})
+            if key is not None:
+                value = value.get(key, default)
+            return copy.deepcopy(value)
+
+    def update(self, patch: Dict):
+        """Merge a patch into the state and publish it; a None value deletes"""
+        with self._lock:
+            if not _differs(self._state, patch):
+                return
+            merge_patch(self._state, patch)
+            self.version += 1
+            for subscriber in self._subscribers:
+                try:
+                    subscriber._offer(patch, self.version)
+                except RuntimeError:
+                    # The subscriber's event loop has closed
+                    pass
+            self._changed.notify_all()
+
+    def component(self, name: str, status: str, **details):
+        """Record a component's lifecycle state (e.g. starting, ready, stopped)"""
+        self.update({"components": {name: {"status": status, "since": time.time(), **details}}})
+
+    def subscribe(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> Tuple[Subscription, int, Dict]:
+        """Register a listener; returns it with the snapshot its deltas apply to"""
+        subscription = Subscription(self, loop or asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.append(subscription)
+            subscription._version = self.version
+            return subscription, self.version, copy.deepcopy(self._state)
+
+    def _unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def wait_for(self, predicate: Callable[[Dict], bool], timeout: Optional[float] = None) -> bool:
+        """Block until predicate(state) holds; returns False on timeout"""
+        with self._changed:
+            return self._changed.wait_for(lambda: predicate(self._state), timeout)
+
+    async def wait_for_async(self, predicate: Callable[[Dict], bool], timeout: Optional[float] = None) -> bool:
+        """wait_for for coroutines: sleeps on the subscription instead of a thread"""
+        subscription, _, state = self.subscribe()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while not predicate(state):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                update = await subscription.next(remaining)
+                if update is not None:
+                    merge_patch(state, update[1])
+            return True
+        finally:
+            subscription.close()
+
+HUB = StatusHub()
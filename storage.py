@@ -0,0 +1,267 @@
+import os
+import time
+import shutil
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, Iterable, List, Optional
+from model_manager import ModelInfo, ModelManager, model_files
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+STORAGE_ROOTS = ("models", "uploads", os.path.join("ComfyUI", "models"))
+
+STORAGE_FREE_BYTES = REGISTRY.gauge(
+    "flux_storage_free_bytes",
+    "Free bytes on the filesystem of a storage root, minus outstanding reservations",
+    ["root"]
+)
+STORAGE_EVICTED_BYTES = REGISTRY.counter(
+    "flux_storage_evicted_bytes_total",
+    "Bytes of cold, persisted model files evicted from local disk"
+)
+
+def _format_bytes(n: int) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(n) < 1024:
+            return f"{n:.0f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TiB"
+
+class InsufficientStorageError(Exception):
+    """Raised when a write cannot be admitted even after eviction"""
+
+    def __init__(self, path: str, needed: int, available: int):
+        super().__init__(
+            f"Not enough disk space for {path}: need {_format_bytes(needed)}, "
+            f"{_format_bytes(max(0, available))} available"
+        )
+        self.path = path
+        self.needed = needed
+        self.available = available
+
+def _device(path: str) -> int:
+    """Filesystem id of path, or of its nearest existing parent"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return os.stat(path).st_dev
+
+def _existing(path: str) -> str:
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return path
+
+def default_is_persisted(model: ModelInfo) -> bool:
+    """For hosts without a Drive: nothing has a copy to restore from, so nothing is evictable"""
+    return False
+
+@dataclass
+class Reservation:
+    governor: "StorageGovernor"
+    device: int
+    path: str
+    nbytes: int
+    released: bool = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.governor._release(self)
+
+    def __enter__(self) -> "Reservation":
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class StorageGovernor:
+    """Admission control and eviction for the directories models are written to.
+
+    A writer reserves the bytes it is about to write before it starts. If the
+    filesystem (minus other outstanding reservations and ``headroom``) can't
+    hold them, cold models that can be restored later (see ``is_persisted``)
+    are deleted from local disk, least recently used first, and if that isn't
+    enough the write is rejected with InsufficientStorageError.
+    """
+
+    def __init__(
+        self,
+        roots: Iterable[str] = STORAGE_ROOTS,
+        manager: Optional[ModelManager] = None,
+        headroom: int = 1024 ** 3,
+        is_persisted: Callable[[ModelInfo], bool] = default_is_persisted,
+        pinned: Callable[[], Iterable[str]] = lambda: (),
+        min_idle_seconds: float = 600.0
+    ):
+        self.roots = list(roots)
+        self.manager = manager
+        self.headroom = headroom
+        self.is_persisted = is_persisted
+        self.pinned = pinned
+        self.min_idle_seconds = min_idle_seconds
+        self._reserved: Dict[int, int] = {}
+        # Guards only the reservation accounting; eviction (Drive checks, deletes) runs outside it
+        self._lock = threading.Lock()
+        # One eviction pass at a time, so concurrent writers don't both evict for the same shortfall
+        self._evicting = threading.Lock()
+
+    def _free(self, device: int, path: str) -> int:
+        return shutil.disk_usage(_existing(path)).free - self._reserved.get(device, 0) - self.headroom
+
+    def _admit(self, device: int, path: str, nbytes: int) -> Optional[Reservation]:
+        with self._lock:
+            if self._free(device, path) < nbytes:
+                return None
+            self._reserved[device] = self._reserved.get(device, 0) + nbytes
+        return Reservation(self, device, path, nbytes)
+
+    def try_reserve(self, path: str, nbytes: int, evict: bool = True) -> Optional[Reservation]:
+        """Reserve nbytes for a write to path, evicting if needed; None if it doesn't fit"""
+        device = _device(path)
+        reservation = self._admit(device, path, nbytes)
+        if reservation is not None or not evict or self.manager is None:
+            return reservation
+        with self._evicting:
+            # Another writer's eviction may already have made room
+            reservation = self._admit(device, path, nbytes)
+            if reservation is None:
+                with self._lock:
+                    needed = nbytes - self._free(device, path)
+                self._evict(device, needed)
+                reservation = self._admit(device, path, nbytes)
+        return reservation
+
+    def reserve(self, path: str, nbytes: int) -> Reservation:
+        """Reserve space or raise InsufficientStorageError"""
+        reservation = self.try_reserve(path, nbytes)
+        if reservation is None:
+            raise InsufficientStorageError(path, nbytes, self.available(path))
+        return reservation
+
+    async def reserve_async(self, path: str, nbytes: int, timeout: float = 0.0, poll_interval: float = 1.0) -> Reservation:
+        """Reserve space, waiting up to timeout for other writes to finish before rejecting"""
+        deadline = time.monotonic() + timeout
+        while True:
+            reservation = await asyncio.to_thread(self.try_reserve, path, nbytes)
+            if reservation is not None:
+                return reservation
+            if time.monotonic() >= deadline:
+                raise InsufficientStorageError(path, nbytes, self.available(path))
+            await asyncio.sleep(poll_interval)
+
+    def _release(self, reservation: Reservation):
+        with self._lock:
+            remaining = self._reserved.get(reservation.device, 0) - reservation.nbytes
+            if remaining > 0:
+                self._reserved[reservation.device] = remaining
+            else:
+                self._reserved.pop(reservation.device, None)
+
+    def available(self, path: str) -> int:
+        with self._lock:
+            return self._free(_device(path), path)
+
+    # Eviction
+
+    def _cold_models(self, device: Optional[int] = None) -> List[ModelInfo]:
+        """Local, unpinned, idle models, coldest first (least recently used, then least used)"""
+        pinned = set(self.pinned())
+        now = time.time()
+        candidates = []
+        for model in list(self.manager.models.values()):
+            if model.name in pinned or not os.path.exists(model.path):
+                continue
+            if device is not None and _device(model.path) != device:
+                continue
+            usage = self.manager.get_usage(model.name, now)
+            if usage["last_used"] and now - usage["last_used"] < self.min_idle_seconds:
+                continue
+            candidates.append((usage["last_used"], usage["uses"], model))
+        candidates.sort(key=lambda c: (c[0], c[1]))
+        return [model for _, _, model in candidates]
+
+    def _restorable(self, model: ModelInfo) -> bool:
+        """Every file of the model (all shards of a sharded one) has a persistent copy"""
+        return all(self.is_persisted(replace(model, path=path)) for path in model_files(model))
+
+    def eviction_candidates(self, device: Optional[int] = None) -> List[ModelInfo]:
+        """Evictable models, coldest first (least recently used, then least used)"""
+        if self.manager is None:
+            return []
+        return [model for model in self._cold_models(device) if self._restorable(model)]
+
+    def _evict(self, device: int, needed: int) -> int:
+        # is_persisted may ask the Drive, so check models one at a time and stop once there is room
+        freed = 0
+        for model in self._cold_models(device):
+            if freed >= needed:
+                break
+            if not self._restorable(model):
+                continue
+            size = 0
+            try:
+                for path in model_files(model):
+                    if os.path.isdir(path):
+                        size += _tree_size(path)
+                        shutil.rmtree(path)
+                    elif os.path.exists(path):
+                        size += os.path.getsize(path)
+                        os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not evict {model.name}: {e}")
+            if size:
+                freed += size
+                STORAGE_EVICTED_BYTES.inc(size)
+                logger.info(f"Evicted {model.name} ({_format_bytes(size)}) from local disk")
+        return freed
+
+    # Reporting
+
+    def report(self) -> Dict:
+        """Capacity per storage root"""
+        roots = []
+        for root in self.roots:
+            device = _device(root)
+            usage = shutil.disk_usage(_existing(root))
+            size = _tree_size(root)
+            with self._lock:
+                reserved = self._reserved.get(device, 0)
+            free = usage.free - reserved
+            STORAGE_FREE_BYTES.set(free, root=root)
+            roots.append({
+                "path": root,
+                "total": usage.total,
+                "used": usage.used,
+                "free": free,
+                "reserved": reserved,
+                "bytes": size
+            })
+        evicted = []
+        if self.manager is not None:
+            evicted = [m.name for m in list(self.manager.models.values()) if not os.path.exists(m.path)]
+        return {"headroom": self.headroom, "roots": roots, "not_local": evicted}
+
+def _tree_size(root: str) -> int:
+    total = 0
+    stack = [root]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+    return total
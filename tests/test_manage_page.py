@@ -0,0 +1,73 @@
+"""The /manage page lists every model type the catalog API returns."""
+import json
+import re
+import shutil
+import subprocess
+
+import pytest
+from fastapi.testclient import TestClient
+
+from model_manager import ModelManager, ModelType
+
+# A minimal DOM: the page's sections (parsed from the served HTML), a fetch
+# that answers with the real /api/models payload, and console.error as a failure
+HARNESS = """
+const sections = %(sections)s;
+const payload = %(payload)s;
+const containers = {};
+const errors = [];
+const document = {
+    querySelectorAll(selector) {
+        if (selector !== '[data-model-type]') throw new Error('unexpected selector ' + selector);
+        return sections.map(type => ({dataset: {modelType: type}}));
+    },
+    querySelector(selector) {
+        const match = selector.match(/^#(\\w+)List \\.models-container$/);
+        if (!match || !sections.includes(match[1])) return null;
+        return containers[match[1]] = containers[match[1]] || {innerHTML: ''};
+    },
+    getElementById() {
+        return {addEventListener() {}};
+    }
+};
+const fetch = async () => ({json: async () => payload});
+console.error = (...args) => errors.push(args.map(String).join(' '));
+%(script)s
+setTimeout(() => process.stdout.write(JSON.stringify({containers, errors})), 50);
+"""
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    import web_ui
+    from benchmarks.run import BenchWorker
+
+    monkeypatch.chdir(tmp_path)
+    manager = ModelManager(str(tmp_path / "models"))
+    for model_type in ModelType:
+        path = tmp_path / f"{model_type.value}-model.safetensors"
+        path.write_bytes(b"\0" * 2048)
+        manager.add_model(f"{model_type.value}-model", model_type, "custom", str(path))
+    monkeypatch.setattr(web_ui.app, "comfy_ui", BenchWorker(manager), raising=False)
+    return TestClient(web_ui.app)
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node to run the page script")
+def test_manage_lists_every_model_type(client):
+    page = client.get("/manage")
+    assert page.status_code == 200
+    html = page.text
+    sections = re.findall(r'data-model-type="(\w+)"', html)
+    assert set(sections) == {t.value for t in ModelType}
+    upload_types = re.findall(r'<option value="(\w+)"', html)
+    assert set(upload_types) <= set(sections)
+
+    script = re.search(r"<script>(.*)</script>", html, re.S).group(1)
+    payload = client.get("/api/models").json()
+    harness = HARNESS % {"sections": json.dumps(sections), "payload": json.dumps(payload), "script": script}
+    result = subprocess.run(["node", "-e", harness], capture_output=True, text=True, timeout=30, check=True)
+    rendered = json.loads(result.stdout)
+
+    assert rendered["errors"] == []
+    for model_type in ModelType:
+        container = rendered["containers"][model_type.value]["innerHTML"]
+        assert f"{model_type.value}-model" in container
+        assert "2.0 KB" in container
@@ -0,0 +1,142 @@
+import os
+import json
+import hmac
+import time
+import hashlib
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+from urllib.parse import parse_qsl
+
+RECORDED_PREFIXES = ("/api/generate", "/api/models", "/api/upload")
+# Short, enum-like fields that say which code path a request takes; kept in clear
+PLAIN_KEYS = frozenset({"source", "type", "model_type", "precision", "shard_size"})
+# Fields whose dict keys are user data (LoRA name -> strength), so keys are anonymized too
+HASHED_KEY_FIELDS = frozenset({"loras"})
+MAX_LIST_ITEMS = 1000
+
+def shape(value: Any, anonymize: Callable[[str], str], key: Optional[str] = None) -> Any:
+    """A request body with every string replaced by its length and a keyed hash.
+
+    Numbers, booleans and structure are kept, so a replay sends requests of
+    the same size and parameters; equal strings get equal hashes, so repeated
+    prompts and model names still repeat.
+    """
+    if isinstance(value, str):
+        if key in PLAIN_KEYS and len(value) <= 32:
+            return value
+        return {"$s": len(value), "$h": anonymize(value)}
+    if isinstance(value, list):
+        shaped = [shape(item, anonymize, key) for item in value[:MAX_LIST_ITEMS]]
+        if len(value) > MAX_LIST_ITEMS:
+            shaped.append({"$more": len(value) - MAX_LIST_ITEMS})
+        return shaped
+    if isinstance(value, dict):
+        if key in HASHED_KEY_FIELDS:
+            return {f"#{anonymize(k)}:{len(k)}": shape(v, anonymize) for k, v in value.items()}
+        return {k: shape(v, anonymize, k) for k, v in value.items()}
+    return value
+
+class TrafficRecorder:
+    """ASGI middleware logging anonymized request shapes and timings as JSON lines.
+
+    Only paths under ``prefixes`` are recorded. Each line holds the wall-clock
+    start, method, route template, status, latency, time to first byte, body
+    sizes and the ``shape`` of JSON bodies and query strings; multipart uploads
+    are recorded by size only. Strings are hashed with a per-recorder secret
+    salt, so a log can be shared without exposing prompts or model names.
+    """
+
+    def __init__(self, app, path: str, prefixes: Sequence[str] = RECORDED_PREFIXES, salt: Optional[bytes] = None, max_body: int = 1024 * 1024):
+        self.app = app
+        self.path = path
+        self.prefixes = tuple(prefixes)
+        self.max_body = max_body
+        self._salt = salt or os.urandom(16)
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", buffering=1)
+
+    def anonymize(self, value: str) -> str:
+        return hmac.new(self._salt, value.encode(), hashlib.sha256).hexdigest()[:12]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        started = time.time()
+        start = time.perf_counter()
+        headers = dict(scope.get("headers") or [])
+        content_type = headers.get(b"content-type", b"").decode("latin-1").split(";")[0].strip()
+        capture = content_type == "application/json"
+        body = bytearray()
+        state = {"received": 0, "sent": 0, "status": 500, "first_byte": None}
+
+        async def tee():
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                state["received"] += len(chunk)
+                if capture and len(body) <= self.max_body:
+                    body.extend(chunk)
+            return message
+
+        async def watch(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                state["first_byte"] = time.perf_counter() - start
+            elif message["type"] == "http.response.body":
+                state["sent"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, tee, watch)
+        finally:
+            self._record(scope, started, time.perf_counter() - start, content_type, bytes(body) if capture else None, state)
+
+    def _record(self, scope, started: float, latency: float, content_type: str, body: Optional[bytes], state: Dict):
+        route = scope.get("route")
+        entry = {
+            "ts": round(started, 6),
+            "method": scope["method"],
+            "route": getattr(route, "path", "unmatched"),
+            "status": state["status"],
+            "latency_ms": round(latency * 1000, 3),
+            "ttfb_ms": round(state["first_byte"] * 1000, 3) if state["first_byte"] is not None else None,
+            "bytes_in": state["received"],
+            "bytes_out": state["sent"]
+        }
+        if scope.get("path_params"):
+            entry["path_params"] = shape(dict(scope["path_params"]), self.anonymize)
+        query = scope.get("query_string", b"").decode("latin-1")
+        if query:
+            entry["query"] = shape(dict(parse_qsl(query, keep_blank_values=True)), self.anonymize)
+        if body is not None and len(body) <= self.max_body:
+            try:
+                entry["body"] = shape(json.loads(body), self.anonymize)
+            except ValueError:
+                entry["body"] = {"$bytes": len(body), "$type": content_type}
+        elif state["received"]:
+            entry["body"] = {"$bytes": state["received"], "$type": content_type}
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def read_log(path: str) -> Iterator[Dict]:
+    """Entries of a traffic log, skipping a torn last line"""
+    with open(path) as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+def load_log(path: str) -> List[Dict]:
+    """A traffic log's entries in start-time order"""
+    return sorted(read_log(path), key=lambda entry: entry["ts"])
@@ -1,23 +1,80 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict
+from typing import TYPE_CHECKING, List, Optional, Dict, Sequence, Tuple
+import io
 import os
-import aiohttp
+import re
+import hmac
+import json
 import asyncio
-from model_manager import ModelType
+import time
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import replace
+from model_manager import ModelType, model_files, parse_model_type
+from metrics import REGISTRY, REQUEST_LATENCY, GENERATION_DURATION, STARTUP, TRACER
+from model_sources import ModelSources, SOURCES
+from federated_search import FederatedSearch
+from output_store import OutputRecord, OutputStore, decode_image_payload
+from batch_generation import BatchItem, BatchRunner, BatchSpec
+from job_store import UNFINISHED, JobStatus, JobStore
+from prefetch import prefetcher_from_env
+from storage import STORAGE_ROOTS, InsufficientStorageError, StorageGovernor, default_is_persisted
+from status_hub import HUB
+from profiler import REQUESTS, RequestTagMiddleware
+from peers import PEER_BYTES, PeerNode
+
+# The NumPy-backed services (LoRA baking, variants, conditioning cache) are
+# imported on first use so the API comes up without loading NumPy
+if TYPE_CHECKING:
+    from lora_bake import LoraBaker
+    from model_variants import VariantManager
+    from conditioning_cache import ConditioningCache
 
 app = FastAPI(title="ComfyUI Lightning Studio")
 
-# Serve static files
-os.makedirs("static", exist_ok=True)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Serve the bundled static files; importing this module creates no directories
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+app.mount("/static", StaticFiles(directory=STATIC_DIR, check_dir=False), name="static")
+
+# Inside track_request_latency, so it sees the task that runs the handler
+app.add_middleware(RequestTagMiddleware)
+
+@app.middleware("http")
+async def track_request_latency(request: Request, call_next):
+    """Record per-route latency; routes are labelled by template, not raw path"""
+    start = time.perf_counter()
+    status = 500
+    if REQUESTS.active:
+        # Response bodies are sent from this task, not the handler's
+        REQUESTS.tasks[asyncio.current_task()] = request.scope
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        STARTUP.mark("first_response")
+        route = request.scope.get("route")
+        REQUEST_LATENCY.observe(
+            time.perf_counter() - start,
+            app="web_ui",
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=str(status)
+        )
+
+if os.getenv("FLUX_TRAFFIC_LOG"):
+    # Opt-in: log anonymized request shapes for benchmarks/replay.py
+    from traffic import TrafficRecorder
+    app.add_middleware(TrafficRecorder, path=os.environ["FLUX_TRAFFIC_LOG"])
 
 # Data models
 class ModelSearchRequest(BaseModel):
     query: str
-    source: str  # "civitai" or "huggingface"
+    source: str = "all"  # "local", "civitai", "huggingface" or "all"
     model_type: Optional[str] = None
     flux_only: bool = False
     limit: int = 20
@@ -31,109 +88,1167 @@ class GenerationRequest(BaseModel):
     width: int = 512
     height: int = 512
     seed: Optional[int] = None
+    loras: Dict[str, float] = {}  # LoRA name -> strength
+
+class BakeRequest(BaseModel):
+    checkpoint: str
+    loras: Dict[str, float]  # LoRA name -> strength
+    name: Optional[str] = None
+
+class ConvertRequest(BaseModel):
+    model: str
+    precision: Optional[str] = "bf16"  # "fp16", "bf16" or None to only reshard
+    shard_size: Optional[str] = None  # e.g. "2GiB"
+
+class ImportRequest(BaseModel):
+    paths: Optional[List[str]] = None  # files or folders inside the import roots; default: all roots
+    move: bool = False  # move into models/<type>/ instead of registering in place
+    hash_files: bool = True
+
+class BatchGenerationRequest(BaseModel):
+    prompts: List[str]
+    models: List[str]
+    negative_prompt: str = ""
+    seeds: Optional[List[int]] = None
+    seed_start: Optional[int] = None  # alternative to seeds: seed_start .. seed_start + seed_count - 1
+    seed_count: int = 1
+    steps: List[int] = [20]
+    cfg_scales: List[float] = [7.0]
+    sizes: List[Tuple[int, int]] = [(512, 512)]
+    loras: List[Dict[str, float]] = [{}]
+    concurrency: int = 2
+
+    def to_spec(self) -> BatchSpec:
+        if self.seeds is not None:
+            seeds = list(self.seeds)
+        elif self.seed_start is not None:
+            seeds = list(range(self.seed_start, self.seed_start + self.seed_count))
+        else:
+            seeds = [None] * max(1, self.seed_count)
+        return BatchSpec(
+            prompts=self.prompts,
+            models=self.models,
+            negative_prompt=self.negative_prompt,
+            seeds=seeds,
+            steps=self.steps,
+            cfg_scales=self.cfg_scales,
+            sizes=[tuple(size) for size in self.sizes],
+            loras=self.loras or [{}]
+        )
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(REGISTRY.render(), media_type=REGISTRY.CONTENT_TYPE)
+
+def _require_token(request: Request, token: Optional[str], header: str, kind: str):
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    supplied = request.headers.get("authorization", "")
+    supplied = supplied[len("Bearer "):] if supplied.startswith("Bearer ") else request.headers.get(header, "")
+    if not hmac.compare_digest(supplied.encode(), token.encode()):
+        raise HTTPException(status_code=401, detail=f"Invalid {kind} token")
+
+def require_admin(request: Request):
+    """Admin endpoints need FLUX_ADMIN_TOKEN as a bearer token; without one they don't exist"""
+    _require_token(request, os.getenv("FLUX_ADMIN_TOKEN"), "x-admin-token", "admin")
+
+def _route_wall_times() -> Dict[str, Tuple[float, int]]:
+    totals: Dict[str, Tuple[float, int]] = {}
+    for (app_name, method, route, _), (total, count) in REQUEST_LATENCY.totals().items():
+        if app_name == "web_ui":
+            key = f"{method} {route}"
+            old_total, old_count = totals.get(key, (0.0, 0))
+            totals[key] = (old_total + total, old_count + count)
+    return totals
+
+@app.post("/api/admin/profile")
+async def profile_process(http_request: Request, seconds: float = 10.0, interval_ms: float = 5.0, idle: bool = False, output: str = "json"):
+    """Sample every thread of this process (web server and host worker) for a few seconds.
+
+    Returns collapsed stacks for flamegraph tools, sampled event-loop time
+    per handler, request wall time per route, CPU per thread and event-loop lag;
+    ?output=collapsed returns only the stacks, as text.
+    """
+    from profiler import ProfilerBusy, profile
+    require_admin(http_request)
+    if output not in ("json", "collapsed"):
+        raise HTTPException(status_code=400, detail="output must be json or collapsed")
+    if not 0.1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="interval_ms must be between 0.1 and 1000")
+    try:
+        report = await profile(seconds, interval_ms / 1000, idle, _route_wall_times)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if output == "collapsed":
+        return Response(report["collapsed"], media_type="text/plain")
+    return report
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness plus boot progress; answers while ComfyUI and the ML stack are still loading"""
+    comfy_ui = getattr(app, "comfy_ui", None)
+    return {
+        "status": "ok",
+        "comfyui_ready": bool(getattr(comfy_ui, "ready", False)),
+        "startup": STARTUP.report()
+    }
+
+@app.get("/api/status")
+async def status():
+    """Full live state: components, queue, unfinished jobs and models"""
+    version, state = HUB.snapshot()
+    return {"version": version, "state": state}
+
+@app.get("/api/status/events")
+async def status_events(heartbeat: float = 15.0):
+    """Server-sent events: a snapshot, then merge-patch (RFC 7386) deltas as state changes"""
+    subscription, version, state = HUB.subscribe()
+
+    async def events():
+        try:
+            yield f"event: snapshot\nid: {version}\ndata: {json.dumps(state)}\n\n"
+            while True:
+                update = await subscription.next(heartbeat)
+                if update is None:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: delta\nid: {update[0]}\ndata: {json.dumps(update[1])}\n\n"
+        finally:
+            subscription.close()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/api/status/ws")
+async def status_socket(websocket: WebSocket):
+    """The same snapshot-then-delta stream as /api/status/events, over a WebSocket"""
+    await websocket.accept()
+    subscription, version, state = HUB.subscribe()
+
+    async def send():
+        await websocket.send_json({"type": "snapshot", "version": version, "data": state})
+        while True:
+            update = await subscription.next(15.0)
+            if update is None:
+                await websocket.send_json({"type": "ping"})
+                continue
+            await websocket.send_json({"type": "delta", "version": update[0], "data": update[1]})
+
+    async def receive():
+        # Clients don't send anything; this just notices when they leave
+        while True:
+            await websocket.receive_text()
+
+    tasks = [asyncio.ensure_future(send()), asyncio.ensure_future(receive())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not isinstance(task.exception(), WebSocketDisconnect):
+                task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        subscription.close()
+
+def publish_catalog():
+    manager = app.comfy_ui.model_manager
+    HUB.update({"models": {"catalog": {"count": len(manager.models), "version": manager.version}}})
+
+@app.on_event("startup")
+async def start_status():
+    """Publish the web app's lifecycle and follow catalog changes"""
+    HUB.component("web", "ready")
+    manager = getattr(getattr(app, "comfy_ui", None), "model_manager", None)
+    if manager is not None:
+        if publish_catalog not in manager.listeners:
+            manager.listeners.append(publish_catalog)
+        publish_catalog()
+
+@app.on_event("shutdown")
+async def stop_status():
+    HUB.component("web", "stopped")
+
+@app.get("/api/models/popular")
+async def popular_models(limit: int = 10, model_type: Optional[str] = None):
+    """Models ranked by predicted demand (recency-weighted request counts)"""
+    manager = app.comfy_ui.model_manager
+    models = manager.top_models(min(limit, 100), parse_model_type(model_type) if model_type else None)
+    return {"models": [
+        {"name": m.name, "type": m.type.value, **manager.get_usage(m.name)}
+        for m in models
+    ]}
 
 @app.get("/api/models")
 async def list_models(model_type: Optional[str] = None):
     """List all available models"""
     try:
-        models = app.comfy_ui.list_models(
-            ModelType(model_type) if model_type else None
+        body = app.comfy_ui.model_manager.list_models_json(
+            parse_model_type(model_type) if model_type else None
         )
-        return {"models": models}
+        return Response(body, media_type="application/json")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def get_storage() -> StorageGovernor:
+    """Disk-space admission and eviction for models/, uploads/ and ComfyUI/models/"""
+    if getattr(app, "storage", None) is None:
+        comfy_ui = getattr(app, "comfy_ui", None)
+        app.storage = StorageGovernor(
+            STORAGE_ROOTS,
+            manager=getattr(comfy_ui, "model_manager", None),
+            headroom=int(os.getenv("FLUX_STORAGE_HEADROOM_BYTES", str(1024 ** 3))),
+            is_persisted=getattr(comfy_ui, "is_persisted", default_is_persisted),
+            pinned=lambda: {getattr(app, "resident_model", None), *list(models_in_use())}
+        )
+        peers = getattr(comfy_ui, "peers", None)
+        if peers is not None and peers.reserve is None:
+            # Files fetched from peers are admitted like any other model write
+            peers.reserve = app.storage.reserve
+    return app.storage
+
+async def reserve_storage(path: str, nbytes: int):
+    """Reserve disk space for a write, queueing up to FLUX_STORAGE_WAIT_SECONDS before rejecting"""
+    return await get_storage().reserve_async(path, nbytes, float(os.getenv("FLUX_STORAGE_WAIT_SECONDS", "0")))
+
+def models_in_use() -> "Counter[str]":
+    """Models that running jobs read, by number of jobs; eviction skips them"""
+    if getattr(app, "models_in_use", None) is None:
+        app.models_in_use = Counter()
+    return app.models_in_use
+
+async def ensure_local(names: Sequence[str]):
+    """Bring back catalog models missing from local disk: from peers or the Drive, else their source"""
+    manager = app.comfy_ui.model_manager
+    restore = getattr(app.comfy_ui, "restore_model", None)
+    for name in names:
+        model = manager.get_model(name)
+        if model is None or all(os.path.exists(path) for path in model_files(model)):
+            continue
+        if restore is not None:
+            with await reserve_storage(model.path, manager.get_stats(name)[0]):
+                # A sharded variant's index names its shards only once it is back
+                for _ in range(2):
+                    for path in model_files(model):
+                        if not os.path.exists(path):
+                            await asyncio.to_thread(restore, replace(model, path=path))
+        if not all(os.path.exists(path) for path in model_files(model)):
+            await get_sources().redownload(model)
+        if not all(os.path.exists(path) for path in model_files(model)):
+            raise HTTPException(status_code=503, detail=f"Model {name} is not on local disk and could not be restored")
+
+@asynccontextmanager
+async def using_models(names: Sequence[str]):
+    """Pin the models a job reads for as long as it runs, restoring any that were evicted first"""
+    names = [name for name in dict.fromkeys(names) if name]
+    in_use = models_in_use()
+    in_use.update(names)
+    try:
+        await ensure_local(names)
+        yield
+    finally:
+        in_use.subtract(names)
+        for name in names:
+            if in_use[name] <= 0:
+                del in_use[name]
+
+async def persist_model(name: str):
+    """Copy a model the catalog added to the host's Drive, which is what makes it evictable"""
+    persist = getattr(app.comfy_ui, "persist_model", None)
+    model = app.comfy_ui.model_manager.get_model(name)
+    if persist is None or model is None:
+        return
+    is_persisted = getattr(app.comfy_ui, "is_persisted", None)
+    try:
+        for path in model_files(model):
+            copy = replace(model, path=path)
+            if is_persisted is None or not await asyncio.to_thread(is_persisted, copy):
+                await asyncio.to_thread(persist, copy)
+    except Exception as e:
+        # The model stays usable; without a copy it is just never evicted
+        print(f"Could not persist {name}: {e}")
+
+def get_peers() -> Optional[PeerNode]:
+    """The host's peer node; None unless FLUX_PEER_TOKEN is set"""
+    return getattr(getattr(app, "comfy_ui", None), "peers", None)
+
+def get_sources() -> ModelSources:
+    """Shared async clients for the upstream model sources"""
+    if getattr(app, "sources", None) is None:
+        app.sources = ModelSources(
+            os.getenv("CIVITAI_API_KEY"),
+            os.getenv("HUGGINGFACE_TOKEN"),
+            reserve=reserve_storage,
+            peers=get_peers()
+        )
+    return app.sources
+
+@app.get("/api/storage")
+async def storage_report():
+    """Capacity, reservations and usage for each storage root"""
+    return await asyncio.to_thread(get_storage().report)
+
+@app.on_event("shutdown")
+async def close_sources():
+    # Work cancelled from here on stays "running" in the job store and is recovered on restart
+    app.shutting_down = True
+    for task in getattr(app, "recovery_tasks", []):
+        task.cancel()
+    if getattr(app, "sources", None) is not None:
+        await app.sources.close()
+    if getattr(app, "output_store", None) is not None:
+        app.output_store.shutdown()
+
+async def run_until_disconnect(http_request: Request, coro, poll_interval: float = 0.5):
+    """Await coro, cancelling it if the HTTP client goes away first"""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client disconnected")
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+
+def get_search() -> FederatedSearch:
+    """Federated search over the local catalog of the current worker and all sources"""
+    manager = app.comfy_ui.model_manager
+    search = getattr(app, "federated_search", None)
+    if search is None or search.index.manager is not manager:
+        search = app.federated_search = FederatedSearch(manager, get_sources())
+    return search
+
+def _search_sources(source: str):
+    if source == "all":
+        return SOURCES
+    if source == "local":
+        return ()
+    if source in SOURCES:
+        return (source,)
+    raise HTTPException(status_code=400, detail="Invalid source")
+
 @app.post("/api/models/search")
 async def search_models(request: ModelSearchRequest):
-    """Search for models from various sources"""
+    """Search the local catalog and upstream sources; local models come first"""
+    sources = _search_sources(request.source)
     try:
-        if request.source == "civitai":
-            models = app.comfy_ui.search_civitai(
-                request.query,
-                request.model_type,
-                limit=request.limit
-            )
-        elif request.source == "huggingface":
-            models = app.comfy_ui.search_huggingface(
+        models = await get_search().search(
+            request.query,
+            sources,
+            request.model_type or None,
+            request.flux_only,
+            request.limit
+        )
+        return {"models": models}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/models/search/stream")
+async def stream_search_models(request: ModelSearchRequest):
+    """Stream search results as NDJSON: local hits first, then merged upstream hits as they arrive"""
+    sources = _search_sources(request.source)
+    search = get_search()
+
+    async def events():
+        try:
+            async for event in search.stream(
                 request.query,
-                ModelType(request.model_type) if request.model_type else None,
+                sources,
+                request.model_type or None,
                 request.flux_only,
                 request.limit
+            ):
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            # Headers are already sent, so report the upstream failure in-band
+            yield json.dumps({"event": "error", "detail": str(e)}) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+def get_job_store() -> JobStore:
+    if getattr(app, "job_store", None) is None:
+        app.job_store = JobStore(os.getenv("FLUX_JOB_DB", "jobs.db"))
+    if app.job_store.on_change is None:
+        app.job_store.on_change = publish_job
+    return app.job_store
+
+_ACTIVE_STATUSES = {status.value for status in UNFINISHED}
+
+def publish_job(job_id: str, changes: Dict):
+    """Mirror unfinished jobs (including download offsets) into the live status"""
+    status = changes.get("status")
+    if status is not None and status not in _ACTIVE_STATUSES:
+        HUB.update({"jobs": {job_id: None}})
+        return
+    HUB.update({"jobs": {job_id: changes}})
+
+def shutting_down() -> bool:
+    return getattr(app, "shutting_down", False)
+
+async def run_download_job(source: str, model_data: Dict, job_id: Optional[str] = None) -> Dict:
+    """Download and register a model as a recorded, resumable job"""
+    inputs = {"source": source, "model_data": model_data}
+    jobs = get_job_store()
+    manager = app.comfy_ui.model_manager
+    # A re-run after a crash may find the model already registered by the first attempt
+    previous = jobs.get(job_id) if job_id else None
+    recorded = previous.progress if previous else {}
+    if job_id is None:
+        # Refuse before downloading: the file would land on top of the existing model's
+        existing = get_sources().catalog_name(source, model_data)
+        if manager.get_model(existing) is not None:
+            raise HTTPException(status_code=409, detail=f"Model {existing} already exists")
+    with jobs.track("download", inputs, job_id, shutting_down=shutting_down) as job:
+        name, path = recorded.get("model_name"), recorded.get("path")
+        if name is None or manager.get_model(name) is None:
+            name, path, model_type, metadata = await get_sources().download(
+                source,
+                dict(model_data),
+                on_progress=lambda written, total: job.progress(offset=written, total=total),
+                # Only a recovered job continues its own partial file; a new one never adopts a stale .part
+                resume=job_id is not None
             )
-        else:
-            raise HTTPException(status_code=400, detail="Invalid source")
-        
-        return {"models": models}
+            job.progress(force=True, model_name=name, path=path)
+            if job_id is None or manager.get_model(name) is None:
+                app.comfy_ui.add_model(
+                    name=name,
+                    model_type=model_type,
+                    source=source,
+                    file_path=path,
+                    metadata=metadata
+                )
+                await persist_model(name)
+        job.outputs = {"model_name": name, "path": path}
+    return {"status": "success", "model_name": name, "job_id": job.id}
+
+@app.post("/api/models/download")
+async def download_model(model_data: Dict, http_request: Request):
+    """Download a model from the specified source and register it"""
+    source = model_data.pop("source", None)
+    if source not in SOURCES:
+        raise HTTPException(status_code=400, detail="Invalid source")
+
+    try:
+        return await run_until_disconnect(http_request, run_download_job(source, model_data))
+    except HTTPException:
+        raise
+    except InsufficientStorageError as e:
+        raise HTTPException(status_code=507, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/models/download")
-async def download_model(model_data: Dict):
-    """Download a model from the specified source"""
-    try:
-        source = model_data.pop("source")
-        if source == "civitai":
-            model_name = app.comfy_ui.download_civitai_model(model_data)
-        elif source == "huggingface":
-            model_name = app.comfy_ui.download_huggingface_model(model_data)
-        else:
-            raise HTTPException(status_code=400, detail="Invalid source")
-        
-        return {"status": "success", "model_name": model_name}
+def get_baker() -> "LoraBaker":
+    if getattr(app, "baker", None) is None:
+        from lora_bake import LoraBaker
+        app.baker = LoraBaker(app.comfy_ui.model_manager, reserve=get_storage().reserve)
+    return app.baker
+
+async def run_bake_job(request: BakeRequest, job_id: Optional[str] = None) -> Dict:
+    """Merge LoRAs into a checkpoint as a recorded job; cached combinations return at once"""
+    with get_job_store().track("bake", request.dict(), job_id, shutting_down=shutting_down) as job:
+        async with using_models([request.checkpoint, *request.loras]):
+            result = await asyncio.to_thread(get_baker().bake, request.checkpoint, request.loras, request.name)
+        if not result.cached:
+            await persist_model(result.model.name)
+        job.outputs = {"model_name": result.model.name, "cached": result.cached}
+    return {
+        "status": "success",
+        "model_name": result.model.name,
+        "cached": result.cached,
+        "patched": result.patched,
+        "unmatched": {lora: len(modules) for lora, modules in result.unmatched.items()},
+        "job_id": job.id
+    }
+
+@app.post("/api/models/bake")
+async def bake_model(request: BakeRequest):
+    """Bake LoRAs into a checkpoint so the combination loads as a single file"""
+    try:
+        return await run_bake_job(request)
+    except HTTPException:
+        raise
+    except InsufficientStorageError as e:
+        raise HTTPException(status_code=507, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def get_variants() -> "VariantManager":
+    if getattr(app, "variants", None) is None:
+        from model_variants import VariantManager
+        app.variants = VariantManager(app.comfy_ui.model_manager, reserve=get_storage().reserve)
+    return app.variants
+
+def load_precisions() -> Tuple[str, ...]:
+    """Variant precisions generation may substitute, in order; FLUX_LOAD_PRECISION=original disables"""
+    from model_variants import PRECISIONS
+    value = os.getenv("FLUX_LOAD_PRECISION", ",".join(p.lower() for p in PRECISIONS))
+    return tuple(p.strip().upper() for p in value.split(",") if p.strip().upper() in PRECISIONS)
+
+def load_sharded() -> bool:
+    """FLUX_LOAD_SHARDED=1 when ComfyUI's loader reads .safetensors.index.json shard sets"""
+    return os.getenv("FLUX_LOAD_SHARDED", "0").lower() in ("1", "true", "yes")
+
+def select_model(name: str) -> str:
+    """The catalog model ComfyUI should load for a request for name"""
+    if getattr(getattr(app, "comfy_ui", None), "model_manager", None) is None:
+        return name
+    precisions, sharded_ok = load_precisions(), load_sharded()
+    if not precisions and not sharded_ok:
+        return name
+    return get_variants().select(name, precisions, sharded_ok=sharded_ok)
+
+async def run_convert_job(request: ConvertRequest, job_id: Optional[str] = None) -> Dict:
+    """Create an fp16/bf16 and/or sharded variant of a model as a recorded job"""
+    from model_variants import parse_precision, parse_size
+    precision = parse_precision(request.precision)
+    shard_bytes = parse_size(request.shard_size) if request.shard_size else None
+    with get_job_store().track("convert", request.dict(), job_id, shutting_down=shutting_down) as job:
+        async with using_models([request.model]):
+            variant = await asyncio.to_thread(get_variants().convert, request.model, precision, shard_bytes)
+        await persist_model(variant.name)
+        job.outputs = {"model_name": variant.name}
+    return {"status": "success", "model_name": variant.name, "job_id": job.id}
+
+@app.post("/api/models/convert")
+async def convert_model(request: ConvertRequest):
+    """Create a reduced-precision or resharded alternate that generation loads instead"""
+    try:
+        return await run_convert_job(request)
+    except HTTPException:
+        raise
+    except InsufficientStorageError as e:
+        raise HTTPException(status_code=507, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def import_roots() -> List[str]:
+    """Folders the import API may scan: the catalog, ComfyUI/models and FLUX_IMPORT_ROOTS"""
+    roots = [str(app.comfy_ui.model_manager.base_path), os.path.join("ComfyUI", "models")]
+    roots.extend(root for root in os.getenv("FLUX_IMPORT_ROOTS", "").split(os.pathsep) if root)
+    return roots
+
+def _import_paths(paths: Optional[List[str]]) -> List[str]:
+    roots = import_roots()
+    if not paths:
+        return [root for root in roots if os.path.exists(root)]
+    allowed = [os.path.realpath(root) for root in roots]
+    for path in paths:
+        real = os.path.realpath(path)
+        if not any(os.path.commonpath([real, root]) == root for root in allowed):
+            raise ValueError(f"{path} is outside the import roots")
+        if not os.path.exists(real):
+            raise ValueError(f"{path} does not exist")
+    return list(paths)
+
+async def run_import_job(request: ImportRequest, job_id: Optional[str] = None) -> Dict:
+    """Register model files already on disk as a recorded job; re-runs skip unchanged files"""
+    from model_import import BulkImporter
+    paths = _import_paths(request.paths)
+    with get_job_store().track("import", request.dict(), job_id, shutting_down=shutting_down) as job:
+        importer = BulkImporter(app.comfy_ui.model_manager, hash_files=request.hash_files, move=request.move)
+        result = await asyncio.to_thread(importer.run, paths)
+        for name in result.added:
+            await persist_model(name)
+        job.outputs = {"added": len(result.added), "updated": len(result.updated), "failed": len(result.failed)}
+    return {"status": "success", "job_id": job.id, **result.to_dict()}
+
+@app.post("/api/models/import")
+async def import_models(request: ImportRequest):
+    """Bulk-register existing model files (e.g. ComfyUI/models or a Drive restore) in the catalog"""
+    try:
+        return await run_import_job(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def get_conditioning_cache() -> Optional["ConditioningCache"]:
+    """The prompt-conditioning cache, if FLUX_TEXT_ENCODER configures one"""
+    if getattr(app, "conditioning_cache", None) is None and os.getenv("FLUX_TEXT_ENCODER"):
+        from conditioning_cache import cache_from_env
+        app.conditioning_cache = cache_from_env()
+    return getattr(app, "conditioning_cache", None)
+
+@app.get("/api/conditioning")
+async def conditioning_report():
+    cache = get_conditioning_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.report()}
+
+@app.get("/api/conditioning/{key}")
+async def get_conditioning(key: str):
+    """A cached text-encoder output as a .npy (fp16) array"""
+    cache = get_conditioning_cache()
+    array = cache.lookup(key) if cache is not None else None
+    if array is None:
+        raise HTTPException(status_code=404, detail="Conditioning not cached")
+    import numpy as np
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return Response(buffer.getvalue(), media_type="application/octet-stream")
+
+async def run_generation(request: GenerationRequest) -> Dict:
+    """Submit one generation to ComfyUI and return its raw JSON result"""
+    # ComfyUI API endpoint
+    api_url = f"{app.comfy_ui.url}/api/predict"
+
+    # Prepare workflow
+    workflow = {
+        "prompt": request.prompt,
+        "negative_prompt": request.negative_prompt,
+        "model": select_model(request.model_name),
+        "steps": request.steps,
+        "cfg_scale": request.cfg_scale,
+        "width": request.width,
+        "height": request.height,
+        "seed": request.seed
+    }
+    if request.loras:
+        workflow["loras"] = request.loras
+
+    # Text-encoder outputs are looked up (or encoded once) here; ComfyUI
+    # fetches them by key from /api/conditioning instead of re-encoding
+    cache = get_conditioning_cache()
+    if cache is not None:
+        with TRACER.span("conditioning.lookup"):
+            prompt_key, negative_key = await asyncio.to_thread(cache.ensure, [request.prompt, request.negative_prompt])
+        workflow["conditioning"] = {
+            "encoder": cache.encoder.model_hash,
+            "prompt": prompt_key,
+            "negative_prompt": negative_key
+        }
+
+    manager = app.comfy_ui.model_manager
+    manager.record_use(request.model_name)
+    for lora in request.loras:
+        manager.record_use(lora)
+
+    async with using_models([workflow["model"], *request.loras]):
+        start = time.perf_counter()
+        status = "error"
+        app.active_generations = getattr(app, "active_generations", 0) + 1
+        HUB.update({"queue": {"active_generations": app.active_generations}})
+        try:
+            with TRACER.span("comfyui.generate", model=request.model_name, steps=request.steps):
+                import aiohttp
+                session = get_sources().session.get()
+                # Renders can outlast the session's read timeout
+                async with session.post(api_url, json=workflow, timeout=aiohttp.ClientTimeout(total=None)) as response:
+                    if response.status != 200:
+                        raise HTTPException(
+                            status_code=response.status,
+                            detail="ComfyUI generation failed"
+                        )
+                    result = await response.json()
+                    status = "ok"
+                    # The batch scheduler starts with whatever ComfyUI has loaded
+                    app.resident_model = request.model_name
+                    HUB.update({"models": {"resident": request.model_name}})
+                    return result
+        finally:
+            app.active_generations -= 1
+            HUB.update({"queue": {"active_generations": app.active_generations}})
+            app.last_activity = time.monotonic()
+            GENERATION_DURATION.observe(
+                time.perf_counter() - start,
+                model=request.model_name,
+                status=status
+            )
+
+def get_output_store() -> OutputStore:
+    if getattr(app, "output_store", None) is None:
+        app.output_store = OutputStore(
+            os.getenv("FLUX_OUTPUT_DIR", "outputs"),
+            retention_days=float(os.getenv("FLUX_OUTPUT_RETENTION_DAYS", "7")),
+            max_bytes=int(os.getenv("FLUX_OUTPUT_MAX_BYTES", "0")) or None
+        )
+    return app.output_store
+
+def output_ref(record: OutputRecord) -> Dict:
+    return {
+        "digest": record.digest,
+        "url": f"/api/outputs/{record.digest}",
+        "thumbnail_url": f"/api/outputs/{record.digest}?size=thumb",
+        "content_type": record.content_type,
+        "size": record.size
+    }
+
+async def _fetch_comfy_image(ref: Dict) -> bytes:
+    """Fetch an image ComfyUI wrote to its output folder"""
+    params = {k: ref[k] for k in ("filename", "subfolder", "type") if ref.get(k) is not None}
+    async with get_sources().session.get().get(f"{app.comfy_ui.url}/view", params=params) as response:
+        response.raise_for_status()
+        return await response.read()
+
+async def store_outputs(result: Dict):
+    """Move images out of a ComfyUI result into the output store, yielding each stored record.
+
+    Inline base64 images (``image`` / ``images``) and ComfyUI file references
+    ({"filename", "subfolder", "type"}) are both accepted. The result is
+    rewritten in place to reference the store instead of carrying the bytes.
+    """
+    store = get_output_store()
+    payloads = []
+    if "image" in result:
+        payloads.append(result.pop("image"))
+    payloads.extend(result.pop("images", None) or [])
+
+    refs = []
+    for payload in payloads:
+        if isinstance(payload, dict) and payload.get("filename"):
+            data = await _fetch_comfy_image(payload)
+        else:
+            data = decode_image_payload(payload)
+        if data is None:
+            continue
+        record = await asyncio.to_thread(store.put_bytes, data)
+        refs.append(output_ref(record))
+        yield record
+
+    result["images"] = refs
+    if refs:
+        result["image"] = refs[0]["url"]
+
+def _job_outputs(result: Dict) -> Dict:
+    return {k: result.get(k) for k in ("prompt_id", "seed", "images")}
+
+async def run_generation_job(request: GenerationRequest, job_id: Optional[str] = None, parent_id: Optional[str] = None) -> Dict:
+    """Run one generation as a recorded job and store its outputs"""
+    inputs = request.dict()
+    with get_job_store().track("generation", inputs, job_id, parent_id, shutting_down=shutting_down) as job:
+        result = await run_generation(request)
+        store = get_output_store()
+        async for record in store_outputs(result):
+            store.schedule_variants(record)
+        job.outputs = _job_outputs(result)
+    result["job_id"] = job.id
+    return result
+
 @app.post("/api/generate")
 async def generate_image(request: GenerationRequest):
     """Generate an image using ComfyUI"""
     try:
-        # ComfyUI API endpoint
-        api_url = f"{app.comfy_ui.url}/api/predict"
-        
-        # Prepare workflow
-        workflow = {
-            "prompt": request.prompt,
-            "negative_prompt": request.negative_prompt,
-            "model": request.model_name,
-            "steps": request.steps,
-            "cfg_scale": request.cfg_scale,
-            "width": request.width,
-            "height": request.height,
-            "seed": request.seed
-        }
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.post(api_url, json=workflow) as response:
-                if response.status != 200:
-                    raise HTTPException(
-                        status_code=response.status,
-                        detail="ComfyUI generation failed"
-                    )
-                result = await response.json()
-                return result
+        return await run_generation_job(request)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/upload/lora")
-async def upload_lora(file: UploadFile = File(...)):
-    """Upload a custom LoRA file"""
+@app.post("/api/generate/stream")
+async def generate_image_stream(request: GenerationRequest):
+    """Generate and stream NDJSON events: each image as soon as it is stored, then its variants"""
+
+    async def events():
+        jobs = get_job_store()
+        job_id = jobs.submit("generation", request.dict())
+        yield json.dumps({"event": "submitted", "model": request.model_name, "job_id": job_id}) + "\n"
+        try:
+            with jobs.track("generation", {}, job_id, shutting_down=shutting_down) as job:
+                result = await run_generation(request)
+                store = get_output_store()
+                pending = []
+                index = 0
+                async for record in store_outputs(result):
+                    yield json.dumps({"event": "image", "index": index, **output_ref(record)}) + "\n"
+                    pending.append((record, asyncio.wrap_future(store.schedule_variants(record))))
+                    index += 1
+                job.outputs = _job_outputs(result)
+            for record, future in pending:
+                try:
+                    variants = await future
+                    yield json.dumps({"event": "variants", "digest": record.digest, "variants": sorted(variants)}) + "\n"
+                except Exception as e:
+                    yield json.dumps({"event": "variants_failed", "digest": record.digest, "error": str(e)}) + "\n"
+            yield json.dumps({"event": "done", "job_id": job_id, **result}) + "\n"
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            yield json.dumps({"event": "error", "detail": detail}) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@contextmanager
+def _queued_batch(batch_id: str):
+    """Show a batch's remaining items in the live queue status while it runs"""
+    try:
+        yield
+    finally:
+        HUB.update({"queue": {"batches": {batch_id: None}}})
+
+def max_batch_concurrency() -> int:
+    """Upper bound on one batch's jobs in flight, so a single request can't flood ComfyUI"""
+    return int(os.getenv("FLUX_BATCH_MAX_CONCURRENCY", "8"))
+
+async def batch_events(request: BatchGenerationRequest, batch_id: Optional[str] = None, skip: Optional[set] = None):
+    """Run a batch as a recorded job; each item is recorded as a child generation job"""
+    jobs = get_job_store()
+    batch_id = batch_id or jobs.submit("batch", request.dict())
+
+    async def run_item(item: BatchItem) -> Dict:
+        inputs = dict(item.params, batch_index=item.index)
+        with jobs.track("generation", inputs, parent_id=batch_id, shutting_down=shutting_down) as job:
+            result = await run_generation(GenerationRequest(**item.params))
+            store = get_output_store()
+            async for record in store_outputs(result):
+                store.schedule_variants(record)
+            job.outputs = _job_outputs(result)
+        result["job_id"] = job.id
+        return result
+
+    cache = get_conditioning_cache()
+    if cache is not None:
+        # Encode every distinct prompt of the batch up front, in as few encoder calls as possible
+        await asyncio.to_thread(cache.ensure, list(dict.fromkeys([*request.prompts, request.negative_prompt])))
+
+    runner = BatchRunner(run_item, concurrency=min(request.concurrency, max_batch_concurrency()))
+    with jobs.track("batch", {}, batch_id, shutting_down=shutting_down) as batch, _queued_batch(batch_id):
+        async for event in runner.run(request.to_spec(), getattr(app, "resident_model", None), batch_id, skip):
+            # Only counts are stored; finished indices are read back from the item jobs on recovery
+            if event["event"] == "progress":
+                batch.progress(completed=event["completed"], failed=event["failed"], total=event["total"])
+                HUB.update({"queue": {"batches": {batch_id: event["total"] - event["completed"] - event["failed"]}}})
+            elif event["event"] == "done":
+                batch.progress(force=True, completed=event["completed"], failed=event["failed"], total=event["total"])
+                batch.outputs = {k: event[k] for k in ("completed", "failed", "total")}
+            yield event
+
+@app.post("/api/generate/batch")
+async def generate_batch(request: BatchGenerationRequest):
+    """Expand a prompt matrix / parameter grid and stream per-item results and progress as NDJSON"""
+    spec = request.to_spec()
+    total = spec.total()
+    max_items = int(os.getenv("FLUX_BATCH_MAX_ITEMS", "100000"))
+    if total == 0:
+        raise HTTPException(status_code=400, detail="Batch expands to no jobs")
+    if total > max_items:
+        raise HTTPException(status_code=400, detail=f"Batch expands to {total} jobs (limit {max_items})")
+    if not 1 <= request.concurrency <= max_batch_concurrency():
+        raise HTTPException(status_code=400, detail=f"concurrency must be between 1 and {max_batch_concurrency()}")
+
+    async def events():
+        async for event in batch_events(request):
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@app.get("/api/jobs")
+async def list_jobs(kind: Optional[str] = None, status: Optional[str] = None, parent_id: Optional[str] = None, limit: int = 100, before: Optional[float] = None):
+    """Job history, newest first; page with ?before=<created_at of the last job>"""
     try:
-        # Save uploaded file
-        file_path = os.path.join("uploads", file.filename)
-        os.makedirs("uploads", exist_ok=True)
-        
+        status_filter = JobStatus(status) if status else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid status")
+    jobs = get_job_store().list(kind, status_filter, parent_id, min(limit, 1000), before)
+    return {"jobs": [job.to_dict() for job in jobs]}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = get_job_store().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+def comfyui_ready(state: Dict) -> bool:
+    return state["components"].get("comfyui", {}).get("status") == "ready"
+
+async def wait_for_comfyui(timeout: float = 600.0, interval: float = 2.0) -> bool:
+    """Wait until ComfyUI answers, so recovered generations don't fail on a cold start.
+
+    A host in this process publishes ComfyUI's lifecycle to the status hub, so
+    this just waits for it to report ready; otherwise ComfyUI is polled.
+    """
+    if HUB.get("components", "comfyui") is not None:
+        return await HUB.wait_for_async(comfyui_ready, timeout)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with get_sources().session.get().get(f"{app.comfy_ui.url}/system_stats") as response:
+                if response.status == 200:
+                    return True
+        except Exception:
+            pass
+        await asyncio.sleep(interval)
+    return False
+
+async def _recover_job(job):
+    try:
+        if job.kind == "download":
+            await run_download_job(job.inputs["source"], job.inputs["model_data"], job.id)
+        elif job.kind == "convert":
+            await run_convert_job(ConvertRequest(**job.inputs), job.id)
+        elif job.kind == "bake":
+            await run_bake_job(BakeRequest(**job.inputs), job.id)
+        elif job.kind == "import":
+            await run_import_job(ImportRequest(**job.inputs), job.id)
+        elif job.kind == "generation":
+            await wait_for_comfyui()
+            await run_generation_job(GenerationRequest(**job.inputs), job.id)
+        elif job.kind == "batch":
+            await wait_for_comfyui()
+            items = get_job_store().children(job.id, JobStatus.COMPLETED)
+            skip = {item.inputs["batch_index"] for item in items if "batch_index" in item.inputs}
+            async for _ in batch_events(BatchGenerationRequest(**job.inputs), job.id, skip):
+                pass
+    except Exception as e:
+        print(f"Recovered job {job.id} ({job.kind}) failed: {e}")
+
+@app.on_event("startup")
+async def recover_jobs():
+    """Re-enqueue generations, downloads, bakes, conversions, imports and batches interrupted by a restart"""
+    jobs = get_job_store()
+    recovered = jobs.recover()
+    app.recovery_tasks = []
+    for job in recovered:
+        if job.parent_id:
+            # Batch items are re-run by their batch, which skips finished indices
+            jobs.fail(job.id, "Interrupted by restart; re-run by its batch")
+            continue
+        app.recovery_tasks.append(asyncio.create_task(_recover_job(job)))
+    if app.recovery_tasks:
+        print(f"Recovering {len(app.recovery_tasks)} interrupted job(s)")
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single 'bytes=start-end' range; None means serve the whole file"""
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", (header or "").strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    if match.group(1) == "":
+        length = int(match.group(2))
+        return max(0, size - length), size - 1
+    start = int(match.group(1))
+    end = int(match.group(2)) if match.group(2) else size - 1
+    return start, min(end, size - 1)
+
+def _iter_file(path: str, start: int, length: int, chunk_size: int = 256 * 1024):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+@app.get("/api/outputs/{digest}")
+async def get_output(digest: str, http_request: Request, size: str = "full"):
+    """Serve a stored output with format negotiation, range requests and immutable caching"""
+    if size not in ("full", "thumb"):
+        raise HTTPException(status_code=400, detail="Invalid size")
+    found = get_output_store().negotiate(digest, http_request.headers.get("accept", ""), size)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Output not found")
+    path, content_type = found
+
+    etag = f'"{digest}-{path.name}"'
+    headers = {
+        "ETag": etag,
+        # Content-addressed, so a given URL + format never changes
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Vary": "Accept",
+        "Accept-Ranges": "bytes"
+    }
+    if etag in http_request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    file_size = path.stat().st_size
+    byte_range = _parse_range(http_request.headers.get("range"), file_size)
+    if byte_range is None:
+        headers["Content-Length"] = str(file_size)
+        return StreamingResponse(_iter_file(str(path), 0, file_size), media_type=content_type, headers=headers)
+
+    start, end = byte_range
+    if start >= file_size or start > end:
+        headers["Content-Range"] = f"bytes */{file_size}"
+        return Response(status_code=416, headers=headers)
+    headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        _iter_file(str(path), start, end - start + 1),
+        status_code=206,
+        media_type=content_type,
+        headers=headers
+    )
+
+def require_peer(request: Request) -> PeerNode:
+    """Peer routes need FLUX_PEER_TOKEN, shared by all instances; without one they don't exist"""
+    peers = get_peers()
+    _require_token(request, os.getenv("FLUX_PEER_TOKEN") if peers is not None else None, "x-peer-token", "peer")
+    return peers
+
+@app.get("/api/peers/manifest")
+async def peer_manifest(http_request: Request):
+    """Content hashes of the model files this instance can serve to its peers"""
+    return require_peer(http_request).manifest()
+
+@app.get("/api/peers/files/{sha256}")
+async def peer_file(sha256: str, http_request: Request):
+    """Size, chunk size and per-chunk sha256 of one advertised file"""
+    entry = require_peer(http_request).entry(sha256)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    return {k: entry[k] for k in ("sha256", "size", "chunk_size", "chunks")}
+
+@app.get("/api/peers/files/{sha256}/data")
+async def peer_file_data(sha256: str, http_request: Request):
+    """Ranged reads of one advertised file"""
+    entry = require_peer(http_request).entry(sha256)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    file_size = entry["size"]
+    headers = {"Accept-Ranges": "bytes", "ETag": f'"{sha256}"'}
+    byte_range = _parse_range(http_request.headers.get("range"), file_size)
+    start, end = byte_range if byte_range is not None else (0, file_size - 1)
+    if byte_range is not None and (start >= file_size or start > end):
+        headers["Content-Range"] = f"bytes */{file_size}"
+        return Response(status_code=416, headers=headers)
+    length = end - start + 1
+    headers["Content-Length"] = str(length)
+    if byte_range is not None:
+        headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+    PEER_BYTES.inc(length, direction="sent")
+    return StreamingResponse(
+        _iter_file(entry["path"], start, length, chunk_size=1024 * 1024),
+        status_code=206 if byte_range is not None else 200,
+        media_type="application/octet-stream",
+        headers=headers
+    )
+
+@app.on_event("startup")
+async def start_output_retention():
+    """Apply the output retention policy periodically"""
+    interval = float(os.getenv("FLUX_OUTPUT_CLEANUP_INTERVAL", "3600"))
+
+    async def loop():
+        while True:
+            try:
+                await asyncio.to_thread(get_output_store().cleanup)
+            except Exception as e:
+                print(f"Output cleanup failed: {e}")
+            await asyncio.sleep(interval)
+
+    app.output_cleanup_task = asyncio.create_task(loop())
+
+def is_idle() -> bool:
+    idle_after = float(os.getenv("FLUX_PREFETCH_IDLE_SECONDS", "60"))
+    return (
+        getattr(app, "active_generations", 0) == 0
+        and time.monotonic() - getattr(app, "last_activity", 0.0) >= idle_after
+    )
+
+@app.on_event("startup")
+async def start_prefetcher():
+    """Re-warm popular models and persist usage counts while the app is idle"""
+    manager = getattr(getattr(app, "comfy_ui", None), "model_manager", None)
+    if manager is None:
+        return
+    prefetcher = prefetcher_from_env(manager, getattr(app.comfy_ui, "restore_model", None), select_model)
+    interval = float(os.getenv("FLUX_PREFETCH_INTERVAL", "300"))
+    app.prefetch_task = asyncio.create_task(prefetcher.run_idle(is_idle, interval))
+
+@app.on_event("shutdown")
+async def flush_usage():
+    if getattr(app, "prefetch_task", None) is not None:
+        app.prefetch_task.cancel()
+    manager = getattr(getattr(app, "comfy_ui", None), "model_manager", None)
+    if manager is not None:
+        manager.flush_usage()
+    persist_index = getattr(getattr(app, "comfy_ui", None), "persist_index", None)
+    if persist_index is not None:
+        await asyncio.to_thread(persist_index)
+
+async def save_upload(file: UploadFile, model_type: ModelType, source: str = "custom") -> str:
+    """Store an uploaded model file in the catalog and persist it if the host can"""
+    file_path = os.path.join("uploads", os.path.basename(file.filename))
+    os.makedirs("uploads", exist_ok=True)
+
+    size = file.size
+    if size is None:
+        file.file.seek(0, os.SEEK_END)
+        size = file.file.tell()
+        file.file.seek(0)
+
+    with await reserve_storage(file_path, size):
         with open(file_path, "wb") as f:
             content = await file.read()
             f.write(content)
-        
-        # Add to model manager
-        model_name = app.comfy_ui.add_model(
-            name=os.path.splitext(file.filename)[0],
-            model_type=ModelType.LORA,
-            source="custom",
-            file_path=file_path
-        )
-        
+
+    name = os.path.splitext(os.path.basename(file.filename))[0]
+    app.comfy_ui.add_model(
+        name=name,
+        model_type=model_type,
+        source=source,
+        file_path=file_path
+    )
+    await persist_model(name)
+    return name
+
+@app.post("/api/upload")
+async def upload_model(model: UploadFile = File(...), type: str = Form(...)):
+    """Upload a model of any type; accepts type names or ComfyUI folder names"""
+    try:
+        model_type = parse_model_type(type)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid model type")
+    if not model.filename:
+        raise HTTPException(status_code=400, detail="No model file selected")
+    try:
+        name = await save_upload(model, model_type)
+        return {"status": "success", "model_name": name, "message": f"{model_type.value} model uploaded successfully"}
+    except InsufficientStorageError as e:
+        raise HTTPException(status_code=507, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/upload/lora")
+async def upload_lora(file: UploadFile = File(...)):
+    """Upload a custom LoRA file"""
+    try:
+        model_name = await save_upload(file, ModelType.LORA)
         return {"status": "success", "model_name": model_name}
+    except InsufficientStorageError as e:
+        raise HTTPException(status_code=507, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/")
+async def index():
+    return FileResponse(os.path.join(STATIC_DIR, "index.html"))
+
+@app.get("/manage")
+async def manage():
+    """Model upload and inventory page"""
+    return FileResponse(os.path.join(TEMPLATES_DIR, "index.html"))
+
+def serve(comfy_ui, port: int = 7860, host: str = "0.0.0.0", background: bool = False, timeout: float = 30.0):
+    """Serve this app for a host object (see catalog.CatalogHost).
+
+    With background=True the server runs in a daemon thread and this returns
+    once it is listening; otherwise it blocks.
+    """
+    import threading
+    import uvicorn
+
+    app.comfy_ui = comfy_ui
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="info"))
+    if not background:
+        server.run()
+        return server
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.monotonic() + timeout
+    while not server.started and time.monotonic() < deadline:
+        time.sleep(0.05)
+    STARTUP.mark("web_listening")
+    return server